@@ -0,0 +1,266 @@
+"""
+Agent エンドポイントの受付制御（ユーザー別レート制限 + 同時実行数の上限）
+
+chat_stream は1件あたり最大900秒 Agent を実行し続けるため、1ユーザーの連打や
+インスタンス全体の同時実行数に上限が無いと、ワーカーと Snowflake ウェアハウスを
+使い切ってしまう。ここではユーザー（user_id、無ければクライアントIP）ごとの
+トークンバケットと、Agent を呼ぶ全エンドポイントで共有する同時実行数の上限を持つ。
+
+- トークンバケットが空なら待たずに拒否（Retry-After は次のトークンが溜まるまでの秒数）
+- 同時実行数が上限なら、待ち行列（上限あり）に入って空きを待つ
+- 待ち行列が満杯、または待ち時間の上限を超えたら拒否
+
+拒否は AdmissionRejected で通知し、呼び出し側で 429 + Retry-After に変換する。
+
+設定（環境変数）:
+    AGENT_ADMISSION_ENABLED: 受付制御を行う（既定: true）
+    AGENT_MAX_CONCURRENCY: インスタンス全体の Agent 同時実行数（既定: 16）
+    AGENT_QUEUE_SIZE: 空きを待てるリクエスト数（既定: 32、0で待たずに拒否）
+    AGENT_QUEUE_TIMEOUT_SEC: 空きを待つ最大秒数（既定: 10）
+    AGENT_RATE_PER_MIN: ユーザーごとの1分あたりのリクエスト数（既定: 20、0で無制限）
+    AGENT_RATE_BURST: ユーザーごとに連続して受け付ける件数（既定: 5）
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+# 保持するユーザー別バケット数（LRU。溢れた古いバケットは満タン扱いで作り直す）
+MAX_BUCKETS = 10000
+# Retry-After の上限秒数
+MAX_RETRY_AFTER_SEC = 60
+
+
+class AdmissionRejected(Exception):
+    """
+    受付拒否
+
+    Attributes:
+        reason: "rate_limited"（ユーザー別レート制限）/ "overloaded"（同時実行数の上限）
+        retry_after: 再試行までの推奨秒数（Retry-After ヘッダ用の整数）
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, min(MAX_RETRY_AFTER_SEC, math.ceil(retry_after)))
+        super().__init__(f"{reason} (retry after {self.retry_after}s)")
+
+
+class TokenBucket:
+    """
+    トークンバケット（rate_per_sec で補充、最大 burst 個）
+
+    スレッドセーフではないため、呼び出し側でロックする。
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        トークンを1つ取る
+
+        Returns:
+            (取れたか, 取れなかった場合に次のトークンが溜まるまでの秒数)
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+
+class AdmissionSlot:
+    """
+    受付済みの実行枠（async with で使う。release は何度呼んでもよい）
+    """
+
+    __slots__ = ("_controller", "_acquired_at", "_released", "waited_sec")
+
+    def __init__(self, controller: "AdmissionController", waited_sec: float):
+        self._controller = controller
+        self._acquired_at = time.monotonic()
+        self._released = False
+        self.waited_sec = waited_sec
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._acquired_at)
+
+    async def __aenter__(self) -> "AdmissionSlot":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """
+    ユーザー別トークンバケット + 同時実行数の上限（待ち行列つき）
+
+    Args:
+        max_concurrency: 同時に実行できるリクエスト数
+        queue_size: 空きを待てるリクエスト数（0 なら待たずに拒否）
+        queue_timeout_sec: 空きを待つ最大秒数
+        rate_per_min: ユーザーごとの1分あたりのリクエスト数（0 以下で無制限）
+        burst: ユーザーごとに連続して受け付ける件数
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        queue_size: int = 32,
+        queue_timeout_sec: float = 10.0,
+        rate_per_min: float = 20.0,
+        burst: int = 5,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout_sec = queue_timeout_sec
+        self.rate_per_sec = rate_per_min / 60.0
+        self.burst = burst
+
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._active = 0
+        # 空き待ちの Future（FIFO）。取得したループ上で set_result する
+        self._waiters: Deque[asyncio.Future] = deque()
+        # 実行時間の移動平均（過負荷時の Retry-After の見積もりに使う）
+        self._avg_hold_sec = 5.0
+        self.stats_counters: Dict[str, int] = {"admitted": 0, "queued": 0, "rate_limited": 0, "overloaded": 0}
+
+    def _take_token(self, key: str) -> None:
+        if self.rate_per_sec <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_sec, self.burst)
+                self._buckets[key] = bucket
+                while len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            ok, wait = bucket.take()
+            if not ok:
+                self.stats_counters["rate_limited"] += 1
+                raise AdmissionRejected("rate_limited", wait)
+
+    def _overloaded(self) -> AdmissionRejected:
+        self.stats_counters["overloaded"] += 1
+        queued = len(self._waiters) + 1
+        return AdmissionRejected("overloaded", self._avg_hold_sec * queued / self.max_concurrency)
+
+    async def acquire(self, key: str) -> AdmissionSlot:
+        """
+        実行枠を取得する（空きが無ければ待ち行列で待つ）
+
+        Args:
+            key: レート制限のキー（user_id など）
+
+        Raises:
+            AdmissionRejected: レート制限超過、待ち行列が満杯、または待ち時間切れ
+        """
+        self._take_token(key)
+
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                self.stats_counters["admitted"] += 1
+                return AdmissionSlot(self, 0.0)
+            if len(self._waiters) >= self.queue_size:
+                raise self._overloaded()
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self.stats_counters["queued"] += 1
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout_sec)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # 枠を渡された直後に諦めた場合は、その枠を次へ回す
+                    self._release_locked(None)
+                # 受け渡し中（未完了）なら cancel しておけば _hand_over が枠を次へ回す
+                waiter.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._overloaded() from None
+            raise
+        with self._lock:
+            self.stats_counters["admitted"] += 1
+        return AdmissionSlot(self, time.monotonic() - started)
+
+    def _release(self, held_sec: Optional[float]) -> None:
+        with self._lock:
+            self._release_locked(held_sec)
+
+    def _release_locked(self, held_sec: Optional[float]) -> None:
+        if held_sec is not None:
+            self._avg_hold_sec = self._avg_hold_sec * 0.8 + held_sec * 0.2
+        # 空きを待っている先頭に枠をそのまま渡す（_active は変えない）
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+            return
+        self._active -= 1
+
+    def _hand_over(self, waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+        else:
+            # 受け渡しと待ち時間切れが入れ違った場合は、枠を次の待ちへ回す
+            self._release(None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiters),
+                "max_concurrency": self.max_concurrency,
+                "users": len(self._buckets),
+                "avg_hold_sec": round(self._avg_hold_sec, 3),
+                **self.stats_counters,
+            }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    プロセス共有の AdmissionController を取得する
+
+    Returns:
+        AGENT_ADMISSION_ENABLED が false なら None
+    """
+    global _controller
+    if os.getenv("AGENT_ADMISSION_ENABLED", "true").lower() != "true":
+        return None
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    max_concurrency=int(os.getenv("AGENT_MAX_CONCURRENCY", "16")),
+                    queue_size=int(os.getenv("AGENT_QUEUE_SIZE", "32")),
+                    queue_timeout_sec=float(os.getenv("AGENT_QUEUE_TIMEOUT_SEC", "10")),
+                    rate_per_min=float(os.getenv("AGENT_RATE_PER_MIN", "20")),
+                    burst=int(os.getenv("AGENT_RATE_BURST", "5")),
+                )
+    return _controller
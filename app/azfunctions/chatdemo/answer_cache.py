@@ -0,0 +1,134 @@
+"""
+Cortex Agent 回答キャッシュ（TTL + LRU、プロセス内）
+
+同じ質問（「今月の売上は?」等）が短時間に繰り返されるたびに Agent を実行しないよう、
+正規化した質問文・Agent名・データベース/スキーマをキーに回答をキャッシュする。
+既定では無効（CHAT_ANSWER_CACHE_ENABLED=true で有効化）。
+
+設定（環境変数）:
+    CHAT_ANSWER_CACHE_ENABLED: キャッシュを有効にする（既定: false）
+    CHAT_ANSWER_CACHE_TTL_SEC: エントリの有効秒数（既定: 300）
+    CHAT_ANSWER_CACHE_MAX_ENTRIES: 保持する最大エントリ数（既定: 256）
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+_WS = re.compile(r"\s+")
+_TRAILING_PUNCT = "?？!！。.、, "
+
+CacheKey = Tuple[str, str, str, str]
+
+
+def normalize_question(text: str) -> str:
+    """
+    質問文を正規化する（NFKC・小文字化・空白の畳み込み・末尾の句読点除去）
+
+    「今月の売上は?」「今月の売上は？」「 今月の売上は 」を同じキーにする。
+    """
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    s = _WS.sub(" ", s).strip()
+    return s.rstrip(_TRAILING_PUNCT)
+
+
+def make_cache_key(text: str, agent: str, database: str, schema: str) -> CacheKey:
+    return (normalize_question(text), (agent or "").upper(), (database or "").upper(), (schema or "").upper())
+
+
+class AnswerCache:
+    """
+    TTL付きLRUキャッシュ（スレッドセーフ）
+
+    Args:
+        max_entries: 保持する最大エントリ数（超えたら最も古く使われたものを破棄）
+        ttl_sec: エントリの有効秒数
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_sec: float = 300.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl_sec = ttl_sec
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Returns:
+            (値, 保存からの経過秒) または None（未登録・期限切れ）
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if now - stored_at > self.ttl_sec:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, now - stored_at
+
+    def put(self, key: CacheKey, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    プロセス共有の AnswerCache を取得する
+
+    Returns:
+        CHAT_ANSWER_CACHE_ENABLED が true でなければ None
+    """
+    global _cache
+    if os.getenv("CHAT_ANSWER_CACHE_ENABLED", "false").lower() != "true":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(
+                    max_entries=int(os.getenv("CHAT_ANSWER_CACHE_MAX_ENTRIES", "256")),
+                    ttl_sec=float(os.getenv("CHAT_ANSWER_CACHE_TTL_SEC", "300")),
+                )
+    return _cache
+
+
+def cache_headers(hit: bool, age: float = 0.0) -> Dict[str, str]:
+    """キャッシュ状態を示すレスポンスヘッダ（X-Cache / Age）"""
+    if hit:
+        return {"X-Cache": "HIT", "Age": str(int(age))}
+    return {"X-Cache": "MISS"}
@@ -0,0 +1,225 @@
+"""
+CHAT_MESSAGES へのバッチ書き込み
+
+save_message が1往復ごとに CREATE TABLE IF NOT EXISTS と文字列連結の1行 INSERT を
+実行していた（1メッセージ2往復、引用符を含むと壊れる）のを置き換える。
+DDL はプロセス内でテーブルごとに1回だけ実行し、メッセージはメモリに溜めて
+件数または経過時間で1本の複数行 INSERT（バインド変数）として送る。
+書き込みに失敗した行はバッファに戻し、最大保持秒数から倍々に（最大 MAX_BACKOFF_SEC 秒）
+間隔を空けて再送する（件数が閾値を超えたままでもすぐには送り直さない）。
+
+設定（環境変数）:
+    CHAT_MESSAGE_FLUSH_ROWS: この件数に達したら書き込む（既定: 200、1文あたりの上限も兼ねる）
+    CHAT_MESSAGE_FLUSH_INTERVAL_SEC: 最大保持秒数（既定: 2）
+    CHAT_MESSAGE_MAX_BUFFER_ROWS: 書き込み失敗時に保持する上限件数（既定: 10000）
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# (sql, bindings) -> SQL API の応答（失敗時 None）
+ExecuteFn = Callable[[str, Optional[Dict[str, Dict[str, Any]]]], Optional[Dict[str, Any]]]
+
+CHAT_MESSAGES_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    ID NUMBER AUTOINCREMENT,
+    USER_ID VARCHAR(255),
+    MESSAGE TEXT,
+    AI_RESPONSE TEXT,
+    TIMESTAMP TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+    PRIMARY KEY (ID)
+)
+"""
+
+# 受付時刻を保持するため TIMESTAMP も明示して挿入する（DEFAULT だと書き込み時刻になる）
+_ROW_PLACEHOLDER = "(?, ?, ?, TO_TIMESTAMP_NTZ(?))"
+
+# 書き込み失敗後に再送を待つ最大秒数
+MAX_BACKOFF_SEC = 60.0
+
+# DDL 実行済みのテーブル（プロセス内で共有）
+_ensured_tables: Set[str] = set()
+_ensured_lock = threading.Lock()
+
+Row = Tuple[str, str, Optional[str], str]
+
+
+def build_insert(table: str, rows: List[Row]) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+    """
+    複数行 INSERT 文とバインド変数を生成する
+
+    Returns:
+        (sql, bindings)
+    """
+    sql = (
+        f"INSERT INTO {table} (USER_ID, MESSAGE, AI_RESPONSE, TIMESTAMP) VALUES "
+        + ", ".join([_ROW_PLACEHOLDER] * len(rows))
+    )
+    bindings: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        for value in row:
+            bindings[str(len(bindings) + 1)] = {"type": "TEXT", "value": value}
+    return sql, bindings
+
+
+class ChatMessageWriter:
+    """
+    チャットメッセージをバッファし、バックグラウンドでまとめて INSERT する
+
+    save() はメモリに積むだけで即座に戻る。close() で残りを書き込んでスレッドを止める。
+    """
+
+    def __init__(
+        self,
+        execute: ExecuteFn,
+        table: str = "CHAT_MESSAGES",
+        flush_rows: int = 200,
+        flush_interval_sec: float = 2.0,
+        max_buffer_rows: int = 10000,
+    ):
+        self.execute = execute
+        self.table = table
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval_sec = flush_interval_sec
+        self.max_buffer_rows = max_buffer_rows
+
+        self._cond = threading.Condition()
+        self._buffer: List[Row] = []
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        # 連続して書き込みに失敗した回数（再送の間隔に使う）
+        self._failures = 0
+        self.stats = {"saved": 0, "written": 0, "statements": 0, "failed": 0, "dropped": 0}
+
+        self._thread = threading.Thread(target=self._run, name="chat-message-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, user_id: str, message: str, ai_response: Optional[str] = None) -> None:
+        """メッセージをバッファに追加する（ノンブロッキング）"""
+        row = (user_id, message, ai_response, datetime.utcnow().isoformat(sep=" "))
+        with self._cond:
+            if self._closed:
+                logging.warning("Chat message writer is closed; message dropped")
+                self.stats["dropped"] += 1
+                return
+            self._buffer.append(row)
+            self.stats["saved"] += 1
+            self._trim_locked()
+            if len(self._buffer) >= self.flush_rows:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """
+        バッファを即時書き込む
+
+        Returns:
+            書き込みに成功した行数
+        """
+        with self._flush_lock:
+            with self._cond:
+                rows = self._buffer
+                self._buffer = []
+            if not rows:
+                return 0
+
+            written = 0
+            failed: List[Row] = []
+            if not self._ensure_table():
+                failed = rows
+            else:
+                for i in range(0, len(rows), self.flush_rows):
+                    batch = rows[i:i + self.flush_rows]
+                    sql, bindings = build_insert(self.table, batch)
+                    if self.execute(sql, bindings) is not None:
+                        written += len(batch)
+                        with self._cond:
+                            self.stats["statements"] += 1
+                    else:
+                        failed.extend(batch)
+
+            with self._cond:
+                self.stats["written"] += written
+                self._failures = self._failures + 1 if failed else 0
+                if failed:
+                    # 失敗分は次回に再送（新しいメッセージより前に戻す）
+                    self.stats["failed"] += len(failed)
+                    self._buffer = failed + self._buffer
+                    self._trim_locked()
+            return written
+
+    def close(self, timeout: float = 30.0) -> None:
+        """残りを書き込んでバックグラウンドスレッドを停止する"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _ensure_table(self) -> bool:
+        if self.table in _ensured_tables:
+            return True
+        with _ensured_lock:
+            if self.table in _ensured_tables:
+                return True
+            if self.execute(CHAT_MESSAGES_DDL.format(table=self.table), None) is None:
+                return False
+            _ensured_tables.add(self.table)
+            return True
+
+    def _trim_locked(self) -> None:
+        overflow = len(self._buffer) - self.max_buffer_rows
+        if overflow > 0:
+            self._buffer = self._buffer[overflow:]
+            self.stats["dropped"] += overflow
+            logging.warning(f"Chat message buffer full; dropped {overflow} oldest messages")
+
+    def _backoff_sec(self) -> float:
+        return min(MAX_BACKOFF_SEC, self.flush_interval_sec * 2 ** (self._failures - 1))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._failures:
+                    # 書き込み失敗後は件数が閾値を超えていても待つ（save の notify では起きない）
+                    deadline = time.monotonic() + self._backoff_sec()
+                    while not self._closed and deadline > time.monotonic():
+                        self._cond.wait(deadline - time.monotonic())
+                elif not self._closed and len(self._buffer) < self.flush_rows:
+                    self._cond.wait(self.flush_interval_sec)
+                closed = self._closed
+            if closed:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Chat message flush error: {e}")
+                with self._cond:
+                    self._failures += 1
+
+
+_writer: Optional[ChatMessageWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_chat_message_writer(execute: ExecuteFn) -> ChatMessageWriter:
+    """
+    プロセス共有の ChatMessageWriter を取得する（初回呼び出し時の execute を使う）
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ChatMessageWriter(
+                    execute,
+                    flush_rows=int(os.getenv("CHAT_MESSAGE_FLUSH_ROWS", "200")),
+                    flush_interval_sec=float(os.getenv("CHAT_MESSAGE_FLUSH_INTERVAL_SEC", "2")),
+                    max_buffer_rows=int(os.getenv("CHAT_MESSAGE_MAX_BUFFER_ROWS", "10000")),
+                )
+                atexit.register(_writer.close)
+    return _writer
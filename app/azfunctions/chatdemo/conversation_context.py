@@ -0,0 +1,213 @@
+"""
+会話コンテキスト（マルチターン）のサーバ側保持
+
+クライアントは conversation_id を送ってくるが、Agent へのペイロードには最新の
+ユーザーメッセージしか入っていなかった。ここでは (user_id, conversation_id) ごとに直近の
+やり取りをコンパクトに保持し、文字数予算内に収まる分だけ messages に付与する。
+予算に入らない古いやり取りは、先頭の一部だけを残した要約行にまとめて付与する。
+
+会話はLRUで管理し（参照・更新ともO(1)）、一定時間使われない会話は破棄する。
+文字数は日本語の場合おおよそトークン数と同程度とみなして予算に使う。
+conversation_id はクライアントが送る値のため、別のユーザーが同じ値を送っても
+他人の履歴が付与されないよう user_id と組で管理する。
+
+設定（環境変数）:
+    CHAT_CONTEXT_ENABLED: 会話コンテキストを付与する（既定: true）
+    CHAT_CONTEXT_MAX_CHARS: 付与する履歴の文字数予算（既定: 4000）
+    CHAT_CONTEXT_MAX_TURNS: 保持する直近のやり取り数（既定: 10）
+    CHAT_CONTEXT_SUMMARY_CHARS: 要約行の文字数上限（既定: 800）
+    CHAT_CONTEXT_MAX_CONVERSATIONS: 保持する会話数（既定: 5000）
+    CHAT_CONTEXT_TTL_SEC: 会話を保持する秒数（最終更新から、既定: 3600）
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# 保存時の1メッセージあたりの上限（巨大なツール結果入りの回答でメモリを食わないように）
+TURN_MAX_CHARS = 2000
+# 要約行に残す先頭文字数
+SUMMARY_QUESTION_CHARS = 60
+SUMMARY_ANSWER_CHARS = 120
+
+
+def _clip(text: str, limit: int) -> str:
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def _text_message(role: str, *texts: str) -> Dict[str, Any]:
+    return {"role": role, "content": [{"type": "text", "text": t} for t in texts if t]}
+
+
+class _Conversation:
+    __slots__ = ("turns", "summary", "updated_at")
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Tuple[str, str]] = deque(maxlen=max_turns)
+        self.summary: Deque[str] = deque()
+        self.updated_at = time.monotonic()
+
+
+class ConversationContextStore:
+    """
+    (user_id, conversation_id) ごとの直近のやり取りを保持し、予算内の履歴付きメッセージを組み立てる
+
+    Args:
+        max_chars: 付与する履歴（要約含む）の文字数予算
+        max_turns: 会話ごとに保持する直近のやり取り数（超えた分は要約行へ）
+        summary_chars: 要約行の文字数上限（超えた分は古い方から捨てる）
+        max_conversations: 保持する会話数（LRU）
+        ttl_sec: 最終更新からこの秒数を過ぎた会話は破棄
+    """
+
+    def __init__(
+        self,
+        max_chars: int = 4000,
+        max_turns: int = 10,
+        summary_chars: int = 800,
+        max_conversations: int = 5000,
+        ttl_sec: float = 3600.0,
+    ):
+        self.max_chars = max_chars
+        self.max_turns = max(1, max_turns)
+        self.summary_chars = summary_chars
+        self.max_conversations = max(1, max_conversations)
+        self.ttl_sec = ttl_sec
+        self._conversations: "OrderedDict[Tuple[str, str], _Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: Tuple[str, str]) -> Optional[_Conversation]:
+        conv = self._conversations.get(key)
+        if conv is None:
+            return None
+        if time.monotonic() - conv.updated_at > self.ttl_sec:
+            del self._conversations[key]
+            return None
+        self._conversations.move_to_end(key)
+        return conv
+
+    def has_history(self, user_id: Optional[str], conversation_id: Optional[str]) -> bool:
+        if not conversation_id:
+            return False
+        with self._lock:
+            conv = self._get(_key(user_id, conversation_id))
+            return bool(conv and (conv.turns or conv.summary))
+
+    def build_messages(self, user_id: Optional[str], conversation_id: Optional[str], text: str) -> List[Dict[str, Any]]:
+        """
+        履歴を付与した Agent 用の messages を返す（履歴が無ければ最新メッセージのみ）
+
+        新しいやり取りから順に予算へ入れ、入らなかった分と保持数を超えて
+        押し出された分は要約行として先頭のユーザーメッセージに添える。
+        """
+        current = _text_message("user", text)
+        if not conversation_id:
+            return [current]
+        with self._lock:
+            conv = self._get(_key(user_id, conversation_id))
+            if conv is None:
+                return [current]
+            turns = list(conv.turns)
+            summary = list(conv.summary)
+
+        budget = self.max_chars
+        included: List[Tuple[str, str]] = []
+        for question, answer in reversed(turns):
+            cost = len(question) + len(answer)
+            if cost > budget:
+                break
+            budget -= cost
+            included.append((question, answer))
+        included.reverse()
+
+        # 予算に入らなかった古いやり取りは要約行へ
+        for question, answer in turns[:len(turns) - len(included)]:
+            summary.append(_summary_line(question, answer))
+        summary_text = _fit_summary(summary, min(self.summary_chars, budget))
+
+        messages: List[Dict[str, Any]] = []
+        for question, answer in included:
+            messages.append(_text_message("user", question))
+            messages.append(_text_message("assistant", answer))
+        messages.append(current)
+        if summary_text:
+            header = f"[これまでの会話の要約]\n{summary_text}"
+            messages[0] = _text_message("user", header, *(c["text"] for c in messages[0]["content"]))
+        return messages
+
+    def append_turn(self, user_id: Optional[str], conversation_id: Optional[str], question: str, answer: str) -> None:
+        """やり取りを1件追加する（保持数を超えた最古のやり取りは要約行へ）"""
+        if not conversation_id or not answer:
+            return
+        key = _key(user_id, conversation_id)
+        with self._lock:
+            conv = self._get(key)
+            if conv is None:
+                conv = _Conversation(self.max_turns)
+                self._conversations[key] = conv
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            if len(conv.turns) == conv.turns.maxlen:
+                conv.summary.append(_summary_line(*conv.turns[0]))
+                _trim_summary(conv.summary, self.summary_chars)
+            conv.turns.append((_clip(question, TURN_MAX_CHARS), _clip(answer, TURN_MAX_CHARS)))
+            conv.updated_at = time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"conversations": len(self._conversations)}
+
+
+def _key(user_id: Optional[str], conversation_id: str) -> Tuple[str, str]:
+    return (user_id or "anonymous", conversation_id)
+
+
+def _summary_line(question: str, answer: str) -> str:
+    return f"- Q: {_clip(question, SUMMARY_QUESTION_CHARS)} / A: {_clip(answer, SUMMARY_ANSWER_CHARS)}"
+
+
+def _trim_summary(lines: Deque[str], limit: int) -> None:
+    total = sum(len(line) + 1 for line in lines)
+    while lines and total > limit:
+        total -= len(lines.popleft()) + 1
+
+
+def _fit_summary(lines: List[str], limit: int) -> str:
+    """新しい要約行から limit 文字に収まる分だけ残す"""
+    kept: List[str] = []
+    total = 0
+    for line in reversed(lines):
+        total += len(line) + 1
+        if total > limit:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+_store: Optional[ConversationContextStore] = None
+_store_lock = threading.Lock()
+
+
+def get_context_store() -> Optional[ConversationContextStore]:
+    """
+    プロセス共有の ConversationContextStore を取得する
+
+    Returns:
+        CHAT_CONTEXT_ENABLED が false なら None
+    """
+    global _store
+    if os.getenv("CHAT_CONTEXT_ENABLED", "true").lower() != "true":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationContextStore(
+                    max_chars=int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "4000")),
+                    max_turns=int(os.getenv("CHAT_CONTEXT_MAX_TURNS", "10")),
+                    summary_chars=int(os.getenv("CHAT_CONTEXT_SUMMARY_CHARS", "800")),
+                    max_conversations=int(os.getenv("CHAT_CONTEXT_MAX_CONVERSATIONS", "5000")),
+                    ttl_sec=float(os.getenv("CHAT_CONTEXT_TTL_SEC", "3600")),
+                )
+    return _store
@@ -0,0 +1,286 @@
+"""
+会話ログのS3バッチ送信（LOG.CORTEX_CONVERSATIONS 外部テーブル用）
+
+チャット1往復ごとにS3へ同期アップロードすると応答にS3のレイテンシが乗り、
+cortex_conversations/ 配下に小さなオブジェクトが大量にできて外部テーブルの
+REFRESH / スキャンが遅くなる。ここではレコードをメモリに溜め、件数・サイズ・
+経過時間のいずれかでバックグラウンドスレッドがまとめてNDJSON（任意でgzip）として
+送信する。パーティション構成（YEAR=/MONTH=/DAY=/HOUR=）は従来どおり。
+送信に失敗したレコードはバッファに戻し、最大保持秒数から倍々に（最大 MAX_BACKOFF_SEC 秒）
+間隔を空けて再送する（件数・サイズが閾値を超えたままでもすぐには送り直さない）。
+
+設定（環境変数）:
+    CHAT_S3_BUCKET: 送信先バケット（未設定なら送信しない）
+    CHAT_LOG_FLUSH_RECORDS: この件数に達したら送信（既定: 500）
+    CHAT_LOG_FLUSH_BYTES: このバイト数に達したら送信（既定: 4MB）
+    CHAT_LOG_FLUSH_INTERVAL_SEC: 最大保持秒数（既定: 60）
+    CHAT_LOG_GZIP: gzip圧縮して .json.gz で送信（既定: true）
+    CHAT_LOG_MAX_BUFFER_RECORDS: 送信失敗時に保持する上限件数（既定: 50000）
+"""
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from s3_upload import upload_bytes
+
+S3_PREFIX = "cortex_conversations"
+# 送信失敗後に再送を待つ最大秒数
+MAX_BACKOFF_SEC = 600.0
+
+
+def build_turn_records(
+    conversation_id: str,
+    session_id: Optional[str],
+    user_id: str,
+    agent_name: str,
+    user_text: str,
+    assistant_text: str,
+    timestamp: datetime,
+) -> List[Dict[str, Any]]:
+    """
+    1往復分（user / assistant の2行）の会話ログレコードを生成する
+    """
+    base = {
+        "conversation_id": conversation_id,
+        "session_id": session_id,
+        "user_id": user_id,
+        "agent_name": agent_name,
+    }
+    return [
+        {
+            **base,
+            "message_role": "user",
+            "message_content": {"text": user_text},
+            "timestamp": timestamp.isoformat(),
+            "metadata": None,
+        },
+        {
+            **base,
+            "message_role": "assistant",
+            "message_content": {"text": assistant_text},
+            "timestamp": timestamp.isoformat(),
+            "metadata": None,
+        },
+    ]
+
+
+def _partition_of(record: Dict[str, Any]) -> str:
+    try:
+        ts = datetime.fromisoformat(record.get("timestamp") or "")
+    except ValueError:
+        ts = datetime.utcnow()
+    return ts.strftime("YEAR=%Y/MONTH=%m/DAY=%d/HOUR=%H")
+
+
+class ConversationLogShipper:
+    """
+    会話ログをバッファし、バックグラウンドでまとめてS3へ送信する
+
+    submit() はメモリに積むだけで即座に戻る。送信はパーティション（時間）単位で
+    1オブジェクトにまとめる。close() で残りを送信してスレッドを止める。
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = S3_PREFIX,
+        flush_records: int = 500,
+        flush_bytes: int = 4 * 1024 * 1024,
+        flush_interval_sec: float = 60.0,
+        use_gzip: bool = True,
+        max_buffer_records: int = 50000,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+        self.flush_interval_sec = flush_interval_sec
+        self.use_gzip = use_gzip
+        self.max_buffer_records = max_buffer_records
+
+        self._cond = threading.Condition()
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        # 連続して送信に失敗した回数（再送の間隔に使う）
+        self._failures = 0
+        self.stats = {"submitted": 0, "shipped": 0, "objects": 0, "failed": 0, "dropped": 0}
+
+        self._thread = threading.Thread(target=self._run, name="conversation-log-shipper", daemon=True)
+        self._thread.start()
+
+    def submit(self, records: List[Dict[str, Any]]) -> None:
+        """レコードをバッファに追加する（ノンブロッキング）"""
+        lines = [json.dumps(r, ensure_ascii=False) for r in records]
+        with self._cond:
+            if self._closed:
+                logging.warning("Conversation log shipper is closed; records dropped")
+                self.stats["dropped"] += len(lines)
+                return
+            self._buffer.extend(lines)
+            self._buffer_bytes += sum(len(line) for line in lines)
+            self.stats["submitted"] += len(lines)
+            self._trim_locked()
+            if self._should_flush_locked():
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """
+        バッファを即時送信する
+
+        Returns:
+            送信に成功したレコード数
+        """
+        with self._flush_lock:
+            with self._cond:
+                lines = self._buffer
+                self._buffer = []
+                self._buffer_bytes = 0
+            if not lines:
+                return 0
+
+            by_partition: Dict[str, List[str]] = defaultdict(list)
+            for line in lines:
+                by_partition[_partition_of(json.loads(line))].append(line)
+
+            shipped = 0
+            failed: List[str] = []
+            for partition, part_lines in by_partition.items():
+                if self._upload(partition, part_lines):
+                    shipped += len(part_lines)
+                else:
+                    failed.extend(part_lines)
+
+            with self._cond:
+                self.stats["shipped"] += shipped
+                self._failures = self._failures + 1 if failed else 0
+                if failed:
+                    # 失敗分は次回に再送（新しいレコードより前に戻す）
+                    self.stats["failed"] += len(failed)
+                    self._buffer = failed + self._buffer
+                    self._buffer_bytes += sum(len(line) for line in failed)
+                    self._trim_locked()
+            return shipped
+
+    def close(self, timeout: float = 30.0) -> None:
+        """残りを送信してバックグラウンドスレッドを停止する"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _should_flush_locked(self) -> bool:
+        return len(self._buffer) >= self.flush_records or self._buffer_bytes >= self.flush_bytes
+
+    def _trim_locked(self) -> None:
+        overflow = len(self._buffer) - self.max_buffer_records
+        if overflow > 0:
+            dropped = self._buffer[:overflow]
+            self._buffer = self._buffer[overflow:]
+            self._buffer_bytes -= sum(len(line) for line in dropped)
+            self.stats["dropped"] += overflow
+            logging.warning(f"Conversation log buffer full; dropped {overflow} oldest records")
+
+    def _backoff_sec(self) -> float:
+        return min(MAX_BACKOFF_SEC, self.flush_interval_sec * 2 ** (self._failures - 1))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._failures:
+                    # 送信失敗後は閾値を超えていても待つ（submit の notify では起きない）
+                    deadline = time.monotonic() + self._backoff_sec()
+                    while not self._closed and deadline > time.monotonic():
+                        self._cond.wait(deadline - time.monotonic())
+                elif not self._closed and not self._should_flush_locked():
+                    self._cond.wait(self.flush_interval_sec)
+                closed = self._closed
+            if closed:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Conversation log flush error: {e}")
+                with self._cond:
+                    self._failures += 1
+
+    def _upload(self, partition: str, lines: List[str]) -> bool:
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        suffix = ".json"
+        if self.use_gzip:
+            body = gzip.compress(body)
+            suffix = ".json.gz"
+        key = f"{self.prefix}/{partition}/{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4()}{suffix}"
+
+        try:
+            ok = upload_bytes(
+                body,
+                self.bucket,
+                key,
+                content_type="application/gzip" if self.use_gzip else "application/json",
+            )
+        except Exception as e:
+            logging.error(f"S3 upload error: {e}")
+            ok = False
+
+        if ok:
+            with self._cond:
+                self.stats["objects"] += 1
+            logging.info(f"Conversation log shipped: {len(lines)} records -> s3://{self.bucket}/{key}")
+        return ok
+
+
+_shipper: Optional[ConversationLogShipper] = None
+_shipper_lock = threading.Lock()
+
+
+def get_log_shipper() -> Optional[ConversationLogShipper]:
+    """
+    プロセス共有の ConversationLogShipper を取得する
+
+    Returns:
+        CHAT_S3_BUCKET 未設定時は None
+    """
+    global _shipper
+    bucket = os.getenv("CHAT_S3_BUCKET")
+    if not bucket:
+        return None
+    if _shipper is None:
+        with _shipper_lock:
+            if _shipper is None:
+                _shipper = ConversationLogShipper(
+                    bucket=bucket,
+                    flush_records=int(os.getenv("CHAT_LOG_FLUSH_RECORDS", "500")),
+                    flush_bytes=int(os.getenv("CHAT_LOG_FLUSH_BYTES", str(4 * 1024 * 1024))),
+                    flush_interval_sec=float(os.getenv("CHAT_LOG_FLUSH_INTERVAL_SEC", "60")),
+                    use_gzip=os.getenv("CHAT_LOG_GZIP", "true").lower() == "true",
+                    max_buffer_records=int(os.getenv("CHAT_LOG_MAX_BUFFER_RECORDS", "50000")),
+                )
+                atexit.register(_shipper.close)
+    return _shipper
+
+
+def ship_conversation_turn(**kwargs: Any) -> bool:
+    """
+    1往復分の会話ログを送信キューに積む（build_turn_records と同じ引数）
+
+    Returns:
+        キューに積んだ場合 True（CHAT_S3_BUCKET 未設定時は False）
+    """
+    shipper = get_log_shipper()
+    if shipper is None:
+        return False
+    shipper.submit(build_turn_records(**kwargs))
+    return True
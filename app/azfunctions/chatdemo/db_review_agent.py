@@ -11,8 +11,8 @@ import re
 import json
 from typing import Dict, Optional, Tuple
 from pathlib import Path
-from datetime import datetime
 from snowflake_cortex import SnowflakeCortexClient
+from review_store import get_review_store
 
 
 class DBReviewAgent:
@@ -20,10 +20,11 @@ class DBReviewAgent:
     
     def __init__(self):
         self.agent_name = "DB_DESIGN.OBSIDIAN_SCHEMA_DB_DESIGN_REVIEW_AGENT"
+        self.cortex_client = SnowflakeCortexClient()
         
-        # レビュー結果の出力ディレクトリ
-        self.output_dir = Path(__file__).parent.parent.parent.parent / "docs" / "snowflake" / "chatdemo" / "reviews" / "schemas"
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # レビュー結果の保存先（index.jsonl で内容ハッシュと指摘数を管理）
+        self.review_store = get_review_store()
+        self.output_dir = self.review_store.root
     
     def review_schema(
         self,
@@ -51,8 +52,8 @@ class DBReviewAgent:
             logging.info(f"Starting DB review for schema: {target_schema} via REST API")
             logging.info(f"Agent name: {self.agent_name}")
             
-            # REST API経由でAgent呼び出し（call_cortex_agentは内部でPOST /api/v2/cortex/agentを呼ぶ）
-                agent_response = self.cortex_client.call_cortex_agent(prompt)
+            # REST API経由でAgent呼び出し（call_cortex_agentは内部で POST .../agents/{agent}:run を呼ぶ）
+            agent_response = self.cortex_client.call_cortex_agent(prompt, self.agent_name)
             
             if not agent_response:
                 return False, "Agent実行結果が空です", None
@@ -212,14 +213,10 @@ class DBReviewAgent:
         Returns:
             保存したファイルのPath
         """
-        # ファイル名生成: {schema}_{YYYYMMDD}_{HHMMSS}.md
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{target_schema}_{timestamp}.md"
-        output_file = self.output_dir / filename
-        
-        # Markdownファイルとして保存
-        output_file.write_text(markdown_content, encoding="utf-8")
-        logging.info(f"Review saved to: {output_file}")
+        # ファイル名生成: {schema}_{YYYYMMDD}_{HHMMSS}.md（前回と同じ内容なら既存ファイルを返す）
+        record = self.review_store.save(target_schema, markdown_content)
+        output_file = self.review_store.root / record.path
+        logging.info(f"Review saved to: {output_file} (duplicate={record.duplicate})")
         
         return output_file
     
@@ -1,3 +1,6 @@
+import asyncio
+import functools
+import math
 import uuid
 
 import azure.functions as func
@@ -5,19 +8,223 @@ import logging
 import os
 import json
 import time
-import requests
 from datetime import datetime
-from s3_upload import upload_file_to_s3
-
-# モックデータ（開発用 - USE_MOCK=Trueの場合のみ使用）
-mock_messages = []
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+from azurefunctions.extensions.http.fastapi import (
+    JSONResponse,
+    Request,
+    Response,
+    StreamingResponse,
+)
+from admission import AdmissionRejected, get_admission_controller
+from http_pool import get_pool_stats
+from message_store import aget_message_store
+from metrics import ACTIVE_STREAMS, CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_REQUESTS, get_registry
+from request_timing import RequestTimer, activate, current_timer, deactivate, span
+from answer_cache import cache_headers, get_answer_cache, make_cache_key
+from conversation_context import get_context_store
+from conversation_log import ship_conversation_turn
+from review_jobs import ReviewJob, get_review_job_store
+from review_incremental import diff_hashes, merge_reports, needs_full_review, object_hashes
+from review_store import get_review_store
+from single_flight import get_stream_coalescer
+from stream_trace import StreamTrace
+from snowflake_cortex_async import AsyncCortexAgentClient, CortexAgentError, StreamDeadlines
+from sse_parser import (
+    EVENT_TEXT,
+    EVENT_TEXT_DELTA,
+    EVENT_THINKING,
+    EVENT_THINKING_DELTA,
+    EVENT_TOOL_CALL,
+    EVENT_TOOL_END,
+    EVENT_TOOL_RESULT,
+    EVENT_TOOL_START,
+    TOOL_STEP_EVENTS,
+)
+
+# モック応答（開発用 - USE_MOCK=Trueの場合のみ使用）
 USE_MOCK = os.getenv('USE_MOCK', 'False').lower() == 'true'
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+# Agentストリームの期限（最初のイベントまで / イベント間隔 / 全体、秒）
+# 超えたら受信を打ち切り、それまでの回答を truncated として返す
+CHAT_STREAM_DEADLINES = StreamDeadlines.from_env("CHAT_STREAM", first_event=60, idle=120, total=900)
+REVIEW_STREAM_DEADLINES = StreamDeadlines.from_env("REVIEW_STREAM", first_event=60, idle=120, total=600)
+
+
+async def _admission_key(req: Request) -> str:
+    """レート制限のキー（body の user_id、無ければクライアントIP）"""
+    try:
+        body = await req.json()
+    except Exception:
+        body = None
+    user_id = body.get("user_id") if isinstance(body, dict) else None
+    if user_id and user_id != "anonymous":
+        return f"user:{user_id}"
+    forwarded = req.headers.get("x-forwarded-for") or ""
+    client = forwarded.split(",")[0].strip() or (req.client.host if req.client else "")
+    return f"ip:{client or 'unknown'}"
+
+
+def _admitted(handler):
+    """
+    Agent を呼ぶエンドポイントの受付制御（admission.AdmissionController）
+
+    ユーザー別のレート制限と、全エンドポイント共有の同時実行数の上限をかける。
+    拒否時は 429 + Retry-After を返す。StreamingResponse の場合は
+    ストリームを送り終えるまで実行枠を保持する。
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(req):
+        controller = get_admission_controller()
+        if controller is None or req.method == "OPTIONS":
+            return await handler(req)
+        try:
+            with span("admission"):
+                slot = await controller.acquire(await _admission_key(req))
+        except AdmissionRejected as e:
+            logging.warning(f"Admission rejected: {e}")
+            payload = {"ok": False, "error": e.reason, "retry_after_sec": e.retry_after}
+            return _json(payload, 429, {"Retry-After": str(e.retry_after)})
+
+        try:
+            response = await handler(req)
+        except BaseException:
+            slot.release()
+            raise
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = _release_after(response.body_iterator, slot)
+        else:
+            slot.release()
+        return response
+
+    return wrapper
+
+
+async def _release_after(iterator: AsyncIterator, slot) -> AsyncIterator:
+    try:
+        async for chunk in iterator:
+            yield chunk
+    finally:
+        slot.release()
+
+
+def _timed(handler):
+    """
+    リクエストごとの処理時間の内訳を記録し、終了時に1行の構造化ログ（request_timing）を出力する
+
+    ハンドラ内からは request_timing.current_timer() / span() / mark() で記録する。
+    StreamingResponse の場合はストリームを送り終えた時点で出力する。
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(req):
+        if req.method == "OPTIONS":
+            return await handler(req)
+        timer = RequestTimer(handler.__name__)
+        token = activate(timer)
+        try:
+            response = await handler(req)
+        except BaseException:
+            timer.emit(status=500)
+            raise
+        finally:
+            deactivate(token)
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = _emit_after(response.body_iterator, timer, response.status_code)
+        else:
+            timer.emit(status=response.status_code)
+        return response
+
+    return wrapper
+
+
+async def _emit_after(iterator: AsyncIterator, timer: RequestTimer, status: int) -> AsyncIterator:
+    # ストリームはハンドラと別のタスクで送信されるため、ここで改めて現在のリクエストとして設定する
+    # （このタスクはストリーム送信で終わるので戻さない）
+    activate(timer)
+    try:
+        async for chunk in iterator:
+            yield chunk
+    finally:
+        timer.emit(status=status)
+
+
+def _metered(handler):
+    """
+    リクエスト数をエンドポイント・ステータス別に数える（metrics.HTTP_REQUESTS）
+
+    StreamingResponse の場合は送信中のクライアントSSEを ACTIVE_STREAMS{kind="client"} に数える。
+    """
+    route = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(req):
+        try:
+            response = await handler(req)
+        except BaseException:
+            HTTP_REQUESTS.inc(route, "500")
+            raise
+        HTTP_REQUESTS.inc(route, str(response.status_code))
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = _count_active(response.body_iterator)
+        return response
+
+    return wrapper
+
+
+async def _count_active(iterator: AsyncIterator) -> AsyncIterator:
+    ACTIVE_STREAMS.inc("client")
+    try:
+        async for chunk in iterator:
+            yield chunk
+    finally:
+        ACTIVE_STREAMS.dec("client")
+
+
+def _debug_requested(req: Request, body: Optional[dict]) -> bool:
+    """debug 指定（body の "debug": true またはクエリ ?debug=1）があるか"""
+    if isinstance(body, dict) and body.get("debug"):
+        return True
+    return (req.query_params.get("debug") or "").lower() in ("1", "true")
+
+
+def _time_agent_event(ev) -> None:
+    """Agentイベントの時点（最初 / 最初のテキスト / 最後）とツール呼び出しのスパンを記録する"""
+    timer = current_timer()
+    if timer is None:
+        return
+    timer.mark("first_event")
+    timer.mark("last_event", once=False)
+    if ev.event == EVENT_TEXT_DELTA:
+        timer.mark("first_text_delta")
+        return
+    if ev.event not in TOOL_STEP_EVENTS and ev.event != EVENT_TOOL_RESULT:
+        return
+    obj = ev.data if isinstance(ev.data, dict) else {}
+    tool_name = str(obj.get("name") or obj.get("tool_name") or "tool")
+    if ev.event in (EVENT_TOOL_CALL, EVENT_TOOL_START):
+        timer.begin("tool", key=tool_name, tool_name=tool_name)
+    elif ev.event == EVENT_TOOL_END:
+        timer.end("tool", key=tool_name)
+    elif timer.is_open("tool", key=tool_name):
+        timer.end("tool", key=tool_name, status=obj.get("status"))
+    else:
+        # 開始イベントが無い場合は tool_result の elapsed_ms から遡って記録する
+        elapsed = obj.get("elapsed_ms") or obj.get("elapsedMs")
+        if isinstance(elapsed, (int, float)):
+            now = timer.elapsed_ms()
+            timer.record("tool", now - elapsed, elapsed, tool_name=tool_name, status=obj.get("status"))
+
 
 @app.route(route="chat", methods=["POST", "OPTIONS"])
-def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+@_metered
+@_timed
+@_admitted
+async def chat_endpoint(req: Request) -> Response:
     """
     チャットメッセージを処理し、Cortex Agent REST API経由でのみ応答するエンドポイント
     """
@@ -25,7 +232,7 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
 
     # OPTIONSリクエスト（CORS preflight）への対応
     if req.method == "OPTIONS":
-        return func.HttpResponse(
+        return Response(
             status_code=200,
             headers={
                 "Access-Control-Allow-Origin": "*",
@@ -35,30 +242,29 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        req_body = req.get_json()
+        with span("request_parse"):
+            req_body = await req.json()
         message = req_body.get('message')
         user_id = req_body.get('user_id', 'anonymous')
+        response_headers = {}
 
         if not message:
-            return func.HttpResponse(
-                json.dumps({"error": "メッセージが必要です"}),
-                mimetype="application/json",
+            return JSONResponse(
+                {"error": "メッセージが必要です"},
                 status_code=400,
                 headers={
                     "Access-Control-Allow-Origin": "*"
                 }
             )
 
+        conversation_id = req_body.get('conversation_id') or str(uuid.uuid4())
+
         if USE_MOCK:
-            # モックデータに保存（開発用）
-            mock_messages.append({
-                'user_id': user_id,
-                'message': message,
-                'ai_response': f"これはモック応答です: {message}",
-                'timestamp': datetime.now().isoformat()
-            })
-            recent_messages = mock_messages[-10:][::-1]
+            # モック応答（開発用）
             ai_response = f"これはモック応答です: {message}"
+            store = await aget_message_store()
+            store.add(user_id, message, ai_response, conversation_id=conversation_id)
+            recent_messages, _ = store.query(limit=10)
         else:
             # Cortex Agent REST API経由でのみ応答
             base_url = os.getenv("SNOWFLAKE_ACCOUNT_URL", "").rstrip("/")
@@ -67,21 +273,26 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
             schema = os.getenv("SNOWFLAKE_SCHEMA", "")
             agent = os.getenv("SNOWFLAKE_AGENT_NAME", "")
 
-            url = f"{base_url}/api/v2/databases/{database}/schemas/{schema}/agents/{agent}:run"
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-            }
+            messages, with_history = _agent_messages(user_id, req_body.get('conversation_id'), message)
+
+            # 回答キャッシュ（CHAT_ANSWER_CACHE_ENABLED=true の場合のみ。会話の続きには使わない）
+            cache = None if req_body.get('no_cache') or with_history else get_answer_cache()
+            cache_key = make_cache_key(message, agent, database, schema)
+            cached = cache.get(cache_key) if cache else None
+
+            client = AsyncCortexAgentClient(base_url, token, database, schema, agent)
             payload = {
-                "messages": [{"role": "user", "content": [{"type": "text", "text": message}]}],
+                "messages": messages,
                 "tool_choice": {"type": "auto"},
             }
             ai_response = "応答を取得できませんでした"
             try:
-                r = requests.post(url, headers=headers, json=payload, timeout=60)
-                if r.status_code < 400:
-                    data = r.json()
+                if cached:
+                    ai_response = cached[0]["answer"]
+                    response_headers.update(cache_headers(True, cached[1]))
+                else:
+                    with span("agent_run"):
+                        data = await client.run_agent(payload, timeout=60)
                     # Snowflake Cortex Agentの応答仕様に応じて取得
                     if "choices" in data and data["choices"]:
                         c = data["choices"][0].get("message", {}).get("content")
@@ -94,50 +305,26 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
                             ) or ai_response
                     elif "data" in data and data["data"]:
                         ai_response = data["data"][0][0]
-            except Exception as e:
+                    if cache:
+                        response_headers.update(cache_headers(False))
+                        if ai_response != "応答を取得できませんでした":
+                            cache.put(cache_key, {"answer": ai_response})
+            except CortexAgentError as e:
+                # 再試行しても失敗した場合は、固定文言の応答にせずエラーとして返す
                 logging.error(f"Cortex Agent REST API error: {e}")
-
-            # S3アップロード（本番時のみ）
-            try:
-                s3_bucket = os.getenv("CHAT_S3_BUCKET")
-                if s3_bucket:
-                    from tempfile import NamedTemporaryFile
-                    now = datetime.utcnow()
-                    year = now.strftime('%Y')
-                    month = now.strftime('%m')
-                    day = now.strftime('%d')
-                    hour = now.strftime('%H')
-                    conversation_id = req_body.get('conversation_id') or str(uuid.uuid4())
-                    agent_name = os.getenv("SNOWFLAKE_AGENT_NAME", "")
-                    # NDJSON: user, assistant 2行
-                    ndjson_lines = []
-                    ndjson_lines.append(json.dumps({
-                        "conversation_id": conversation_id,
-                        "session_id": req_body.get('session_id'),
-                        "user_id": user_id,
-                        "agent_name": agent_name,
-                        "message_role": "user",
-                        "message_content": {"text": message},
-                        "timestamp": now.isoformat(),
-                        "metadata": None
-                    }, ensure_ascii=False))
-                    ndjson_lines.append(json.dumps({
-                        "conversation_id": conversation_id,
-                        "session_id": req_body.get('session_id'),
-                        "user_id": user_id,
-                        "agent_name": agent_name,
-                        "message_role": "assistant",
-                        "message_content": {"text": ai_response},
-                        "timestamp": now.isoformat(),
-                        "metadata": None
-                    }, ensure_ascii=False))
-                    s3_key = f"cortex_conversations/YEAR={year}/MONTH={month}/DAY={day}/HOUR={hour}/{uuid.uuid4()}.json"
-                    with NamedTemporaryFile("w", encoding="utf-8", delete=False) as tmpf:
-                        tmpf.write("\n".join(ndjson_lines) + "\n")
-                        tmpf.flush()
-                        upload_file_to_s3(tmpf.name, s3_bucket, s3_key, content_type="application/json")
-            except Exception as e:
-                logging.error(f"S3 upload error: {e}")
+                return _agent_error_response(e)
+            if ai_response != "応答を取得できませんでした":
+                _remember_turn(user_id, req_body.get('conversation_id'), message, ai_response)
+
+            await _record_turn(
+                conversation_id=conversation_id,
+                session_id=req_body.get('session_id'),
+                user_id=user_id,
+                agent_name=os.getenv("SNOWFLAKE_AGENT_NAME", ""),
+                user_text=message,
+                assistant_text=ai_response,
+                timestamp=datetime.utcnow(),
+            )
 
             # 最近のメッセージは返さない（または空リスト）
             recent_messages = []
@@ -148,18 +335,20 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
             "recent_messages": recent_messages,
             "ai_response": ai_response
         }
-
-        return func.HttpResponse(
-            json.dumps(response_data, ensure_ascii=False),
-            mimetype="application/json",
-            status_code=200
-        )
+        if _debug_requested(req, req_body):
+            response_data["timings"] = current_timer().summary()
+
+        with span("serialize"):
+            return JSONResponse(
+                response_data,
+                status_code=200,
+                headers=response_headers
+            )
 
     except Exception as e:
         logging.error(f"エラー: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": str(e)}),
-            mimetype="application/json",
+        return JSONResponse(
+            {"error": str(e)},
             status_code=500,
             headers={
                 "Access-Control-Allow-Origin": "*"
@@ -167,16 +356,50 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
         )
 
 
+@app.route(route="http-pool/stats", methods=["GET"])
+@_metered
+async def get_http_pool_stats_endpoint(req: Request) -> Response:
+    """
+    Snowflake向け接続プールのヒット/ミス件数を返す（接続再利用の確認用）
+    """
+    return JSONResponse(
+        get_pool_stats(),
+        status_code=200,
+        headers={"Access-Control-Allow-Origin": "*"}
+    )
+
+
+@app.route(route="metrics", methods=["GET"])
+async def get_metrics_endpoint(req: Request) -> Response:
+    """
+    プロセス内メトリクスを Prometheus テキスト形式で返す（metrics.py）
+
+    Functions はインスタンスごとに別プロセスのため、値はこのインスタンス分のみ。
+    """
+    return Response(
+        get_registry().render(),
+        status_code=200,
+        headers={"Content-Type": METRICS_CONTENT_TYPE},
+    )
+
+
 @app.route(route="messages", methods=["GET", "OPTIONS"])
-def get_messages(req: func.HttpRequest) -> func.HttpResponse:
+@_metered
+async def get_messages(req: Request) -> Response:
     """
-    チャットメッセージの取得（Snowflake DB直接アクセスは不可、モックのみ）
+    チャットメッセージの取得（プロセス内の MessageStore から。Snowflake DB直接アクセスは不可）
+
+    クエリパラメータ:
+        limit: 最大件数（既定 50、上限 200）
+        user_id / conversation_id: 絞り込み（どちらか必須。全ユーザーの一覧は USE_MOCK 時のみ）
+        before: この id より古いもの（前のページ）
+        after: この id より新しいもの（ポーリング）
     """
     logging.info('Get messages endpoint triggered')
 
     # OPTIONSリクエスト（CORS preflight）への対応
     if req.method == "OPTIONS":
-        return func.HttpResponse(
+        return Response(
             status_code=200,
             headers={
                 "Access-Control-Allow-Origin": "*",
@@ -186,22 +409,38 @@ def get_messages(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        limit = int(req.params.get('limit', '50'))
+        params = req.query_params
+        limit = min(int(params.get('limit', '50')), 200)
+        before = params.get('before')
+        after = params.get('after')
+        user_id = params.get('user_id')
+        conversation_id = params.get('conversation_id')
+
+        if not (user_id or conversation_id or USE_MOCK):
+            # 全ユーザーのメッセージ（ai_response を含む）は返さない
+            return JSONResponse(
+                {"error": "user_id または conversation_id が必要です"},
+                status_code=400,
+                headers={"Access-Control-Allow-Origin": "*"}
+            )
 
-        if USE_MOCK:
-            # モックデータから取得
-            messages = mock_messages[-limit:][::-1]
-        else:
-            # DBアクセス禁止のため空リスト返却
-            messages = []
+        store = await aget_message_store()
+        messages, next_before = store.query(
+            limit=limit,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            before=int(before) if before else None,
+            after=int(after) if after else None,
+        )
 
         response_data = {
-            "messages": messages
+            "messages": messages,
+            "next_before": next_before,
+            "latest_id": store.latest_id,
         }
 
-        return func.HttpResponse(
-            json.dumps(response_data, ensure_ascii=False),
-            mimetype="application/json",
+        return JSONResponse(
+            response_data,
             status_code=200,
             headers={
                 "Access-Control-Allow-Origin": "*",
@@ -212,9 +451,8 @@ def get_messages(req: func.HttpRequest) -> func.HttpResponse:
 
     except Exception as e:
         logging.error(f"エラー: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": str(e)}),
-            mimetype="application/json",
+        return JSONResponse(
+            {"error": str(e)},
             status_code=500,
             headers={
                 "Access-Control-Allow-Origin": "*"
@@ -231,18 +469,80 @@ CORS_HEADERS = {
     "Access-Control-Allow-Methods": "POST, OPTIONS",
     "Access-Control-Allow-Headers": "Content-Type, Authorization",
     "Access-Control-Max-Age": "86400",
+    "Access-Control-Expose-Headers": "X-Cache, Age, X-Single-Flight, Retry-After",
 }
 
 
-def _json(payload: dict, status: int = 200) -> func.HttpResponse:
-    return func.HttpResponse(
-        json.dumps(payload, ensure_ascii=False),
+def _json(payload: dict, status: int = 200, headers: dict = None) -> Response:
+    return JSONResponse(
+        payload,
         status_code=status,
-        mimetype="application/json",
-        headers=CORS_HEADERS,
+        headers={**CORS_HEADERS, **headers} if headers else CORS_HEADERS,
     )
 
 
+def _agent_error_response(e: CortexAgentError) -> Response:
+    """
+    再試行しても失敗したAgent呼び出しのエラー応答
+
+    Retry-After が分かる場合（429 / 503・サーキットが開いている）は 503 + Retry-After、それ以外は 502。
+    """
+    payload = {"ok": False, "error": "snowflake_error", "snowflake_status": e.status, "body": e.body}
+    if e.retry_after is None:
+        return _json(payload, 502)
+    retry_after = max(1, math.ceil(e.retry_after))
+    return _json({**payload, "retry_after_sec": retry_after}, 503, {"Retry-After": str(retry_after)})
+
+
+def _agent_messages(user_id: Optional[str], conversation_id: Optional[str], text: str) -> Tuple[list, bool]:
+    """
+    Agentに渡す messages を組み立てる（そのユーザーの、クライアントが送った conversation_id の履歴を予算内で付与）
+
+    Returns:
+        (messages, 履歴を付与したか)
+    """
+    context = get_context_store()
+    if context is None or not context.has_history(user_id, conversation_id):
+        return [{"role": "user", "content": [{"type": "text", "text": text}]}], False
+    return context.build_messages(user_id, conversation_id, text), True
+
+
+def _remember_turn(user_id: Optional[str], conversation_id: Optional[str], text: str, answer: Optional[str]) -> None:
+    """次のターンで履歴として付与するため、やり取りを会話コンテキストに追加する"""
+    context = get_context_store()
+    if context is not None:
+        context.append_turn(user_id, conversation_id, text, answer)
+
+
+async def _record_turn(
+    conversation_id: str,
+    session_id,
+    user_id: str,
+    agent_name: str,
+    user_text: str,
+    assistant_text: str,
+    timestamp: datetime,
+) -> None:
+    """会話1往復を /messages 用の MessageStore と S3会話ログ（CHAT_S3_BUCKET 設定時）に記録する"""
+    store = await aget_message_store()
+    store.add(
+        user_id, user_text, assistant_text, conversation_id=conversation_id, timestamp=timestamp.isoformat()
+    )
+    try:
+        with span("log_write"):
+            ship_conversation_turn(
+                conversation_id=conversation_id,
+                session_id=session_id,
+                user_id=user_id,
+                agent_name=agent_name,
+                user_text=user_text,
+                assistant_text=assistant_text,
+                timestamp=timestamp,
+            )
+    except Exception as e:
+        logging.error(f"Conversation log error: {e}")
+
+
 def _env(name: str) -> str:
     v = os.getenv(name)
     if not v:
@@ -349,8 +649,29 @@ def _strip_leading_blank_lines(s: str) -> str:
     return "".join(lines[i:])
 
 
+async def _open_agent_stream(client: AsyncCortexAgentClient, payload: dict, subscribe: set, flight_key=None):
+    """
+    AgentのSSEストリームを開く
+
+    flight_key を指定した場合、同じキーで実行中のリクエストがあれば
+    その上流ストリームに相乗りする（single_flight.StreamCoalescer）。
+    期限（CHAT_STREAM_DEADLINES）は上流ストリームにかかり、共有中の全員が同じ打ち切りを受け取る。
+    """
+    coalescer = get_stream_coalescer() if flight_key is not None else None
+    with span("agent_open", coalesced=coalescer is not None):
+        if coalescer is None:
+            return await client.open_sse(payload, subscribe=subscribe, timeout=900, deadlines=CHAT_STREAM_DEADLINES)
+        return await coalescer.open(
+            (flight_key, frozenset(subscribe)),
+            lambda: client.open_sse(payload, subscribe=subscribe, timeout=900, deadlines=CHAT_STREAM_DEADLINES),
+        )
+
+
 @app.route(route="chat-stream", methods=["POST", "OPTIONS"])
-def chat_stream(req: func.HttpRequest) -> func.HttpResponse:
+@_metered
+@_timed
+@_admitted
+async def chat_stream(req: Request) -> Response:
     import uuid
     """
     ストリーミング対応のCortex Agent APIエンドポイント
@@ -358,29 +679,25 @@ def chat_stream(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Chat stream endpoint triggered')
 
     if req.method == "OPTIONS":
-        return func.HttpResponse("", status_code=204, headers=CORS_HEADERS)
+        return Response(status_code=204, headers=CORS_HEADERS)
 
     started = time.time()
 
     try:
-        try:
-            body = req.get_json()
-        except Exception:
-            raw = req.get_body().decode("utf-8", errors="replace")
-            body = json.loads(raw) if raw else {}
+        with span("request_parse"):
+            try:
+                body = await req.json()
+            except Exception:
+                raw = (await req.body()).decode("utf-8", errors="replace")
+                body = json.loads(raw) if raw else {}
 
         text = body.get("text") or body.get("input") or body.get("message")
 
-        s3_bucket = os.getenv("CHAT_S3_BUCKET")
         conversation_id = body.get('conversation_id') or str(uuid.uuid4())
         session_id = body.get('session_id')
         user_id = body.get('user_id', 'anonymous')
         agent_name = os.getenv("SNOWFLAKE_AGENT_NAME", "")
         now = datetime.utcnow()
-        year = now.strftime('%Y')
-        month = now.strftime('%m')
-        day = now.strftime('%d')
-        hour = now.strftime('%H')
 
         if not text:
             return _json({"ok": False, "error": "text is required"}, 400)
@@ -391,30 +708,58 @@ def chat_stream(req: func.HttpRequest) -> func.HttpResponse:
         schema = _env("SNOWFLAKE_SCHEMA")
         agent = _env("SNOWFLAKE_AGENT_NAME")
 
-        url = f"{base_url}/api/v2/databases/{database}/schemas/{schema}/agents/{agent}:run"
+        messages, with_history = _agent_messages(user_id, body.get("conversation_id"), text)
+
+        # 回答キャッシュ（CHAT_ANSWER_CACHE_ENABLED=true の場合のみ。会話の続きには使わない）
+        # ヒット時は保存済みの progress / tool_details をそのまま返し、UIの表示を再現する
+        cache = None if body.get("no_cache") or with_history else get_answer_cache()
+        cache_key = make_cache_key(text, agent, database, schema)
+        cached = cache.get(cache_key) if cache else None
+        if cached:
+            entry, age = cached
+            _remember_turn(user_id, body.get("conversation_id"), text, entry["answer"])
+            await _record_turn(
+                conversation_id=conversation_id,
+                session_id=session_id,
+                user_id=user_id,
+                agent_name=agent_name,
+                user_text=text,
+                assistant_text=entry["answer"],
+                timestamp=now,
+            )
+            return _json(
+                {
+                    "ok": True,
+                    "elapsed_sec": round(time.time() - started, 3),
+                    # /chat で保存したエントリは answer のみ
+                    "progress": [],
+                    "tool_logs": [],
+                    "tool_details": [],
+                    "events_count": 0,
+                    **entry,
+                    "cached": True,
+                },
+                headers=cache_headers(True, age),
+            )
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "Accept": "text/event-stream",
-        }
+        client = AsyncCortexAgentClient(base_url, token, database, schema, agent)
 
         payload = {
-            "messages": [{"role": "user", "content": [{"type": "text", "text": text}]}],
+            "messages": messages,
             "tool_choice": {"type": "auto"},
         }
 
-        r = requests.post(url, headers=headers, json=payload, stream=True, timeout=900)
-        if r.status_code >= 400:
-            return _json(
-                {
-                    "ok": False,
-                    "error": "snowflake_error",
-                    "snowflake_status": r.status_code,
-                    "body": r.text,
-                },
-                502,
-            )
+        # thinking.delta は DEBUG 時のみ購読（それ以外は JSON デコードせず読み飛ばす）
+        subscribe = {EVENT_THINKING, EVENT_TEXT_DELTA, EVENT_TEXT, EVENT_TOOL_RESULT, *TOOL_STEP_EVENTS}
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            subscribe.add(EVENT_THINKING_DELTA)
+
+        # 実行中の同一リクエストがあれば上流ストリームを共有する（no_cache・会話の続きは単独実行）
+        flight_key = None if body.get("no_cache") or with_history else cache_key
+        try:
+            stream = await _open_agent_stream(client, payload, subscribe, flight_key)
+        except CortexAgentError as e:
+            return _agent_error_response(e)
 
         progress = ["開始：Agentに問い合わせました"]
         tool_logs_short = []
@@ -423,8 +768,6 @@ def chat_stream(req: func.HttpRequest) -> func.HttpResponse:
         delta_all = []
 
         buf = ""
-        current_event = None
-        events_count = 0
 
         final_answer = None
         got_final = False
@@ -456,174 +799,614 @@ def chat_stream(req: func.HttpRequest) -> func.HttpResponse:
                         if line:
                             add_progress(line)
 
-        for raw in r.iter_lines(decode_unicode=False):
-            if raw is None:
-                continue
-            try:
-                line = raw.decode("utf-8")
-            except Exception:
-                line = raw.decode("utf-8", errors="replace")
+        try:
+            async for ev in stream:
+                _time_agent_event(ev)
+                if ev.event == EVENT_THINKING_DELTA:
+                    if ev.text:
+                        logging.debug(f"[thinking.delta] {ev.text[:500]}")
+                    continue
 
-            line = line.rstrip("\r")
+                if ev.event == EVENT_THINKING:
+                    t = ev.text
+                    if t:
+                        logging.info(f"[thinking] {t[:2000]}")
+                        add_progress(f"[thinking] {t}")
+                    continue
 
-            if line == "":
-                current_event = None
-                continue
+                if ev.event == EVENT_TEXT_DELTA:
+                    t = ev.text
+                    if t:
+                        delta_all.append(t)
+                        buf += t
+                        flush(False)
+                    continue
 
-            if line.startswith("event:"):
-                current_event = line[len("event:"):].strip()
-                continue
+                if ev.event == EVENT_TEXT:
+                    if got_final:
+                        continue
+                    t = ev.text
+                    if t:
+                        final_answer = t
+                        got_final = True
+                        flush(True)
+                        add_progress("完了：最終回答を受け取りました")
+                    continue
 
-            if not line.startswith("data:"):
-                continue
+                if ev.event == EVENT_TOOL_RESULT:
+                    logging.info(f"🔧 Tool result event: {ev.raw[:500].decode('utf-8', errors='replace')}")
+                    detail = _extract_tool_detail(ev.data)
+                    logging.info(f"✅ Extracted detail: {json.dumps(detail, ensure_ascii=False)[:500]}")
+                    tool_logs_short.append(f'{detail["tool_name"]} ({detail["status"]})')
+                    tool_details.append(detail)
+                    add_progress(f"🔧 ツール: **{detail['tool_name']}** ({detail['status']})")
+                    continue
+
+                if ev.event in TOOL_STEP_EVENTS:
+                    obj = ev.data if isinstance(ev.data, dict) else {}
+                    tool_name = obj.get("name") or obj.get("tool_name") or "unknown"
+                    if ev.event == EVENT_TOOL_CALL:
+                        add_progress(f"📞 ツール呼び出し: **{tool_name}**")
+                    elif ev.event == EVENT_TOOL_START:
+                        add_progress(f"▶️ ツール実行開始: **{tool_name}**")
+                    elif ev.event == EVENT_TOOL_END:
+                        add_progress(f"✅ ツール実行完了: **{tool_name}**")
+                    continue
+        finally:
+            # エラー・期限切れ・途中での return でも接続をプールに返す
+            await stream.aclose()
+
+        events_count = stream.events_seen
+        truncated = stream.truncated
+
+        if truncated:
+            flush(True)
+            add_progress(f"中断：応答の期限を超えたため途中までの回答を返します（{stream.expired}）")
+
+        if not final_answer:
+            final_answer = "".join(delta_all).strip()
+            if final_answer and not truncated:
+                add_progress("完了：最終回答を受け取りました")
+
+        elapsed = round(time.time() - started, 3)
+
+        if not truncated:
+            _remember_turn(user_id, body.get("conversation_id"), text, final_answer)
+        await _record_turn(
+            conversation_id=conversation_id,
+            session_id=session_id,
+            user_id=user_id,
+            agent_name=agent_name,
+            user_text=text,
+            assistant_text=final_answer,
+            timestamp=now,
+        )
+
+        result = {
+            "answer": _fix_mojibake(final_answer or ""),
+            "progress": progress,
+            "tool_logs": tool_logs_short,
+            "tool_details": tool_details,
+            "events_count": events_count,
+            "truncated": truncated,
+        }
+        if truncated:
+            result["truncated_reason"] = stream.expired
+        elif cache and result["answer"]:
+            cache.put(cache_key, result)
+
+        headers = cache_headers(False) if cache else {}
+        if hasattr(stream, "leader"):
+            headers["X-Single-Flight"] = "leader" if stream.leader else "follower"
+
+        if _debug_requested(req, body):
+            result["timings"] = current_timer().summary()
+
+        with span("serialize"):
+            return _json({"ok": True, "elapsed_sec": elapsed, **result}, headers=headers)
+
+    except Exception as e:
+        logging.error(f"ストリーミングエラー: {str(e)}")
+        return _json({"ok": False, "error": "internal_error", "message": str(e)}, 500)
+
+
+# ----------------------------
+# SSE中継エンドポイント（HTTP streams拡張を使用）
+# ----------------------------
+SSE_HEADERS = {
+    **CORS_HEADERS,
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _relay_agent_sse(
+    client: AsyncCortexAgentClient,
+    payload: dict,
+    flight_key=None,
+    on_final: Optional[Callable[[str], None]] = None,
+    debug: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Cortex AgentのSSEを受信した順にクライアント向けSSEへ変換して中継する
+
+    回答全文やツール結果は保持しない（メモリは1イベント分のみ。
+    flight_key 指定時の共有ストリームは同一リクエストの実行中のみ受信済みイベントを保持）。
+    on_final には最終テキスト（response.text）を完了時に渡す。
+    debug=True なら done イベントに処理時間の内訳（timings）を付ける。
+    """
+    subscribe = {EVENT_TEXT_DELTA, EVENT_TEXT, EVENT_TOOL_RESULT, *TOOL_STEP_EVENTS}
+    try:
+        stream = await _open_agent_stream(client, payload, subscribe, flight_key)
+    except CortexAgentError as e:
+        yield _sse(
+            "error",
+            {"error": "snowflake_error", "status": e.status, "body": e.body[:2000], "retry_after_sec": e.retry_after},
+        )
+        return
+
+    started = time.time()
+    tool_count = 0
+    final_text = None
+
+    yield _sse("start", {"status": "connected"})
+
+    try:
+        async for ev in stream:
+            _time_agent_event(ev)
+            if ev.event == EVENT_TEXT_DELTA:
+                if ev.text:
+                    yield _sse("text_delta", {"text": ev.text})
+
+            elif ev.event == EVENT_TEXT:
+                if ev.text:
+                    final_text = final_text or ev.text
+                    yield _sse("text_final", {"text": _fix_mojibake(ev.text)})
+
+            elif ev.event == EVENT_TOOL_RESULT:
+                tool_count += 1
+                yield _sse("tool_detail", _extract_tool_detail(ev.data))
+
+            elif ev.event in TOOL_STEP_EVENTS:
+                obj = ev.data if isinstance(ev.data, dict) else {}
+                tool_name = obj.get("name") or obj.get("tool_name") or "unknown"
+                step_type = ev.event.split(".")[-1]
+                yield _sse("tool_step", {"type": step_type, "tool_name": tool_name})
+
+        if on_final and final_text and not stream.truncated:
+            on_final(final_text)
+
+        done = {
+            "status": "truncated" if stream.truncated else "completed",
+            "truncated": stream.truncated,
+            "truncated_reason": stream.expired,
+            "tool_count": tool_count,
+            "events_count": stream.events_seen,
+            "elapsed_sec": round(time.time() - started, 3),
+        }
+        if debug and current_timer() is not None:
+            done["timings"] = current_timer().summary()
+        yield _sse("done", done)
+
+    except Exception as e:
+        logging.exception("SSE relay failed")
+        yield _sse("error", {"error": "internal_error", "message": str(e)})
+
+    finally:
+        await stream.aclose()
+
+
+@app.route(route="chat-stream-sse", methods=["POST", "OPTIONS"])
+@_metered
+@_timed
+@_admitted
+async def chat_stream_sse(req: Request) -> Response:
+    """
+    Cortex Agentのイベントを受信次第ブラウザへ転送するSSEエンドポイント
+
+    /chat-stream と同じリクエスト形式。レスポンスは text/event-stream で、
+    start → (text_delta | tool_step | tool_detail | text_final)* → done を順に送る。
+    """
+    logging.info('Chat stream SSE endpoint triggered')
 
-            data_str = line[len("data:"):].strip()
-            if data_str == "[DONE]":
-                break
+    if req.method == "OPTIONS":
+        return Response(status_code=204, headers=CORS_HEADERS)
 
+    try:
+        with span("request_parse"):
             try:
-                obj = json.loads(data_str)
+                body = await req.json()
             except Exception:
-                continue
+                body = {}
 
-            events_count += 1
+        text = body.get("text") or body.get("input") or body.get("message")
+        if not text:
+            return JSONResponse({"ok": False, "error": "text is required"}, status_code=400, headers=CORS_HEADERS)
 
-            if current_event == "response.thinking.delta":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    logging.info(f"[thinking.delta] {t[:500]}")
-                continue
+        base_url = _env("SNOWFLAKE_ACCOUNT_URL").rstrip("/")
+        token = _env("SNOWFLAKE_BEARER_TOKEN")
+        database = _env("SNOWFLAKE_DATABASE")
+        schema = _env("SNOWFLAKE_SCHEMA")
+        agent = _env("SNOWFLAKE_AGENT_NAME")
 
-            if current_event == "response.thinking":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    logging.info(f"[thinking] {t[:2000]}")
-                    add_progress(f"[thinking] {t}")
-                continue
+        client = AsyncCortexAgentClient(base_url, token, database, schema, agent)
+        user_id = body.get("user_id", "anonymous")
+        conversation_id = body.get("conversation_id")
+        messages, with_history = _agent_messages(user_id, conversation_id, text)
+        payload = {
+            "messages": messages,
+            "tool_choice": {"type": "auto"},
+        }
 
-            if current_event == "response.text.delta":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    delta_all.append(t)
-                    buf += t
-                    flush(False)
-                continue
+        flight_key = None if body.get("no_cache") or with_history else make_cache_key(text, agent, database, schema)
+
+        return StreamingResponse(
+            _relay_agent_sse(
+                client,
+                payload,
+                flight_key,
+                on_final=lambda answer: _remember_turn(user_id, conversation_id, text, answer),
+                debug=_debug_requested(req, body),
+            ),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
 
-            if current_event == "response.text":
-                if got_final:
-                    continue
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    final_answer = t
-                    got_final = True
-                    flush(True)
-                    add_progress("完了：最終回答を受け取りました")
-                continue
+    except Exception as e:
+        logging.exception("chat_stream_sse failed")
+        return JSONResponse({"ok": False, "error": "internal_error", "message": str(e)}, status_code=500, headers=CORS_HEADERS)
+
+def _review_target(req_body: dict) -> Tuple[Optional[str], Optional[str], Optional[Any]]:
+    """リクエストJSONからレビュー対象（target_schema, target_object, max_tables）を取り出す"""
+    target_schema = req_body.get("target_schema")
+    target_table = req_body.get("target_table")          # 既存互換
+    target_object = req_body.get("target_object")        # ★新規
+    max_tables = req_body.get("max_tables")
+
+    # 互換：target_object 未指定なら target_table を採用（既存クライアント救済）
+    if not target_object and target_table:
+        target_object = target_table
+    return target_schema, target_object, max_tables
+
+
+async def _run_schema_review(
+    target_schema: str,
+    target_object: Optional[str],
+    max_tables,
+    on_event: Optional[Callable[[Any], None]] = None,
+) -> Tuple[int, dict, dict]:
+    """
+    DB設計レビューを実行し、結果をファイルに保存する
 
-            if current_event == "response.tool_result":
-                logging.info(f"🔧 Tool result event: {json.dumps(obj, ensure_ascii=False)[:500]}")
-                detail = _extract_tool_detail(obj)
-                logging.info(f"✅ Extracted detail: {json.dumps(detail, ensure_ascii=False)[:500]}")
-                tool_logs_short.append(f'{detail["tool_name"]} ({detail["status"]})')
-                tool_details.append(detail)
-                add_progress(f"🔧 ツール: **{detail['tool_name']}** ({detail['status']})")
-                continue
+    同期応答（POST /review/schema の wait=true）と非同期ジョブ（review_jobs.py）で共用する。
+    スキーマ単位レビューでは、レビュー開始時点の Vault のオブジェクト別ハッシュを一緒に記録する
+    （次回の差分レビューの基準）。
 
-            if current_event in ["response.tool.call", "response.tool.start", "response.tool.end"]:
-                tool_name = obj.get("name") or obj.get("tool_name") or "unknown"
-                if current_event == "response.tool.call":
-                    add_progress(f"📞 ツール呼び出し: **{tool_name}**")
-                elif current_event == "response.tool.start":
-                    add_progress(f"▶️ ツール実行開始: **{tool_name}**")
-                elif current_event == "response.tool.end":
-                    add_progress(f"✅ ツール実行完了: **{tool_name}**")
-                continue
+    Args:
+        on_event: 受信したAgentイベントごとに呼ぶ（ジョブの進捗記録用）
 
-        if not final_answer:
-            final_answer = "".join(delta_all).strip()
-            if final_answer:
-                add_progress("完了：最終回答を受け取りました")
+    Returns:
+        (HTTPステータス, レスポンスJSON, 追加のレスポンスヘッダ)
+    """
+    message = "レビュー完了"
+    # Vault の読み込み・ハッシュ計算はファイルI/Oのためワーカースレッドで行う
+    vault_hashes = None if target_object else await asyncio.to_thread(object_hashes, target_schema)
 
-        elapsed = round(time.time() - started, 3)
+    # ----------------------------
+    # Snowflake Cortex Agent 設定
+    # ----------------------------
+    base_url = os.getenv("SNOWFLAKE_ACCOUNT_URL", "").rstrip("/")
+    token = os.getenv("SNOWFLAKE_BEARER_TOKEN", "")
+    database = os.getenv("SNOWFLAKE_DATABASE", "")
+    schema = os.getenv("SNOWFLAKE_SCHEMA_REVIEW", os.getenv("SNOWFLAKE_SCHEMA", ""))
+    agent = os.getenv(
+        "SNOWFLAKE_AGENT_NAME_REVIEW",
+        os.getenv("SNOWFLAKE_AGENT_NAME", ""),
+    )
 
-        try:
-            if s3_bucket:
-                import tempfile
-                ndjson_lines = []
-                ndjson_lines.append(json.dumps({
-                    "conversation_id": conversation_id,
-                    "session_id": session_id,
-                    "user_id": user_id,
-                    "agent_name": agent_name,
-                    "message_role": "user",
-                    "message_content": {"text": text},
-                    "timestamp": now.isoformat(),
-                    "metadata": None
-                }, ensure_ascii=False))
-                ndjson_lines.append(json.dumps({
-                    "conversation_id": conversation_id,
-                    "session_id": session_id,
-                    "user_id": user_id,
-                    "agent_name": agent_name,
-                    "message_role": "assistant",
-                    "message_content": {"text": final_answer},
-                    "timestamp": now.isoformat(),
-                    "metadata": None
-                }, ensure_ascii=False))
-                s3_key = f"cortex_conversations/YEAR={year}/MONTH={month}/DAY={day}/HOUR={hour}/{uuid.uuid4()}.json"
-                with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False) as tmpf:
-                    tmpf.write("\n".join(ndjson_lines) + "\n")
-                    tmpf.flush()
-                    upload_file_to_s3(tmpf.name, s3_bucket, s3_key, content_type="application/json")
-        except Exception as e:
-            logging.error(f"S3 upload error: {e}")
-
-        return _json(
+    client = AsyncCortexAgentClient(base_url, token, database, schema, agent)
+
+    # ----------------------------
+    # PARAMS_JSON（文字列前提 / null禁止）
+    # ----------------------------
+    params = {
+        "TARGET_SCHEMA": str(target_schema),
+        "MAX_TABLES": str(max_tables) if max_tables else "2000",
+    }
+
+    # ★重要：TARGET_OBJECT 指定時は tool 側が TARGET_TABLE を要求するため、同じ値を入れる
+    # instructions: "TARGET_TABLE は TARGET_OBJECT と同義として扱い、TARGET_OBJECT の値をそのまま渡す"
+    if target_object:
+        params["TARGET_OBJECT"] = str(target_object)
+        params["TARGET_TABLE"] = str(target_object)  # ★これが無いと Agent が tool を呼べない/迷う
+
+    # ----------------------------
+    # prompt（誤解させない・短め・PARAMS_JSON唯一入力を強調）
+    # ----------------------------
+    if target_object:
+        prompt = (
+            "以下の PARAMS_JSON を唯一の入力として、"
+            "OBSIDIAN_SCHEMA_DB_DESIGN_REVIEW_AGENT の定義に厳密に従い、静的設計レビューを実行してください。\n\n"
+            f"PARAMS_JSON:\n{json.dumps(params, ensure_ascii=False)}\n\n"
+            "注意:\n"
+            "- 今回は TARGET_OBJECT 指定のためオブジェクト単位レビュー（スキーマ全体レビューは禁止）\n"
+            "- オブジェクト単位レビュー手順に従い、最初は list_table_related_doc_paths を INCLUDE_COLUMNS=\"false\" で実行\n"
+            "- 推測禁止、Vault 根拠のみ使用\n"
+        )
+    else:
+        prompt = (
+            "以下の PARAMS_JSON を唯一の入力として、"
+            "OBSIDIAN_SCHEMA_DB_DESIGN_REVIEW_AGENT の定義に厳密に従い、静的設計レビューを実行してください。\n\n"
+            f"PARAMS_JSON:\n{json.dumps(params, ensure_ascii=False)}\n\n"
+            "注意:\n"
+            "- TARGET_OBJECT 未指定のためスキーマ単位レビュー\n"
+            "- 推測禁止、Vault 根拠のみ使用\n"
+        )
+
+    payload = {
+        "messages": [
             {
-                "ok": True,
-                "elapsed_sec": elapsed,
-                "answer": _fix_mojibake(final_answer or ""),
-                "progress": progress,
-                "tool_logs": tool_logs_short,
-                "tool_details": tool_details,
-                "events_count": events_count,
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}],
             }
-        )
+        ],
+        "tool_choice": {"type": "auto"},
+    }
 
-    except Exception as e:
-        logging.error(f"ストリーミングエラー: {str(e)}")
-        return _json({"ok": False, "error": "internal_error", "message": str(e)}, 500)
+    # ----------------------------
+    # Cortex Agent 呼び出し（SSE）
+    # streamのログは REVIEW_STREAM_TRACE（off / sampled / full）に従う
+    # ----------------------------
+    trace = StreamTrace("review_schema_endpoint")
+    subscribe = trace.subscribe({EVENT_TEXT, EVENT_TEXT_DELTA})
+    if on_event is not None and subscribe is not None:
+        subscribe |= {EVENT_TOOL_RESULT, *TOOL_STEP_EVENTS}
+    # Agent の同時実行数はプロセス全体で共有（ジョブ・wait=true・差分レビューのオブジェクト単位）
+    async with get_review_job_store().agent_slot():
+        try:
+            with span("agent_open"):
+                stream = await client.open_sse(
+                    payload, subscribe=subscribe, timeout=120, deadlines=REVIEW_STREAM_DEADLINES
+                )
+        except CortexAgentError as e:
+            headers = {"Retry-After": str(max(1, math.ceil(e.retry_after)))} if e.retry_after else {}
+            return 500, {"success": False, "error": f"Cortex Agent API error: {e.status}", "body": e.body}, headers
 
-@app.route(route="review/schema", methods=["POST", "OPTIONS"])
-def review_schema_endpoint(req: func.HttpRequest) -> func.HttpResponse:
-    import os
-    import json
-    import logging
-    import requests
-    from datetime import datetime
-    from pathlib import Path
-    import azure.functions as func
+        final_text = ""      # 最終出力：response.text（なければdelta結合）
+        delta_chunks = []
+
+        try:
+            async for ev in stream:
+                _time_agent_event(ev)
+                trace.event(ev)
+                if on_event is not None:
+                    on_event(ev)
+
+                if ev.event == EVENT_TEXT_DELTA:
+                    if ev.text:
+                        delta_chunks.append(ev.text)
+                elif ev.event == EVENT_TEXT:
+                    if ev.text and ev.text.strip():
+                        final_text = ev.text
+        finally:
+            # 例外・ジョブのキャンセルでも接続をプールに返す
+            await stream.aclose()
+
+    trace.close(
+        stream.parser.event_names(),
+        done=stream.parser.done,
+        truncated=stream.truncated,
+        delta_chunks=len(delta_chunks),
+    )
+
+    # response.text が来ない場合は delta を最終回答にする
+    if not final_text.strip() and delta_chunks:
+        final_text = "".join(delta_chunks).strip()
+
+    success = bool(final_text.strip())
+    truncated = stream.truncated
+
+    if not success:
+        message = "最終回答（response.text / response.text.delta）を取得できませんでした"
+    elif truncated:
+        message = f"応答の期限を超えたため途中までのレビューです（{stream.expired}）"
 
     # ----------------------------
-    # 変数の初期化
+    # ファイル保存（最終回答のみ。期限切れで途中までのものは保存しない）
+    # 先頭空白行があれば削除。前回と同じ内容ならファイルは増やさずインデックスにのみ記録
     # ----------------------------
-    success = False
-    markdown = ""        # ログ用途：stream全文
-    final_text = ""      # 最終出力：response.text（なければdelta結合）
-    message = "レビュー完了"
+    review_record = None
+    if success and not truncated:
+        final_text = _strip_leading_blank_lines(final_text)
+
+        with span("review_write"):
+            # レビューファイル・インデックスの書き込みはイベントループを止めないようワーカースレッドで行う
+            review_record = await asyncio.to_thread(
+                get_review_store().save, target_schema, final_text, obj=target_object, vault_hashes=vault_hashes
+            )
+
+        logging.info(f"Review saved to: {review_record.path} (duplicate={review_record.duplicate})")
+
+    response_data = {
+        "success": success,
+        "message": message,
+        "final_text": final_text,
+        "truncated": truncated,
+        "metadata": {
+            "target_schema": target_schema,
+            "target_object": target_object,
+            "max_tables": max_tables,
+            "review_date": datetime.now().strftime("%Y-%m-%d"),
+            "review_file": review_record.path if review_record else None,
+            "content_hash": review_record.content_hash if review_record else None,
+            "duplicate": review_record.duplicate if review_record else False,
+            "severity": review_record.severity if review_record else None,
+        },
+    }
+    return (200 if success else 500), response_data, {}
+
+
+async def _run_incremental_review(
+    target_schema: str,
+    max_tables,
+    on_event: Optional[Callable[[Any], None]] = None,
+) -> Tuple[int, dict, dict]:
+    """
+    差分レビュー：前回のスキーマレビューから Vault が変わったオブジェクトだけをレビューし、前回のレポートに統合する
+
+    前回のレビュー（またはそのハッシュ）が無い、スキーマ自体が変わった、変更が多い場合はスキーマ全体をレビューする。
+    変更が無ければ Agent は呼ばずに前回のレビューを返す。
+    オブジェクトのレビューに失敗した場合、そのオブジェクトは前回の指摘とハッシュのまま残す（次回また対象になる）。
+    変更された全オブジェクトが失敗した場合は保存せずに失敗を返す。
+    """
+    # Vault・レビューストアのファイルI/Oはイベントループを止めないようワーカースレッドで行う
+    store = get_review_store()
+    with span("vault_hash"):
+        current = await asyncio.to_thread(object_hashes, target_schema)
+    base = await asyncio.to_thread(store.latest, target_schema)
+    if base is None or not base.vault_hashes:
+        logging.info(f"Incremental review: no base review with vault hashes for {target_schema}, running full review")
+        return await _run_schema_review(target_schema, None, max_tables, on_event)
+
+    changed, removed = diff_hashes(base.vault_hashes, current)
+    incremental = {"base_review": base.path, "changed_objects": changed, "removed_objects": removed, "full_review": False}
+    logging.info(f"Incremental review: {target_schema} changed={changed} removed={removed} base={base.path}")
+    if needs_full_review(changed, current):
+        status, response_data, headers = await _run_schema_review(target_schema, None, max_tables, on_event)
+        response_data.setdefault("metadata", {})["incremental"] = {**incremental, "full_review": True}
+        return status, response_data, headers
+
+    previous = await asyncio.to_thread(store.read, base)
+    metadata = {
+        "target_schema": target_schema,
+        "target_object": None,
+        "max_tables": max_tables,
+        "review_date": datetime.now().strftime("%Y-%m-%d"),
+        "incremental": incremental,
+    }
+    if not changed and not removed:
+        metadata.update(review_file=base.path, content_hash=base.content_hash, duplicate=True, severity=base.severity)
+        response_data = {
+            "success": True,
+            "message": "前回のレビューから Vault の変更が無いため、前回のレビューを返します",
+            "final_text": previous,
+            "truncated": False,
+            "metadata": metadata,
+        }
+        return 200, response_data, {}
+
+    # 変更されたオブジェクトを並列にレビューする（Agent の同時実行数は _run_schema_review の実行枠で制限）
+    results = await asyncio.gather(
+        *(_run_schema_review(target_schema, obj, max_tables, on_event) for obj in changed)
+    )
+    updates = {}
+    failed = {}
+    failed_headers = {}
+    recorded = dict(current)
+    for obj, (status, data, headers) in zip(changed, results):
+        if status < 400 and data.get("success") and not data.get("truncated"):
+            updates[obj] = data["final_text"]
+            continue
+        failed[obj] = data.get("message") or data.get("error") or f"status {status}"
+        failed_headers.update(headers)
+        if obj in base.vault_hashes:
+            recorded[obj] = base.vault_hashes[obj]
+        else:
+            del recorded[obj]
+    incremental["failed_objects"] = failed
+
+    if changed and not updates:
+        # 全オブジェクトが失敗した場合は前回と同じ内容のレビューを保存しない（次回も同じオブジェクトが対象になる）
+        logging.warning(f"Incremental review failed for all changed objects: {target_schema} {sorted(failed)}")
+        response_data = {
+            "success": False,
+            "message": f"差分レビュー失敗（変更された全オブジェクトのレビューに失敗）: {', '.join(sorted(failed))}",
+            "final_text": None,
+            "truncated": False,
+            "metadata": metadata,
+        }
+        return 500, response_data, failed_headers
+
+    with span("review_merge"):
+        final_text = await asyncio.to_thread(
+            merge_reports, target_schema, previous, updates, removed, base.path, metadata["review_date"]
+        )
+    with span("review_write"):
+        review_record = await asyncio.to_thread(store.save, target_schema, final_text, vault_hashes=recorded)
+    logging.info(f"Incremental review saved to: {review_record.path} (reviewed={sorted(updates)} failed={sorted(failed)})")
+
+    metadata.update(
+        review_file=review_record.path,
+        content_hash=review_record.content_hash,
+        duplicate=review_record.duplicate,
+        severity=review_record.severity,
+    )
+    message = f"差分レビュー完了（{len(updates)} / {len(current)} オブジェクトを再レビュー）"
+    if failed:
+        message += f"。レビューに失敗したオブジェクトは前回の指摘のまま: {', '.join(sorted(failed))}"
+    response_data = {
+        "success": True,
+        "message": message,
+        "final_text": final_text,
+        "truncated": False,
+        "metadata": metadata,
+    }
+    return 200, response_data, {}
+
+
+async def _run_review_job(job: ReviewJob) -> Tuple[int, dict]:
+    """バックグラウンドでレビューを実行する（処理時間の内訳は route=review_job として出力）"""
+    timer = RequestTimer("review_job")
+    activate(timer)
+    status = 500
+    try:
+        if job.target.get("incremental"):
+            status, response_data, _ = await _run_incremental_review(
+                job.target["target_schema"], job.target["max_tables"], on_event=job.on_event
+            )
+        else:
+            status, response_data, _ = await _run_schema_review(
+                job.target["target_schema"],
+                job.target["target_object"],
+                job.target["max_tables"],
+                on_event=job.on_event,
+            )
+        return status, response_data
+    finally:
+        timer.emit(status=status, job_id=job.id)
+
+
+def _review_job_links(job: ReviewJob) -> dict:
+    return {
+        "status_url": f"/api/review/jobs/{job.id}",
+        "result_url": f"/api/review/jobs/{job.id}/result",
+    }
 
-    target_schema = None
-    target_table = None     # 互換用
-    target_object = None    # ★追加：オブジェクト単位レビュー用
-    max_tables = None
 
+@app.route(route="review/schema", methods=["POST", "OPTIONS"])
+@_metered
+@_timed
+@_admitted
+async def review_schema_endpoint(req: Request) -> Response:
+    """
+    DB設計レビュー
+
+    既定ではジョブを登録して 202 と job_id をすぐ返し、レビューはバックグラウンドで実行する
+    （同じ対象のジョブが実行中ならそのジョブを返す）。
+    リクエストに "wait": true を指定すると、従来どおりレビュー完了まで待って結果を返す。
+    "incremental": true（スキーマ単位のみ）なら、前回のレビューから Vault が変わったオブジェクトだけをレビューする。
+    """
     logging.info("DB Review endpoint triggered")
 
     # ----------------------------
     # OPTIONS（CORS）
     # ----------------------------
     if req.method == "OPTIONS":
-        return func.HttpResponse(
+        return Response(
             status_code=200,
             headers={
                 "Access-Control-Allow-Origin": "*",
@@ -636,269 +1419,309 @@ def review_schema_endpoint(req: func.HttpRequest) -> func.HttpResponse:
         # ----------------------------
         # リクエストJSON取得
         # ----------------------------
-        req_body = req.get_json()
-        target_schema = req_body.get("target_schema")
-        target_table = req_body.get("target_table")          # 既存互換
-        target_object = req_body.get("target_object")        # ★新規
-        max_tables = req_body.get("max_tables")
-
-        # 互換：target_object 未指定なら target_table を採用（既存クライアント救済）
-        if not target_object and target_table:
-            target_object = target_table
+        with span("request_parse"):
+            req_body = await req.json()
+        target_schema, target_object, max_tables = _review_target(req_body)
 
         if not target_schema:
-            return func.HttpResponse(
-                json.dumps(
-                    {"success": False, "error": "target_schema パラメータが必要です"},
-                    ensure_ascii=False,
-                ),
-                mimetype="application/json",
+            return JSONResponse(
+                {"success": False, "error": "target_schema パラメータが必要です"},
                 status_code=400,
                 headers={"Access-Control-Allow-Origin": "*"},
             )
 
-        # ----------------------------
-        # Snowflake Cortex Agent 設定
-        # ----------------------------
-        base_url = os.getenv("SNOWFLAKE_ACCOUNT_URL", "").rstrip("/")
-        token = os.getenv("SNOWFLAKE_BEARER_TOKEN", "")
-        database = os.getenv("SNOWFLAKE_DATABASE", "")
-        schema = os.getenv("SNOWFLAKE_SCHEMA_REVIEW", os.getenv("SNOWFLAKE_SCHEMA", ""))
-        agent = os.getenv(
-            "SNOWFLAKE_AGENT_NAME_REVIEW",
-            os.getenv("SNOWFLAKE_AGENT_NAME", ""),
-        )
-
-        url = f"{base_url}/api/v2/databases/{database}/schemas/{schema}/agents/{agent}:run"
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "Accept": "text/event-stream",
-        }
-
-        # ----------------------------
-        # PARAMS_JSON（文字列前提 / null禁止）
-        # ----------------------------
-        params = {
-            "TARGET_SCHEMA": str(target_schema),
-            "MAX_TABLES": str(max_tables) if max_tables else "2000",
-        }
-
-        # ★重要：TARGET_OBJECT 指定時は tool 側が TARGET_TABLE を要求するため、同じ値を入れる
-        # instructions: "TARGET_TABLE は TARGET_OBJECT と同義として扱い、TARGET_OBJECT の値をそのまま渡す"
-        if target_object:
-            params["TARGET_OBJECT"] = str(target_object)
-            params["TARGET_TABLE"] = str(target_object)  # ★これが無いと Agent が tool を呼べない/迷う
+        incremental = bool(req_body.get("incremental")) and not target_object
 
-        # ----------------------------
-        # prompt（誤解させない・短め・PARAMS_JSON唯一入力を強調）
-        # ----------------------------
-        if target_object:
-            prompt = (
-                "以下の PARAMS_JSON を唯一の入力として、"
-                "OBSIDIAN_SCHEMA_DB_DESIGN_REVIEW_AGENT の定義に厳密に従い、静的設計レビューを実行してください。\n\n"
-                f"PARAMS_JSON:\n{json.dumps(params, ensure_ascii=False)}\n\n"
-                "注意:\n"
-                "- 今回は TARGET_OBJECT 指定のためオブジェクト単位レビュー（スキーマ全体レビューは禁止）\n"
-                "- オブジェクト単位レビュー手順に従い、最初は list_table_related_doc_paths を INCLUDE_COLUMNS=\"false\" で実行\n"
-                "- 推測禁止、Vault 根拠のみ使用\n"
+        if not req_body.get("wait"):
+            target = {"target_schema": target_schema, "target_object": target_object, "max_tables": max_tables}
+            key = (str(target_schema).upper(), str(target_object or "").upper(), str(max_tables or ""))
+            if incremental:
+                target["incremental"] = True
+                key += ("incremental",)
+            try:
+                job, deduplicated = get_review_job_store().submit(
+                    key, target, _run_review_job, owner=await _admission_key(req)
+                )
+            except AdmissionRejected as e:
+                return _review_job_rejected(e)
+            response_data = {
+                "success": True,
+                "job_id": job.id,
+                "status": job.status,
+                "deduplicated": deduplicated,
+                **_review_job_links(job),
+            }
+            return JSONResponse(
+                response_data,
+                status_code=202,
+                headers={"Access-Control-Allow-Origin": "*", "Location": response_data["status_url"]},
             )
+
+        if incremental:
+            status, response_data, headers = await _run_incremental_review(target_schema, max_tables)
         else:
-            prompt = (
-                "以下の PARAMS_JSON を唯一の入力として、"
-                "OBSIDIAN_SCHEMA_DB_DESIGN_REVIEW_AGENT の定義に厳密に従い、静的設計レビューを実行してください。\n\n"
-                f"PARAMS_JSON:\n{json.dumps(params, ensure_ascii=False)}\n\n"
-                "注意:\n"
-                "- TARGET_OBJECT 未指定のためスキーマ単位レビュー\n"
-                "- 推測禁止、Vault 根拠のみ使用\n"
+            status, response_data, headers = await _run_schema_review(target_schema, target_object, max_tables)
+        if _debug_requested(req, req_body):
+            response_data["timings"] = current_timer().summary()
+
+        with span("serialize"):
+            return JSONResponse(
+                response_data,
+                status_code=status,
+                headers={"Access-Control-Allow-Origin": "*", **headers},
             )
 
-        payload = {
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}],
-                }
-            ],
-            "tool_choice": {"type": "auto"},
-        }
+    except Exception as e:
+        logging.error(f"DB review error: {str(e)}")
+        return JSONResponse(
+            {"success": False, "error": str(e)},
+            status_code=500,
+            headers={"Access-Control-Allow-Origin": "*"},
+        )
 
-        # ----------------------------
-        # Cortex Agent 呼び出し（SSE）
-        # ----------------------------
-        r = requests.post(url, headers=headers, json=payload, timeout=120, stream=True)
-
-        if r.status_code >= 400:
-            return func.HttpResponse(
-                json.dumps(
-                    {
-                        "success": False,
-                        "error": f"Cortex Agent API error: {r.status_code}",
-                        "body": r.text,
-                    },
-                    ensure_ascii=False,
-                ),
-                mimetype="application/json",
-                status_code=500,
-                headers={"Access-Control-Allow-Origin": "*"},
-            )
 
-        content_chunks = []
-        delta_chunks = []
-        current_event = None
+@app.route(route="review/jobs/{job_id}", methods=["GET"])
+@_metered
+async def get_review_job(req: Request) -> Response:
+    """
+    レビュージョブの状態と進捗（受信イベント数・直近のツール呼び出し）を返す
+    """
+    job = get_review_job_store().get(req.path_params.get("job_id", ""))
+    if job is None:
+        return _json({"success": False, "error": "job not found"}, 404)
+    return _json({**job.to_dict(), **_review_job_links(job)})
 
-        for raw in r.iter_lines(decode_unicode=False):
-            if raw is None:
-                continue
 
-            try:
-                line = raw.decode("utf-8")
-            except Exception:
-                line = raw.decode("utf-8", errors="ignore")
+@app.route(route="review/jobs/{job_id}/result", methods=["GET"])
+@_metered
+async def get_review_job_result(req: Request) -> Response:
+    """
+    レビュージョブの結果を返す
 
-            # 既存仕様：streamの行ログは残す
-            logging.info(f"[review_schema_endpoint][stream] {line[:500]}")
-            content_chunks.append(line)
+    完了前は 202 と状態を返す。完了後は POST /review/schema（wait=true）と同じレスポンス。
+    クエリ format=markdown なら最終回答のMarkdownをそのまま返す。
+    """
+    job = get_review_job_store().get(req.path_params.get("job_id", ""))
+    if job is None:
+        return _json({"success": False, "error": "job not found"}, 404)
+    if job.active:
+        return _json({"success": False, "job_id": job.id, "status": job.status}, 202, {"Retry-After": "10"})
+
+    status, response_data = job.result
+    if (req.query_params.get("format") or "").lower() in ("md", "markdown") and response_data.get("final_text"):
+        return Response(
+            response_data["final_text"],
+            media_type="text/markdown; charset=utf-8",
+            status_code=status,
+            headers={"Access-Control-Allow-Origin": "*"},
+        )
+    return _json({**response_data, "job_id": job.id, "status": job.status}, status)
 
-            line = line.rstrip("\r")
 
-            if line == "":
-                current_event = None
-                continue
+# バッチレビューの SSE で、完了待ちの間に送るハートビートの間隔（フロントのアイドルタイムアウト対策）
+_BATCH_HEARTBEAT_SEC = 30
 
-            if line.startswith("event:"):
-                current_event = line[len("event:"):].strip()
-                logging.info(f"[review_schema_endpoint][event] {current_event}")
-                continue
 
-            if not line.startswith("data:"):
-                continue
+def _review_job_rejected(e: AdmissionRejected) -> Response:
+    """ジョブ登録の拒否（全体の上限は 503、ユーザーごとの上限は 429。どちらも Retry-After つき）"""
+    logging.warning(f"Review job rejected: {e}")
+    payload = {"success": False, "error": e.reason, "retry_after_sec": e.retry_after}
+    return _json(payload, 503 if e.reason == "overloaded" else 429, {"Retry-After": str(e.retry_after)})
 
-            data_str = line[len("data:"):].strip()
-            if data_str == "[DONE]":
-                logging.info("[review_schema_endpoint][done] [DONE]")
-                break
 
-            # ここから data: JSON のログ（必要分だけ）
-            # パースできない場合はそのままログ
-            try:
-                obj = json.loads(data_str)
-            except Exception:
-                logging.info(f"[review_schema_endpoint][data] {data_str[:500]}")
-                continue
+def _batch_targets(body: dict) -> list:
+    """
+    バッチの対象を (key, target) のリストにする
 
-            # --- thinking delta ---
-            if current_event == "response.thinking.delta":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    logging.info(f"[review_schema_endpoint][thinking.delta] {t[:500]}")
-                continue
+    targets の要素は "SCHEMA" / "SCHEMA.OBJECT" の文字列、または POST /review/schema と同じ形式の dict。
+    max_tables / incremental は要素に無ければ body の値を使う。同じ対象（大文字小文字は区別しない）は1回だけ実行する。
+    """
+    items = []
+    seen = set()
+    for t in body.get("targets") or []:
+        if isinstance(t, str):
+            schema, _, obj = t.partition(".")
+            t = {"target_schema": schema, "target_object": obj or None}
+        if not isinstance(t, dict):
+            raise ValueError(f"invalid target: {t!r}")
+        target_schema, target_object, max_tables = _review_target(t)
+        if not target_schema:
+            raise ValueError(f"target_schema is required: {t!r}")
+        if max_tables is None:
+            max_tables = body.get("max_tables")
+        target = {"target_schema": target_schema, "target_object": target_object, "max_tables": max_tables}
+        key = (str(target_schema).upper(), str(target_object or "").upper(), str(max_tables or ""))
+        if t.get("incremental", body.get("incremental")) and not target_object:
+            target["incremental"] = True
+            key += ("incremental",)
+        if key not in seen:
+            seen.add(key)
+            items.append((key, target))
+    return items
+
+
+def _batch_max_parallel(body: dict) -> Optional[int]:
+    """バッチの max_parallel（未指定なら None。整数でなければ ValueError）"""
+    value = body.get("max_parallel")
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid max_parallel: {value!r}")
 
-            # --- thinking final ---
-            if current_event == "response.thinking":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    logging.info(f"[review_schema_endpoint][thinking] {t[:2000]}")
-                continue
 
-            # --- response.text.delta（ログ＋蓄積）---
-            if current_event == "response.text.delta":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t:
-                    logging.info(f"[review_schema_endpoint][text.delta] {t[:500]}")
-                    delta_chunks.append(t)
-                continue
+def _batch_target_result(index: int, job: ReviewJob, deduplicated: bool) -> dict:
+    """完了したバッチ対象1件の結果（SSE の target_done とサマリの1行）"""
+    status, data = job.result or (500, {})
+    metadata = data.get("metadata") or {}
+    return {
+        "index": index,
+        "job_id": job.id,
+        "target": job.target,
+        "status": job.status,
+        "success": bool(data.get("success")) and status < 400,
+        "message": data.get("message") or data.get("error") or job.error,
+        "truncated": bool(data.get("truncated")),
+        "review_file": metadata.get("review_file"),
+        "duplicate": bool(metadata.get("duplicate")),
+        "severity": metadata.get("severity"),
+        "deduplicated": deduplicated,
+        "elapsed_sec": round(job.finished_at - job.started_at, 1) if job.started_at and job.finished_at else 0.0,
+    }
 
-            # --- response.text（ログ＋最終採用）---
-            if current_event == "response.text":
-                t = obj.get("text") if isinstance(obj, dict) else None
-                if isinstance(t, str) and t.strip():
-                    logging.info(f"[review_schema_endpoint][text] {t[:500]}")
-                    final_text = t
-                continue
 
-            # --- tool steps（tool_call / tool_start / tool_end 相当）---
-            if current_event in ("response.tool.call", "response.tool.start", "response.tool.end"):
-                tool_name = None
-                if isinstance(obj, dict):
-                    tool_name = obj.get("name") or obj.get("tool_name") or "unknown"
-                logging.info(f"[review_schema_endpoint][tool_step] {current_event} tool={tool_name}")
-                continue
+def _write_batch_summary(results: list, started: float) -> Path:
+    """バッチ全体のサマリを reviews/batches/BATCH_{ts}.md に保存する"""
+    ts = datetime.fromtimestamp(started)
+    lines = [
+        "---",
+        "type: review_batch",
+        f"review_date: {ts.strftime('%Y-%m-%d')}",
+        f"targets: {len(results)}",
+        "---",
+        "",
+        f"# DB設計レビュー バッチサマリ（{ts.strftime('%Y-%m-%d %H:%M:%S')}）",
+        "",
+        "| 対象 | 結果 | Critical | High | Med | Low | 所要秒 | レビュー |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    totals = {"critical": 0, "high": 0, "med": 0, "low": 0}
+    for r in sorted(results, key=lambda r: r["index"]):
+        t = r["target"]
+        name = f"{t['target_schema']}.{t['target_object']}" if t.get("target_object") else t["target_schema"]
+        sev = r["severity"] or {}
+        for k in totals:
+            totals[k] += sev.get(k, 0)
+        result = "成功" if r["success"] else ("途中まで" if r["truncated"] else "失敗")
+        link = f"[[{r['review_file'][:-3]}]]" if r["review_file"] else (r["message"] or "")
+        lines.append(
+            f"| {name} | {result} | {sev.get('critical', '-')} | {sev.get('high', '-')} | {sev.get('med', '-')} "
+            f"| {sev.get('low', '-')} | {r['elapsed_sec']} | {link} |"
+        )
+    lines += [
+        "",
+        f"合計: Critical {totals['critical']} / High {totals['high']} / Med {totals['med']} / Low {totals['low']}"
+        f"（成功 {sum(r['success'] for r in results)} / {len(results)} 件、経過 {time.time() - started:.1f} 秒）",
+        "",
+    ]
+    output_dir = get_review_store().root.parent / "batches"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_file = output_dir / f"BATCH_{ts.strftime('%Y%m%d_%H%M%S')}.md"
+    output_file.write_text("\n".join(lines), encoding="utf-8")
+    return output_file
+
+
+async def _relay_review_batch(items: list, max_parallel: int, owner: str) -> AsyncIterator[str]:
+    """
+    バッチの各対象をジョブとして実行し、登録・完了を SSE で送る
 
-            # --- tool result ---
-            if current_event == "response.tool_result":
-                # 全文は重いので先頭だけ（既存方針に合わせる）
-                logging.info(
-                    f"[review_schema_endpoint][tool_result] {json.dumps(obj, ensure_ascii=False)[:500]}"
-                )
+    start → (target_start | target_done)* → done。完了待ちの間は SSE コメントでハートビートを送る。
+    クライアントが切断した場合、まだ登録していない対象は取りやめる（登録済みのジョブは最後まで実行する）。
+    """
+    batch = get_review_job_store().batch(items, _run_review_job, max_parallel, owner)
+    results = []
+    yield _sse("start", {"targets": [t for _, t in items], "max_parallel": max_parallel})
+    try:
+        while not batch.finished:
+            event = await batch.next_event(_BATCH_HEARTBEAT_SEC)
+            if event is None:
+                yield ": keep-alive\n\n"
                 continue
+            kind, index, job, deduplicated = event
+            if kind == batch.SUBMITTED:
+                yield _sse(
+                    "target_start",
+                    {"index": index, "job_id": job.id, "target": job.target, "deduplicated": deduplicated,
+                     **_review_job_links(job)},
+                )
+            else:
+                result = _batch_target_result(index, job, deduplicated)
+                results.append(result)
+                yield _sse("target_done", result)
+
+        summary_file = _write_batch_summary(results, batch.started_at)
+        logging.info(f"Review batch summary saved to: {summary_file}")
+        yield _sse(
+            "done",
+            {
+                "targets": len(results),
+                "succeeded": sum(r["success"] for r in results),
+                "failed": sum(not r["success"] for r in results),
+                "summary_file": summary_file.name,
+                "elapsed_sec": round(time.time() - batch.started_at, 1),
+            },
+        )
+    except Exception as e:
+        logging.exception("Review batch failed")
+        yield _sse("error", {"error": "internal_error", "message": str(e)})
+    finally:
+        batch.cancel()
 
-            # その他イベント（念のためログ）
-            logging.info(
-                f"[review_schema_endpoint][event_data] event={current_event} data={json.dumps(obj, ensure_ascii=False)[:300]}"
-            )
-
-        # response.text が来ない場合は delta を最終回答にする
-        if not final_text.strip() and delta_chunks:
-            final_text = "".join(delta_chunks).strip()
-
-        markdown = "\n".join(content_chunks)
-        success = bool(final_text.strip())
-
-        if not success:
-            message = "最終回答（response.text / response.text.delta）を取得できませんでした"
-
-        # ----------------------------
-        # ファイル保存（最終回答のみ）
-        # 先頭空白行があれば削除
-        # ----------------------------
-        if success:
-            # 既存 util を使う想定（この関数はファイル上のどこかに既にある前提）
-            final_text = _strip_leading_blank_lines(final_text)
-
-            output_dir = (
-                Path(__file__).parent.parent.parent.parent
-                / "docs" / "snowflake" / "chatdemo" / "reviews" / "schemas"
-            )
-            output_dir.mkdir(parents=True, exist_ok=True)
-
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            schema_name = str(target_schema).replace("/", "_").replace(".", "_")
-
-            obj_part = ""
-            if target_object:
-                obj_part = "_" + str(target_object).replace("/", "_").replace(".", "_")
 
-            output_file = output_dir / f"{schema_name}{obj_part}_{ts}.md"
-            output_file.write_text(final_text, encoding="utf-8")
+@app.route(route="review/batch", methods=["POST", "OPTIONS"])
+@_metered
+@_timed
+@_admitted
+async def review_batch_endpoint(req: Request) -> Response:
+    """
+    複数スキーマ・オブジェクトのDB設計レビューをまとめて実行する（SSE）
 
-            logging.info(f"Review saved to: {output_file}")
+    各対象は POST /review/schema と同じジョブとして登録し、バッチ内の同時実行数を max_parallel までにする。
+    対象ごとの完了を target_done で送り、最後にサマリ（reviews/batches/BATCH_{ts}.md）を書いて done を送る。
+    全体の所要時間は、同時実行数が対象数以上なら最も遅い対象とほぼ同じになる。
+    """
+    logging.info("DB Review batch endpoint triggered")
 
-        response_data = {
-            "success": success,
-            "message": message,
-            "final_text": final_text,
-            "metadata": {
-                "target_schema": target_schema,
-                "target_object": target_object,
-                "max_tables": max_tables,
-                "review_date": datetime.now().strftime("%Y-%m-%d"),
-            },
-        }
+    if req.method == "OPTIONS":
+        return Response(status_code=204, headers=CORS_HEADERS)
 
-        return func.HttpResponse(
-            json.dumps(response_data, ensure_ascii=False),
-            mimetype="application/json",
-            status_code=200 if success else 500,
-            headers={"Access-Control-Allow-Origin": "*"},
-        )
+    with span("request_parse"):
+        try:
+            body = await req.json()
+        except Exception:
+            body = {}
 
-    except Exception as e:
-        logging.error(f"DB review error: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"success": False, "error": str(e)}, ensure_ascii=False),
-            mimetype="application/json",
-            status_code=500,
-            headers={"Access-Control-Allow-Origin": "*"},
-        )
+    if not isinstance(body, dict):
+        body = {}
+    try:
+        items = _batch_targets(body)
+        max_parallel = _batch_max_parallel(body)
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400, headers=CORS_HEADERS)
+    if not items:
+        return JSONResponse({"success": False, "error": "targets パラメータが必要です"}, status_code=400, headers=CORS_HEADERS)
+
+    store = get_review_job_store()
+    owner = await _admission_key(req)
+    try:
+        store.check_capacity(owner)
+    except AdmissionRejected as e:
+        return _review_job_rejected(e)
+    limit = min(store.max_concurrency, store.max_active_per_owner)
+    max_parallel = max(1, min(max_parallel or store.max_concurrency, limit))
+    return StreamingResponse(
+        _relay_review_batch(items, max_parallel, owner),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
@@ -0,0 +1,270 @@
+"""
+Snowflake向けHTTP接続プール
+
+Cortex Agent / SQL API 呼び出しで共有するプロセス単位の requests.Session と
+aiohttp.ClientSession（async エンドポイント用）を提供する。
+ルートごとに requests.post を呼ぶとリクエストのたびに TCP+TLS ハンドシェイクが
+発生するため、keep-alive 付きの接続プールを全エンドポイントで使い回す。
+ヒット/ミス件数は同期・非同期の両プール合算で計測する。
+非同期プールでは、実行中のリクエストの RequestTimer（request_timing.py）に
+接続取得（connection_acquire）と応答ヘッダ受信まで（snowflake_ttfb）のスパンも記録する。
+
+設定（環境変数）:
+    SNOWFLAKE_HTTP_POOL_CONNECTIONS: キャッシュするホスト別プール数（既定: 4）
+    SNOWFLAKE_HTTP_POOL_MAXSIZE: ホストあたりの最大接続数（既定: 32）
+    SNOWFLAKE_HTTP_POOL_BLOCK: 上限到達時に空きを待つか（既定: false）
+    SNOWFLAKE_HTTP_KEEPALIVE_SEC: TCP keep-alive のアイドル秒数（既定: 60）
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from request_timing import current_timer
+
+
+class _PoolCounters:
+    """接続プールのヒット/ミス件数（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def on_get(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def on_new(self) -> None:
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            total = self.requests
+            misses = min(self.new_connections, total)
+        return {
+            "requests": total,
+            "hits": total - misses,
+            "misses": misses,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.new_connections = 0
+
+
+_counters = _PoolCounters()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        _counters.on_get()
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _counters.on_new()
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        _counters.on_get()
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _counters.on_new()
+        return super()._new_conn()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        logging.warning(f"Invalid {name}, fallback to {default}")
+        return default
+
+
+def _keepalive_socket_options(idle_sec: int) -> List[Tuple[int, int, int]]:
+    """TCP keep-alive を有効化するソケットオプション（OSが対応する範囲のみ）"""
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle_sec))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle_sec // 4)))
+    return options
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """ヒット/ミス計測と TCP keep-alive を備えた HTTPAdapter"""
+
+    def __init__(self, keepalive_sec: int = 60, **kwargs):
+        self._keepalive_sec = keepalive_sec
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs["socket_options"] = _keepalive_socket_options(self._keepalive_sec)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def pool_settings() -> Dict[str, int]:
+    """環境変数から接続プール設定を取得"""
+    return {
+        "pool_connections": _env_int("SNOWFLAKE_HTTP_POOL_CONNECTIONS", 4),
+        "pool_maxsize": _env_int("SNOWFLAKE_HTTP_POOL_MAXSIZE", 32),
+        "pool_block": os.getenv("SNOWFLAKE_HTTP_POOL_BLOCK", "false").lower() == "true",
+        "keepalive_sec": _env_int("SNOWFLAKE_HTTP_KEEPALIVE_SEC", 60),
+    }
+
+
+def _build_session() -> requests.Session:
+    settings = pool_settings()
+    adapter = PooledHTTPAdapter(
+        keepalive_sec=settings["keepalive_sec"],
+        pool_connections=settings["pool_connections"],
+        pool_maxsize=settings["pool_maxsize"],
+        pool_block=settings["pool_block"],
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    logging.info(f"HTTP pool initialized: {settings}")
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    プロセス共有の requests.Session を取得する
+
+    Returns:
+        keep-alive 接続プールを持つ requests.Session（初回呼び出し時に生成）
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+_async_session: Optional[aiohttp.ClientSession] = None
+_async_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _on_request_start(session, ctx, params) -> None:
+    timer = current_timer()
+    if timer is not None:
+        timer.begin("connection_acquire", key=id(ctx))
+        timer.begin("snowflake_ttfb", key=id(ctx), method=params.method, path=params.url.path)
+
+
+async def _on_connection_create_end(session, ctx, params) -> None:
+    _counters.on_get()
+    _counters.on_new()
+    timer = current_timer()
+    if timer is not None:
+        timer.end("connection_acquire", key=id(ctx), reused=False)
+
+
+async def _on_connection_reuseconn(session, ctx, params) -> None:
+    _counters.on_get()
+    timer = current_timer()
+    if timer is not None:
+        timer.end("connection_acquire", key=id(ctx), reused=True)
+
+
+async def _on_request_end(session, ctx, params) -> None:
+    timer = current_timer()
+    if timer is not None:
+        timer.end("snowflake_ttfb", key=id(ctx), status=params.response.status)
+
+
+async def _on_request_exception(session, ctx, params) -> None:
+    timer = current_timer()
+    if timer is not None:
+        timer.end("connection_acquire", key=id(ctx), error=type(params.exception).__name__)
+        timer.end("snowflake_ttfb", key=id(ctx), error=type(params.exception).__name__)
+
+
+def _build_async_session() -> aiohttp.ClientSession:
+    settings = pool_settings()
+    connector = aiohttp.TCPConnector(
+        limit=settings["pool_connections"] * settings["pool_maxsize"],
+        limit_per_host=settings["pool_maxsize"],
+        keepalive_timeout=settings["keepalive_sec"],
+        enable_cleanup_closed=True,
+    )
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    logging.info(f"Async HTTP pool initialized: {settings}")
+    return aiohttp.ClientSession(
+        connector=connector,
+        trace_configs=[trace_config],
+        headers={"Connection": "keep-alive"},
+    )
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """
+    プロセス共有の aiohttp.ClientSession を取得する
+
+    aiohttp のセッションはイベントループに紐づくため、実行中のループが
+    変わった場合（テストでの asyncio.run 等）は作り直す。
+
+    Returns:
+        keep-alive 接続プールを持つ aiohttp.ClientSession
+    """
+    global _async_session, _async_session_loop
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session.closed or _async_session_loop is not loop:
+        _async_session = _build_async_session()
+        _async_session_loop = loop
+    return _async_session
+
+
+def get_pool_stats() -> Dict[str, object]:
+    """
+    接続プールの利用状況を取得する
+
+    Returns:
+        {"requests": N, "hits": N, "misses": N, "hit_ratio": float, "settings": {...}}
+        misses は新規 TCP 接続（ハンドシェイク）の回数
+    """
+    stats: Dict[str, object] = dict(_counters.snapshot())
+    total = stats["requests"]
+    stats["hit_ratio"] = round(stats["hits"] / total, 4) if total else 0.0
+    stats["settings"] = pool_settings()
+    return stats
+
+
+def reset_session() -> None:
+    """共有セッションを破棄して計測値をリセットする（設定変更・テスト用）"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _counters.reset()
@@ -0,0 +1,307 @@
+"""
+チャットメッセージのインメモリストア（/messages 用）
+
+固定長のリングバッファにメッセージを保持し、ユーザー別・会話別・ユーザー×会話別のインデックスで
+最新 limit 件をO(limit)で返す。各メッセージには単調増加の id を振り、
+before / after をカーソルとしたページングに使う（チャットUIのポーリングは after）。
+容量を超えた古いメッセージはリングバッファとインデックスの両方から捨てる。
+
+起動時のバックフィル元として、conversation_log.py が送信した NDJSON ログ
+（ローカルディレクトリまたは s3://bucket/prefix）を読み込むバックエンドを差し込める。
+バックフィルはファイル・S3 の読み込みを伴うため、非同期ハンドラからは aget_message_store() で
+ワーカースレッド上で行う（イベントループを止めない）。
+
+設定（環境変数）:
+    CHAT_MESSAGES_CAPACITY: 保持する最大メッセージ数（既定: 10000）
+    CHAT_MESSAGES_BACKEND: バックフィル元（ディレクトリ or s3://bucket/prefix、未設定なら無し）
+    CHAT_MESSAGES_BACKFILL_HOURS: S3 から読み込む直近の時間数（既定: 24）
+"""
+import asyncio
+import bisect
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from conversation_log import S3_PREFIX
+
+
+class _IdIndex:
+    """
+    昇順の id リスト（先頭からの削除は head をずらして償却O(1)）
+    """
+
+    __slots__ = ("ids", "head")
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.head = 0
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.head
+
+    def append(self, msg_id: int) -> None:
+        self.ids.append(msg_id)
+
+    def pop_left(self) -> None:
+        self.head += 1
+        if self.head > 64 and self.head * 2 > len(self.ids):
+            del self.ids[:self.head]
+            self.head = 0
+
+    def page(self, limit: int, before: Optional[int], after: Optional[int]) -> List[int]:
+        """条件に合う id を新しい順に最大 limit 件返す"""
+        ids, lo = self.ids, self.head
+        if after is not None:
+            start = bisect.bisect_right(ids, after, lo)
+            stop = len(ids) if before is None else bisect.bisect_left(ids, before, start)
+            return ids[start:min(stop, start + limit)][::-1]
+        stop = len(ids) if before is None else bisect.bisect_left(ids, before, lo)
+        return ids[max(lo, stop - limit):stop][::-1]
+
+
+class MessageStore:
+    """
+    リングバッファ + ユーザー別 / 会話別 / ユーザー×会話別インデックスのメッセージストア（スレッドセーフ）
+
+    Args:
+        capacity: 保持する最大メッセージ数
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = max(1, capacity)
+        self._ring: List[Optional[Dict[str, Any]]] = [None] * self.capacity
+        self._next_id = 1
+        self._all = _IdIndex()
+        self._by_user: Dict[str, _IdIndex] = {}
+        self._by_conversation: Dict[str, _IdIndex] = {}
+        self._by_user_conversation: Dict[Tuple[str, str], _IdIndex] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._all)
+
+    @property
+    def latest_id(self) -> Optional[int]:
+        return self._next_id - 1 if self._next_id > 1 else None
+
+    def add(
+        self,
+        user_id: Optional[str],
+        message: str,
+        ai_response: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        timestamp: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """メッセージを追加する（容量超過時は最も古いものを捨てる）"""
+        # インデックスのキーと捨てる際のキーを揃えるため、ユーザー未指定はここで正規化する
+        user_id = user_id or "anonymous"
+        with self._lock:
+            msg_id = self._next_id
+            self._next_id += 1
+            record = {
+                "id": msg_id,
+                "user_id": user_id,
+                "conversation_id": conversation_id,
+                "message": message,
+                "ai_response": ai_response,
+                "timestamp": timestamp or datetime.now().isoformat(),
+            }
+            slot = msg_id % self.capacity
+            evicted = self._ring[slot]
+            if evicted is not None:
+                self._evict(evicted)
+            self._ring[slot] = record
+            self._all.append(msg_id)
+            self._by_user.setdefault(user_id, _IdIndex()).append(msg_id)
+            if conversation_id:
+                self._by_conversation.setdefault(conversation_id, _IdIndex()).append(msg_id)
+                self._by_user_conversation.setdefault((user_id, conversation_id), _IdIndex()).append(msg_id)
+            return record
+
+    def _evict(self, record: Dict[str, Any]) -> None:
+        # インデックスは id の昇順なので、捨てるメッセージは常に各インデックスの先頭
+        self._all.pop_left()
+        conversation_id = record["conversation_id"]
+        for index_map, key in (
+            (self._by_user, record["user_id"]),
+            (self._by_conversation, conversation_id),
+            (self._by_user_conversation, (record["user_id"], conversation_id) if conversation_id else None),
+        ):
+            index = index_map.get(key) if key else None
+            if index is None:
+                continue
+            index.pop_left()
+            if not index:
+                del index_map[key]
+
+    def query(
+        self,
+        limit: int = 50,
+        user_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        メッセージを新しい順に最大 limit 件返す
+
+        Args:
+            user_id / conversation_id: 絞り込み（両方指定時はそのユーザーの、その会話のメッセージのみ。
+                どちらも無ければ全ユーザーのメッセージを返すため、呼び出し側で公開範囲を制限すること）
+            before: この id より古いもの（前のページ）
+            after: この id より新しいもの（ポーリング。after 直後から limit 件）
+
+        Returns:
+            (messages, next_before) next_before は続きを取得する際の before（無ければ None）
+        """
+        limit = max(0, limit)
+        with self._lock:
+            if conversation_id and user_id:
+                # 他のユーザーの会話は返さない（絞り込みをページングの前に行い、件数と next_before を正しくする）
+                index = self._by_user_conversation.get((user_id, conversation_id))
+            elif conversation_id:
+                index = self._by_conversation.get(conversation_id)
+            elif user_id:
+                index = self._by_user.get(user_id)
+            else:
+                index = self._all
+            if index is None or limit == 0:
+                return [], None
+            ids = index.page(limit, before, after)
+            ring, cap = self._ring, self.capacity
+            messages = [ring[i % cap] for i in ids]
+            next_before = ids[-1] if len(ids) == limit and ids[-1] > index.ids[index.head] else None
+            return messages, next_before
+
+    def load(self, records: Iterable[Dict[str, Any]]) -> int:
+        """バックエンドから読み込んだメッセージを古い順に追加する"""
+        count = 0
+        for r in records:
+            self.add(
+                r.get("user_id"),
+                r.get("message") or "",
+                r.get("ai_response"),
+                conversation_id=r.get("conversation_id"),
+                timestamp=r.get("timestamp"),
+            )
+            count += 1
+        return count
+
+
+class NDJSONLogBackend:
+    """
+    conversation_log.py が送信した会話ログ（NDJSON、.json / .json.gz）からメッセージを復元する
+
+    user 行と続く assistant 行（同じ conversation_id）を1メッセージにまとめる。
+
+    Args:
+        source: ログのディレクトリ、または s3://bucket/prefix（prefix 省略時は cortex_conversations）
+        backfill_hours: S3 の場合に読み込む直近の時間パーティション数
+    """
+
+    def __init__(self, source: str, backfill_hours: int = 24):
+        self.source = source
+        self.backfill_hours = backfill_hours
+
+    def load(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """メッセージを古い順に返す（limit 指定時は新しい方から limit 件）"""
+        lines: List[Dict[str, Any]] = []
+        for blob in self._blobs():
+            if blob[:2] == b"\x1f\x8b":
+                blob = gzip.decompress(blob)
+            for raw in blob.splitlines():
+                if raw.strip():
+                    try:
+                        lines.append(json.loads(raw))
+                    except ValueError:
+                        continue
+        lines.sort(key=lambda r: r.get("timestamp") or "")
+        messages = list(_pair_turns(lines))
+        return messages[-limit:] if limit else messages
+
+    def _blobs(self) -> Iterator[bytes]:
+        if self.source.startswith("s3://"):
+            yield from self._s3_blobs()
+            return
+        for root, _, files in os.walk(self.source):
+            for name in sorted(files):
+                if name.endswith((".json", ".json.gz", ".jsonl")):
+                    with open(os.path.join(root, name), "rb") as f:
+                        yield f.read()
+
+    def _s3_blobs(self) -> Iterator[bytes]:
+        from s3_upload import get_s3_client
+
+        bucket, _, prefix = self.source[len("s3://"):].partition("/")
+        prefix = (prefix or S3_PREFIX).rstrip("/")
+        s3 = get_s3_client()
+        paginator = s3.get_paginator("list_objects_v2")
+        now = datetime.utcnow()
+        for h in range(self.backfill_hours - 1, -1, -1):
+            partition = (now - timedelta(hours=h)).strftime("YEAR=%Y/MONTH=%m/DAY=%d/HOUR=%H")
+            for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/{partition}/"):
+                for obj in page.get("Contents", []):
+                    yield s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+
+
+def _pair_turns(lines: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    pending: Dict[Any, Dict[str, Any]] = {}
+    for r in lines:
+        conv = r.get("conversation_id")
+        text = (r.get("message_content") or {}).get("text")
+        if r.get("message_role") == "user":
+            if conv in pending:
+                yield pending.pop(conv)
+            pending[conv] = {
+                "user_id": r.get("user_id"),
+                "conversation_id": conv,
+                "message": text,
+                "ai_response": None,
+                "timestamp": r.get("timestamp"),
+            }
+        elif r.get("message_role") == "assistant" and conv in pending:
+            msg = pending.pop(conv)
+            msg["ai_response"] = text
+            yield msg
+    yield from pending.values()
+
+
+_store: Optional[MessageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_message_store() -> MessageStore:
+    """
+    プロセス共有の MessageStore を取得する（初回に CHAT_MESSAGES_BACKEND からバックフィル）
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = MessageStore(int(os.getenv("CHAT_MESSAGES_CAPACITY", "10000")))
+                source = os.getenv("CHAT_MESSAGES_BACKEND")
+                if source:
+                    try:
+                        backend = NDJSONLogBackend(
+                            source,
+                            backfill_hours=int(os.getenv("CHAT_MESSAGES_BACKFILL_HOURS", "24")),
+                        )
+                        loaded = store.load(backend.load(limit=store.capacity))
+                        logging.info(f"Message store backfilled: {loaded} messages from {source}")
+                    except Exception as e:
+                        logging.error(f"Message store backfill error: {e}")
+                _store = store
+    return _store
+
+
+async def aget_message_store() -> MessageStore:
+    """
+    get_message_store() の非同期版（初回のバックフィルをワーカースレッドで行う）
+    """
+    if _store is not None:
+        return _store
+    return await asyncio.to_thread(get_message_store)
@@ -0,0 +1,302 @@
+"""
+プロセス内メトリクス（Prometheus / OpenMetrics テキスト形式で /metrics に公開）
+
+ログの文字列と Application Insights のサンプリング（host.json で 20件/秒）だけでは
+件数・分布が追えないため、カウンタ・ゲージ・ヒストグラムをプロセス内に持ち、
+GET /api/metrics でまとめて返す。
+
+常時有効にしておけるよう、記録側はロック1回と dict 更新だけにしている。
+SSEイベント種類ごとの件数のようにイベント単位で発生するものは、
+ストリーム側でまとめて数えて終了時に1回だけ加算する。
+接続プール・受付制御・サーキットブレーカーの状態は取得時（scrape）に各モジュールから読む。
+
+メトリクス:
+    chatdemo_http_requests_total{route, status}: エンドポイント別のリクエスト数
+    chatdemo_agent_run_duration_seconds{mode, outcome}: Agent実行の所要時間（mode: run / stream）
+    chatdemo_agent_sse_events_total{event}: Agentから受信したSSEイベント数（種類別）
+    chatdemo_agent_tool_calls_total{tool_name, status}: ツール呼び出し数
+    chatdemo_agent_tool_duration_seconds{tool_name}: ツール呼び出しの所要時間
+    chatdemo_s3_upload_duration_seconds{outcome}: S3アップロードの所要時間
+    chatdemo_active_streams{kind}: 実行中のストリーム数（agent: Agentからの受信 / client: クライアントへのSSE送信）
+"""
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒単位の既定バケット（Agent実行は数十秒〜15分かかるため上側を厚くする）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 900)
+
+Sample = Tuple[Dict[str, str], float]
+Collected = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """単調増加のカウンタ（ラベル値の組ごと）"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(_Metric):
+    """増減する現在値"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items
+        ]
+
+
+class Histogram(_Metric):
+    """
+    累積バケットのヒストグラム
+
+    記録時はバケット位置を二分探索して該当1件だけ加算し、累積は出力時に計算する。
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値の組 -> [バケット別件数（最後は +Inf）, 合計, 件数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(labels)
+            return entry[2] if entry else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        lines = self._header()
+        bounds = [*self.buckets, math.inf]
+        for labels, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(bounds, counts):
+                cumulative += c
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスと取得時に値を読むコレクタの登録先"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Collected]]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Collected]]) -> None:
+        """
+        取得時に呼ぶコレクタを登録する
+
+        collector は (name, type, help, [(labels, value), ...]) を返す。
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus テキスト形式（末尾は改行）"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {_escape(str(e))}")
+                continue
+            for name, kind, help_text, samples in collected:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """プロセス共有の MetricsRegistry を取得する"""
+    return _registry
+
+
+HTTP_REQUESTS = _registry.counter(
+    "chatdemo_http_requests_total", "HTTP requests by route and status", ("route", "status")
+)
+AGENT_RUN_DURATION = _registry.histogram(
+    "chatdemo_agent_run_duration_seconds", "Cortex Agent run duration", ("mode", "outcome")
+)
+AGENT_SSE_EVENTS = _registry.counter(
+    "chatdemo_agent_sse_events_total", "SSE events received from Cortex Agent by type", ("event",)
+)
+AGENT_TOOL_CALLS = _registry.counter(
+    "chatdemo_agent_tool_calls_total", "Cortex Agent tool calls", ("tool_name", "status")
+)
+AGENT_TOOL_DURATION = _registry.histogram(
+    "chatdemo_agent_tool_duration_seconds", "Cortex Agent tool call duration", ("tool_name",)
+)
+S3_UPLOAD_DURATION = _registry.histogram(
+    "chatdemo_s3_upload_duration_seconds", "S3 upload latency", ("outcome",)
+)
+ACTIVE_STREAMS = _registry.gauge(
+    "chatdemo_active_streams", "Streams in progress (agent: receiving from Cortex Agent, client: sending SSE)", ("kind",)
+)
+
+
+def _collect_runtime() -> Iterable[Collected]:
+    """接続プール・受付制御・サーキットブレーカーの現在値"""
+    from admission import get_admission_controller
+    from http_pool import get_pool_stats
+    from resilience import get_breaker_stats
+
+    pool = get_pool_stats()
+    yield "chatdemo_http_pool_requests_total", "counter", "HTTP pool connection checkouts", [({}, pool["requests"])]
+    yield "chatdemo_http_pool_new_connections_total", "counter", "New TCP+TLS connections", [({}, pool["misses"])]
+
+    controller = get_admission_controller()
+    if controller is not None:
+        stats = controller.stats()
+        yield "chatdemo_admission_active", "gauge", "Agent runs holding an admission slot", [({}, stats["active"])]
+        yield "chatdemo_admission_waiting", "gauge", "Requests waiting for an admission slot", [({}, stats["waiting"])]
+        yield "chatdemo_admission_rejected_total", "counter", "Requests rejected by admission control", [
+            ({"reason": reason}, stats[reason]) for reason in ("rate_limited", "overloaded")
+        ]
+
+    breakers = get_breaker_stats()
+    if breakers:
+        yield "chatdemo_circuit_breaker_state", "gauge", "Circuit breaker state (1 for the current state)", [
+            ({"breaker": name, "state": state}, 1 if s["state"] == state else 0)
+            for name, s in sorted(breakers.items())
+            for state in ("closed", "open", "half_open")
+        ]
+
+
+_registry.register_collector(_collect_runtime)
+
+
+def observe_tool_call(tool_name: str, status: Optional[str], duration_sec: Optional[float]) -> None:
+    """ツール呼び出し1件を記録する（所要時間が分からなければ件数のみ）"""
+    AGENT_TOOL_CALLS.inc(tool_name, status or "unknown")
+    if duration_sec is not None:
+        AGENT_TOOL_DURATION.observe(duration_sec, tool_name)
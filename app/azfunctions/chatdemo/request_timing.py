@@ -0,0 +1,122 @@
+"""
+リクエスト単位の処理時間の内訳（タイミングスパン）
+
+1ターン10〜60秒の内訳（リクエスト解析・受付待ち・接続取得・Snowflake の TTFB・
+最初のイベント / テキスト・各ツール呼び出し・最後のイベント・会話ログ書き込み・
+レスポンス生成）を記録し、リクエストの終わりに1行の構造化ログとして出力する。
+debug 指定時はレスポンスJSONにも同じ内訳を付ける（レスポンス生成自体はログのみ）。
+
+現在のリクエストの RequestTimer は contextvars で保持するため、
+http_pool の aiohttp トレースフックなど呼び出し階層の深い所からも記録できる。
+
+ログ形式（1リクエスト1行）:
+    request_timing {"route": "chat_stream", "status": 200, "total_ms": 12345.6,
+                    "spans": [{"name": "agent_open", "start_ms": 1.2, "duration_ms": 850.3}, ...],
+                    "marks": {"first_event": 910.4, ...}}
+"""
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Hashable, Iterator, List, Optional, Tuple
+
+_current: contextvars.ContextVar[Optional["RequestTimer"]] = contextvars.ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """
+    1リクエスト分のスパン（開始・所要時間）とマーク（時点）を記録する
+
+    時刻はリクエスト開始からのミリ秒。スパンは開始順に並ぶ。
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self._t0 = time.perf_counter()
+        self._spans: List[Dict[str, Any]] = []
+        self._open: Dict[Tuple[str, Hashable], Tuple[float, Dict[str, Any]]] = {}
+        self.marks: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def begin(self, name: str, key: Hashable = None, **attrs: Any) -> None:
+        """スパンを開始する（同じ name / key のスパンが開いていれば何もしない）"""
+        self._open.setdefault((name, key), (self.elapsed_ms(), attrs))
+
+    def is_open(self, name: str, key: Hashable = None) -> bool:
+        return (name, key) in self._open
+
+    def end(self, name: str, key: Hashable = None, **attrs: Any) -> None:
+        """begin したスパンを終える（開いていなければ何もしない）"""
+        opened = self._open.pop((name, key), None)
+        if opened is None:
+            return
+        start, begin_attrs = opened
+        self._spans.append(
+            {"name": name, "start_ms": start, "duration_ms": round(self.elapsed_ms() - start, 1), **begin_attrs, **attrs}
+        )
+
+    def record(self, name: str, start_ms: float, duration_ms: float, **attrs: Any) -> None:
+        """開始時刻と所要時間が分かっているスパンを追加する"""
+        self._spans.append({"name": name, "start_ms": round(start_ms, 1), "duration_ms": round(duration_ms, 1), **attrs})
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[None]:
+        """with ブロックの所要時間をスパンとして記録する"""
+        start = self.elapsed_ms()
+        try:
+            yield
+        finally:
+            self._spans.append(
+                {"name": name, "start_ms": start, "duration_ms": round(self.elapsed_ms() - start, 1), **attrs}
+            )
+
+    def mark(self, name: str, once: bool = True) -> None:
+        """時点を記録する（once=True なら最初の1回のみ、False なら上書き）"""
+        if not once or name not in self.marks:
+            self.marks[name] = self.elapsed_ms()
+
+    def summary(self) -> Dict[str, Any]:
+        """スパンとマークの内訳（終わっていないスパンは open として含める）"""
+        now = self.elapsed_ms()
+        spans = list(self._spans)
+        for (name, _), (start, attrs) in self._open.items():
+            spans.append({"name": name, "start_ms": start, "duration_ms": round(now - start, 1), "open": True, **attrs})
+        spans.sort(key=lambda s: s["start_ms"])
+        return {"route": self.route, **self.fields, "total_ms": now, "spans": spans, "marks": dict(self.marks)}
+
+    def emit(self, **fields: Any) -> None:
+        """内訳を1行の構造化ログとして出力する"""
+        self.fields.update(fields)
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("request_timing %s", json.dumps(self.summary(), ensure_ascii=False, separators=(",", ":")))
+
+
+def current_timer() -> Optional[RequestTimer]:
+    """実行中のリクエストの RequestTimer（無ければ None）"""
+    return _current.get()
+
+
+def activate(timer: RequestTimer) -> contextvars.Token:
+    """timer を現在のコンテキストのリクエストとして設定する（戻り値は deactivate に渡す）"""
+    return _current.set(timer)
+
+
+def deactivate(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def span(name: str, **attrs: Any) -> ContextManager[None]:
+    """現在のリクエストのスパンを記録する with 用コンテキスト（リクエスト外なら何もしない）"""
+    timer = _current.get()
+    return timer.span(name, **attrs) if timer is not None else nullcontext()
+
+
+def mark(name: str, once: bool = True) -> None:
+    """現在のリクエストに時点を記録する（リクエスト外なら何もしない）"""
+    timer = _current.get()
+    if timer is not None:
+        timer.mark(name, once)
@@ -0,0 +1,346 @@
+"""
+Snowflake（Cortex Agent / SQL API）呼び出しの再試行とサーキットブレーカー
+
+429 / 5xx や接続失敗といった一時的な失敗は、そのまま利用者にエラーを返すより
+少し待って再送した方が成功率が高い。ここでは指数バックオフ + ジッタ（full jitter）で
+再試行し、応答に Retry-After があればそれ以上待つ。再試行するのは
+「ストリームを受け取る前」の失敗だけで、Agent の :run（読み取りのみ）、
+SQL API の GET（ポーリング・パーティション取得）、requestId 付きの文投入が対象。
+
+アカウント側が劣化している間は、再試行が負荷をさらに上げてしまうため、
+連続失敗が閾値を超えたらサーキットを開き、一定時間は呼び出さずに即座に失敗させる。
+時間が経ったら1件だけ試し（half-open）、成功すれば閉じる。
+読み取りタイムアウトは再試行しないがサーキットの失敗として数え、4xx の応答は成功として扱う。
+
+設定（環境変数）:
+    SNOWFLAKE_RETRY_MAX_ATTEMPTS: 最大試行回数（既定: 4、1で再試行しない）
+    SNOWFLAKE_RETRY_BASE_DELAY_SEC: バックオフの初期値（既定: 0.5）
+    SNOWFLAKE_RETRY_MAX_DELAY_SEC: 1回あたりの待ち時間の上限（既定: 8）
+    SNOWFLAKE_RETRY_MAX_ELAPSED_SEC: 再試行を打ち切るまでの合計秒数（既定: 30）
+    SNOWFLAKE_BREAKER_FAILURE_THRESHOLD: サーキットを開く連続失敗数（既定: 5）
+    SNOWFLAKE_BREAKER_RESET_SEC: サーキットを開いておく秒数（既定: 30）
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+import requests
+
+# 一時的な失敗として再試行するHTTPステータス
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているため呼び出さずに失敗した"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit open: {name} (retry after {retry_after:.1f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After ヘッダ（秒数 または HTTP日付）を秒数にする"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def status_of(exc: BaseException) -> Optional[int]:
+    """例外に対応するHTTPステータス（無ければ None）"""
+    status = getattr(exc, "status", None)
+    if isinstance(status, int):
+        return status
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) if response is not None else None
+
+
+def retry_after_of(exc: BaseException) -> Optional[float]:
+    """例外が持つ Retry-After の秒数（無ければ None）"""
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    response = getattr(exc, "response", None)
+    if response is not None and getattr(response, "headers", None) is not None:
+        return parse_retry_after(response.headers.get("Retry-After"))
+    return None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    再試行してよい一時的な失敗か
+
+    - 429 / 5xx
+    - 接続の確立失敗・切断（接続タイムアウトを含む）
+    読み取りタイムアウトは Agent が実行中の可能性があるため再試行しない。
+    """
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    connect_timeout = getattr(aiohttp, "ConnectionTimeoutError", None)
+    if connect_timeout is not None and isinstance(exc, connect_timeout):
+        return True
+    if isinstance(exc, asyncio.TimeoutError):
+        return False
+    return isinstance(exc, (aiohttp.ClientConnectionError, requests.ConnectionError))
+
+
+class RetryPolicy:
+    """
+    指数バックオフ + full jitter の再試行ポリシー
+
+    Args:
+        max_attempts: 最大試行回数（初回を含む）
+        base_delay: バックオフの初期値（秒）
+        max_delay: 1回あたりの待ち時間の上限（秒）
+        max_elapsed_sec: 初回からこの秒数を超える再試行はしない
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_elapsed_sec: float = 30.0,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed_sec = max_elapsed_sec
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        attempt 回目の失敗後に待つ秒数
+
+        Retry-After があればそれを下限にし、同時に再送が集中しないよう少しずらす。
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    連続失敗でサーキットを開くブレーカー（スレッドセーフ）
+
+    Args:
+        name: 識別名（ログ・統計用）
+        failure_threshold: サーキットを開く連続失敗数
+        reset_timeout_sec: 開いてから half-open で試すまでの秒数
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout_sec: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_sec = reset_timeout_sec
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.stats_counters: Dict[str, int] = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def before_call(self) -> None:
+        """
+        呼び出し前に確認する
+
+        Raises:
+            CircuitOpenError: サーキットが開いている（half-open で試行中の場合を含む）
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            now = time.monotonic()
+            remaining = self._opened_at + self.reset_timeout_sec - now
+            if self._state == OPEN and remaining <= 0:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                # 試行は1件だけ（試行が戻ってこない場合に備えて reset_timeout 後は次を許す）
+                if self._probe_at is None or now - self._probe_at > self.reset_timeout_sec:
+                    self._probe_at = now
+                    return
+                remaining = self.reset_timeout_sec - (now - self._probe_at)
+            self.stats_counters["rejected"] += 1
+            raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logging.info(f"Circuit closed: {self.name}")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+                self.stats_counters["opened"] += 1
+                logging.warning(f"Circuit opened: {self.name} ({self._failures} consecutive failures)")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "failures": self._failures, **self.stats_counters}
+
+
+def _after_failure(
+    exc: Exception,
+    attempt: int,
+    started: float,
+    breaker: Optional[CircuitBreaker],
+    policy: RetryPolicy,
+    is_retryable: Callable[[BaseException], bool],
+) -> Optional[float]:
+    """失敗を記録し、再試行するなら待ち秒数を返す（しないなら None）"""
+    transient = is_retryable(exc)
+    if breaker is not None:
+        status = status_of(exc)
+        if transient or isinstance(exc, (asyncio.TimeoutError, requests.Timeout)):
+            # 読み取りタイムアウトは再試行しないが、応答できていないので失敗として数える
+            breaker.record_failure()
+        elif status is not None and 400 <= status < 500:
+            # 4xx はサービス自体は応答しているので成功扱い
+            breaker.record_success()
+        # それ以外（呼び出し側の例外など）はサービスの状態が分からないので記録しない
+    if not transient or attempt >= policy.max_attempts:
+        return None
+    delay = policy.backoff(attempt, retry_after_of(exc))
+    if time.monotonic() - started + delay > policy.max_elapsed_sec:
+        return None
+    logging.warning(f"Transient error (attempt {attempt}/{policy.max_attempts}), retrying in {delay:.2f}s: {exc}")
+    return delay
+
+
+async def call_with_retry(
+    fn: Callable[[], Awaitable[Any]],
+    breaker: Optional[CircuitBreaker] = None,
+    policy: Optional[RetryPolicy] = None,
+    is_retryable: Callable[[BaseException], bool] = is_transient,
+) -> Any:
+    """
+    コルーチン生成関数を再試行つきで実行する
+
+    Raises:
+        最後の試行の例外、またはサーキットが開いていれば CircuitOpenError
+    """
+    policy = policy or get_retry_policy()
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        attempt += 1
+        try:
+            result = await fn()
+        except Exception as e:
+            delay = _after_failure(e, attempt, started, breaker, policy, is_retryable)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+def call_with_retry_sync(
+    fn: Callable[[], Any],
+    breaker: Optional[CircuitBreaker] = None,
+    policy: Optional[RetryPolicy] = None,
+    is_retryable: Callable[[BaseException], bool] = is_transient,
+) -> Any:
+    """call_with_retry の同期版（requests 用）"""
+    policy = policy or get_retry_policy()
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        attempt += 1
+        try:
+            result = fn()
+        except Exception as e:
+            delay = _after_failure(e, attempt, started, breaker, policy, is_retryable)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+_policy: Optional[RetryPolicy] = None
+_breakers: Dict[str, CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """環境変数から生成したプロセス共有の RetryPolicy を取得する"""
+    global _policy
+    if _policy is None:
+        with _lock:
+            if _policy is None:
+                _policy = RetryPolicy(
+                    max_attempts=int(os.getenv("SNOWFLAKE_RETRY_MAX_ATTEMPTS", "4")),
+                    base_delay=float(os.getenv("SNOWFLAKE_RETRY_BASE_DELAY_SEC", "0.5")),
+                    max_delay=float(os.getenv("SNOWFLAKE_RETRY_MAX_DELAY_SEC", "8")),
+                    max_elapsed_sec=float(os.getenv("SNOWFLAKE_RETRY_MAX_ELAPSED_SEC", "30")),
+                )
+    return _policy
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    名前ごとのプロセス共有 CircuitBreaker を取得する
+
+    Args:
+        name: "agent:<アカウントURL>" / "sql:<アカウントURL>" など
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=int(os.getenv("SNOWFLAKE_BREAKER_FAILURE_THRESHOLD", "5")),
+                    reset_timeout_sec=float(os.getenv("SNOWFLAKE_BREAKER_RESET_SEC", "30")),
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """全ブレーカーの状態"""
+    with _lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.stats() for b in breakers}
@@ -0,0 +1,275 @@
+"""
+DB設計レビューの指摘（Findings）の集計エンジン（インクリメンタル・キャッシュつき）
+
+レビューは1日に数十件ずつ増えるため、実行のたびに全ファイルを読み直して
+優先度ごとに正規表現をかけると、集計時間がファイル数に比例して伸び続ける。
+ここでは各ファイルを1回の走査で解析して指摘（優先度・番号・タイトル・対象オブジェクト）を取り出し、
+列ごとのリストとしてキャッシュ（JSON）に保存する。キャッシュはファイルの mtime とサイズで判定し、
+変わったファイルだけを解析し直す。
+
+指摘の対象オブジェクト:
+    指摘ブロック内で最初に出てくる master/ のパス（Evidence / 変更対象PATH）から求める。
+    columns/SCHEMA.TABLE.COLUMN.md はテーブル（SCHEMA.TABLE）、schemas/SCHEMA.md はスキーマとして扱い、
+    パスが無ければレビュー対象（SCHEMA または SCHEMA.OBJECT）とする。
+    ファイル名が識別子（英数字・_・$）を . で区切った1〜3個でないパス（<SCHEMA>.<TABLE>、LOG.*、
+    日本語を含む文中の表記など）は対象オブジェクトとみなさず、次のパスを探す。
+
+キャッシュの形式:
+    {"version": 2, "files": {"DB_DESIGN_20260102_092948.md": {
+        "mtime_ns": ..., "size": ..., "schema": "DB_DESIGN", "object": null, "reviewed_at": "2026-01-02T09:29:48",
+        "findings": {"severity": ["high", ...], "number": [1, ...], "title": ["...", ...], "object": ["DB_DESIGN.X", ...]}}}}
+"""
+import csv
+import io
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from review_store import SEVERITIES, ReviewStore
+
+CACHE_FILE = ".review_analytics_cache.json"
+CACHE_VERSION = 2
+
+GROUP_BY = ("schema", "object", "week")
+
+_FINDING_HEADING = re.compile(r"^#### (Critical|High|Med|Low)-(\d+)\s*[:：]?\s*(.*)$")
+_MASTER_PATH = re.compile(
+    r"master/(schemas|tables|columns|views|externaltables|semanticviews|other)/"
+    r"([A-Za-z0-9_$]+(?:\.[A-Za-z0-9_$]+){0,2})\.md"
+)
+
+# 列の並び（findings() が返す列）
+COLUMNS = ("file", "schema", "review_object", "reviewed_at", "week", "severity", "number", "title", "object")
+
+
+def _object_of(kind: str, name: str) -> str:
+    if kind == "columns":
+        return name.rsplit(".", 1)[0] if name.count(".") >= 2 else name
+    return name
+
+
+def finding_object(line: str) -> Optional[str]:
+    """行に含まれる master/ のパスから対象オブジェクト（SCHEMA.OBJECT / SCHEMA）を求める（無ければ None）"""
+    if "master/" not in line:
+        return None
+    p = _MASTER_PATH.search(line)
+    return _object_of(p.group(1), p.group(2)) if p else None
+
+
+def parse_findings(markdown: str) -> Dict[str, list]:
+    """
+    レビューMarkdownから指摘を列ごとのリストで取り出す（1回の走査）
+
+    Returns:
+        {"severity": [...], "number": [...], "title": [...], "object": [...]}（object はパスが無ければ None）
+    """
+    cols: Dict[str, list] = {"severity": [], "number": [], "title": [], "object": []}
+    in_finding = False
+    for line in markdown.splitlines():
+        if line.startswith("#"):
+            m = _FINDING_HEADING.match(line)
+            if m:
+                cols["severity"].append(m.group(1).lower())
+                cols["number"].append(int(m.group(2)))
+                cols["title"].append(m.group(3).strip())
+                cols["object"].append(None)
+                in_finding = True
+            elif line.startswith(("## ", "### ")):
+                in_finding = False
+            continue
+        if in_finding and cols["object"][-1] is None:
+            cols["object"][-1] = finding_object(line)
+    return cols
+
+
+def iso_week(reviewed_at: str) -> str:
+    """"2026-01-04T02:58:15" -> "2026-W01"（ISO週）"""
+    year, week, _ = datetime.fromisoformat(reviewed_at).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class ReviewAnalytics:
+    """
+    レビュー指摘の集計
+
+    Args:
+        root: レビューMarkdownのディレクトリ（reviews/schemas）
+        cache_path: キャッシュファイル（既定: root/.review_analytics_cache.json）
+    """
+
+    def __init__(self, root: Path, cache_path: Optional[Path] = None):
+        self.root = Path(root)
+        self.cache_path = Path(cache_path) if cache_path else self.root / CACHE_FILE
+        self.store = ReviewStore(self.root)
+        self._files: Dict[str, Dict[str, Any]] = {}
+
+    def refresh(self) -> Tuple[int, int]:
+        """
+        キャッシュを読み、追加・変更されたファイルだけを解析し直す（変化があればキャッシュを書き戻す）
+
+        Returns:
+            (解析したファイル数, キャッシュを使ったファイル数)
+        """
+        cached = self._load_cache()
+        # 対象・日時は review_store のインデックスから（未登録のファイルは backfill で登録）
+        self.store.backfill()
+        targets = {r.path: r for r in self.store.records() if not r.duplicate}
+
+        files: Dict[str, Dict[str, Any]] = {}
+        parsed = reused = 0
+        dirty = False
+        for md_file in sorted(self.root.glob("*.md")):
+            record = targets.get(md_file.name)
+            if record is None:
+                continue
+            st = md_file.stat()
+            entry = cached.get(md_file.name)
+            if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                reused += 1
+            else:
+                entry = {
+                    "mtime_ns": st.st_mtime_ns,
+                    "size": st.st_size,
+                    "findings": parse_findings(md_file.read_text(encoding="utf-8")),
+                }
+                parsed += 1
+            meta = {"schema": record.schema, "object": record.object, "reviewed_at": record.reviewed_at}
+            if any(entry.get(k) != v for k, v in meta.items()):
+                entry.update(meta)
+                dirty = True
+            files[md_file.name] = entry
+
+        self._files = files
+        if dirty or parsed or files.keys() != cached.keys():
+            self._save_cache()
+        return parsed, reused
+
+    def findings(self) -> Dict[str, list]:
+        """全指摘を列ごとのリストで返す（列は COLUMNS）"""
+        out: Dict[str, list] = {c: [] for c in COLUMNS}
+        for name, entry in sorted(self._files.items(), key=lambda kv: kv[1]["reviewed_at"]):
+            f = entry["findings"]
+            n = len(f["severity"])
+            review_object = f"{entry['schema']}.{entry['object']}" if entry["object"] else entry["schema"]
+            out["file"].extend([name] * n)
+            out["schema"].extend([entry["schema"]] * n)
+            out["review_object"].extend([review_object] * n)
+            out["reviewed_at"].extend([entry["reviewed_at"]] * n)
+            out["week"].extend([iso_week(entry["reviewed_at"])] * n)
+            out["severity"].extend(f["severity"])
+            out["number"].extend(f["number"])
+            out["title"].extend(f["title"])
+            out["object"].extend(o or review_object for o in f["object"])
+        return out
+
+    def group(self, by: str) -> List[Dict[str, Any]]:
+        """
+        schema / object / week ごとの優先度別指摘数
+
+        Returns:
+            [{"key": ..., "reviews": レビュー数, "critical": ..., "high": ..., "med": ..., "low": ..., "total": ...}]
+            （指摘数の多い順。week は週の昇順）
+        """
+        if by not in GROUP_BY:
+            raise ValueError(f"group by must be one of {GROUP_BY}: {by}")
+        cols = self.findings()
+        keys = cols[by]
+        rows: Dict[str, Dict[str, Any]] = {}
+        reviews: Dict[str, set] = {}
+        for key, sev, name in zip(keys, cols["severity"], cols["file"]):
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {"key": key, "reviews": 0, **dict.fromkeys(SEVERITIES, 0), "total": 0}
+                reviews[key] = set()
+            row[sev] += 1
+            row["total"] += 1
+            reviews[key].add(name)
+        if by != "object":
+            # 指摘0件のレビューもレビュー数に含める
+            for name, entry in self._files.items():
+                key = entry["schema"] if by == "schema" else iso_week(entry["reviewed_at"])
+                if key not in rows:
+                    rows[key] = {"key": key, "reviews": 0, **dict.fromkeys(SEVERITIES, 0), "total": 0}
+                    reviews[key] = set()
+                reviews[key].add(name)
+        for key, row in rows.items():
+            row["reviews"] = len(reviews[key])
+        if by == "week":
+            return sorted(rows.values(), key=lambda r: r["key"])
+        return sorted(rows.values(), key=lambda r: (-r["total"], r["key"]))
+
+    def trend(self, by: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        週ごとの推移（by に schema / object を指定するとその単位でも分ける）
+
+        Returns:
+            [{"week": ..., ("schema" / "object": ...,) "reviews": ..., "critical": ..., ..., "total": ...}]
+        """
+        if by not in (None, "schema", "object"):
+            raise ValueError(f"trend by must be schema or object: {by}")
+        rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        reviews: Dict[Tuple[str, str], set] = {}
+
+        def row_for(week: str, key: str) -> Dict[str, Any]:
+            row = rows.get((week, key))
+            if row is None:
+                row = rows[(week, key)] = {"week": week, **({by: key} if by else {}), "reviews": 0,
+                                           **dict.fromkeys(SEVERITIES, 0), "total": 0}
+                reviews[(week, key)] = set()
+            return row
+
+        cols = self.findings()
+        keys = cols[by] if by else [""] * len(cols["week"])
+        for week, key, sev, name in zip(cols["week"], keys, cols["severity"], cols["file"]):
+            row = row_for(week, key)
+            row[sev] += 1
+            row["total"] += 1
+            reviews[(week, key)].add(name)
+        if by != "object":
+            for name, entry in self._files.items():
+                k = (iso_week(entry["reviewed_at"]), entry["schema"] if by else "")
+                row_for(*k)
+                reviews[k].add(name)
+        for k, row in rows.items():
+            row["reviews"] = len(reviews[k])
+        return [rows[k] for k in sorted(rows)]
+
+    def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logging.warning(f"Ignoring invalid analytics cache {self.cache_path}: {e}")
+            return {}
+        if data.get("version") != CACHE_VERSION:
+            return {}
+        return data.get("files", {})
+
+    def _save_cache(self) -> None:
+        # 途中で中断しても壊れたキャッシュが残らないよう一時ファイルから置き換える
+        tmp = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        tmp.write_text(
+            json.dumps({"version": CACHE_VERSION, "files": self._files}, ensure_ascii=False, separators=(",", ":")),
+            encoding="utf-8",
+        )
+        os.replace(tmp, self.cache_path)
+
+
+def to_csv(rows: Iterable[Dict[str, Any]]) -> str:
+    """集計行を CSV 文字列にする（列は最初の行のキー順）"""
+    rows = list(rows)
+    buf = io.StringIO()
+    if rows:
+        writer = csv.DictWriter(buf, fieldnames=list(rows[0].keys()), lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    return buf.getvalue()
+
+
+def to_json(rows: Iterable[Dict[str, Any]]) -> str:
+    return json.dumps(list(rows), ensure_ascii=False, indent=2)
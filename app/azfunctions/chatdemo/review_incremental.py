@@ -0,0 +1,241 @@
+"""
+差分レビュー（Vault の変更があったオブジェクトだけを再レビューして前回のレポートに統合する）
+
+スキーマ全体のレビューは、1列の定義が変わっただけでもスキーマ全体を Agent に送り直すため、
+変更の少ないスキーマでは費用と待ち時間のほとんどが無駄になる。
+ここではスキーマ配下のオブジェクトごとに Vault の定義（master/）と設計書（design/）のハッシュを求め、
+前回のレビューに記録したハッシュ（review_store の vault_hashes）と比べて変わったオブジェクトを返す。
+再レビューした結果は、前回のレポートの該当オブジェクトの指摘と入れ替えて1つのレポートにする。
+
+指摘の対象オブジェクト:
+    オブジェクト単位レビューの指摘はすべてレビューしたオブジェクトのものとする。
+    スキーマ全体のレビューの指摘は、指摘内で最初に出てくる master/ のパスから求める（無ければスキーマ自体）。
+    統合したレポートでは各指摘の見出しの直後に "<!-- object: SCHEMA.OBJECT -->" を書き、
+    次回の統合ではパスより優先して使う（パスの無い指摘も正しいオブジェクトとして入れ替えられるように）。
+
+オブジェクトとハッシュの対象:
+    "" (スキーマ自体): master/schemas/{SCHEMA}.md, design/design.{SCHEMA}.md
+    "{OBJECT}": master/{tables,views,externaltables}/{SCHEMA}.{OBJECT}.md,
+                master/columns/{SCHEMA}.{OBJECT}.*.md, design/{SCHEMA}/design.{OBJECT}.md
+
+設定（環境変数）:
+    REVIEW_VAULT_DIR: Vault のディレクトリ（既定: docs/snowflake/chatdemo）
+"""
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from review_analytics import finding_object
+
+SCHEMA_KEY = ""
+
+_OBJECT_DIRS = ("tables", "views", "externaltables")
+
+DEFAULT_VAULT_DIR = Path(__file__).parent.parent.parent.parent / "docs" / "snowflake" / "chatdemo"
+
+# 変更されたオブジェクトがこの割合を超えたら差分ではなくスキーマ全体をレビューする
+FULL_REVIEW_RATIO = 0.5
+
+_FINDING_HEADING = re.compile(r"^#### (Critical|High|Med|Low)-(\d+)(.*)$")
+_OBJECT_MARKER = re.compile(r"^<!-- object: (\S+) -->$")
+_SEVERITY_ORDER = ("Critical", "High", "Med", "Low")
+
+
+def vault_dir() -> Path:
+    return Path(os.getenv("REVIEW_VAULT_DIR") or DEFAULT_VAULT_DIR)
+
+
+def object_hashes(schema: str, root: Optional[Path] = None) -> Dict[str, str]:
+    """
+    スキーマ配下のオブジェクトごとの Vault のハッシュ（SHA-256）
+
+    Returns:
+        {"": スキーマ自体, "OBJECT": オブジェクト, ...}（ファイルが1つも無いオブジェクトは含まない）
+    """
+    root = Path(root) if root else vault_dir()
+    master = root / "master"
+    prefix = f"{schema}."
+    files: Dict[str, List[Path]] = {
+        SCHEMA_KEY: [master / "schemas" / f"{schema}.md", root / "design" / f"design.{schema}.md"]
+    }
+    for kind in _OBJECT_DIRS:
+        for path in (master / kind).glob(f"{prefix}*.md"):
+            obj = path.name[len(prefix):-3]
+            files.setdefault(obj, []).extend([path, root / "design" / schema / f"design.{obj}.md"])
+    for path in (master / "columns").glob(f"{prefix}*.md"):
+        obj = path.name[len(prefix):-3].split(".", 1)[0]
+        files.setdefault(obj, []).append(path)
+
+    hashes = {}
+    for obj, paths in files.items():
+        digest = hashlib.sha256()
+        found = False
+        for path in sorted(set(paths)):
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                continue
+            found = True
+            digest.update(path.relative_to(root).as_posix().encode("utf-8") + b"\0" + data + b"\0")
+        if found:
+            hashes[obj] = digest.hexdigest()
+    return hashes
+
+
+def diff_hashes(previous: Dict[str, str], current: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """
+    Returns:
+        (追加・変更されたオブジェクト, 削除されたオブジェクト)
+    """
+    changed = sorted(k for k, h in current.items() if previous.get(k) != h)
+    removed = sorted(k for k in previous if k not in current)
+    return changed, removed
+
+
+def needs_full_review(changed: List[str], current: Dict[str, str]) -> bool:
+    """スキーマ自体（スキーマ定義・スキーマ設計書）が変わったか、変更が多い場合はスキーマ全体をレビューする"""
+    return SCHEMA_KEY in changed or len(changed) > FULL_REVIEW_RATIO * len(current)
+
+
+class Finding(NamedTuple):
+    """レポート内の指摘1件（lines の先頭は "#### {severity}-{n}: ..." 見出し）"""
+    severity: str
+    object: Optional[str]
+    lines: List[str]
+
+
+def _normalize_object(obj: Optional[str], schema: str) -> str:
+    """指摘の対象を SCHEMA 単位 ("") かオブジェクト名（スキーマ接頭辞なし）にする"""
+    if not obj:
+        return SCHEMA_KEY
+    upper, schema_upper = obj.upper(), schema.upper()
+    if upper == schema_upper:
+        return SCHEMA_KEY
+    if upper.startswith(schema_upper + "."):
+        return obj[len(schema) + 1:].split(".", 1)[0]
+    return obj
+
+
+def split_report(markdown: str, schema: str) -> Tuple[List[str], List[Finding], List[str]]:
+    """
+    レポートを Findings 節の前・指摘・後に分ける
+
+    Findings 節は最初の指摘見出しを含む "## " 節（"### Critical" 等の小見出しは捨てて再生成する）。
+    指摘の対象は "<!-- object: ... -->" 行があればそれ、無ければ指摘内の master/ のパスから求める。
+    指摘が無ければ (全行, [], [])。
+    """
+    lines = markdown.splitlines()
+    first = next((i for i, line in enumerate(lines) if _FINDING_HEADING.match(line)), None)
+    if first is None:
+        return lines, [], []
+    start = next((i for i in range(first, -1, -1) if lines[i].startswith("## ")), first - 1)
+    end = next((i for i in range(first, len(lines)) if lines[i].startswith("## ")), len(lines))
+
+    findings: List[Finding] = []
+    markers: List[Optional[str]] = []
+    for line in lines[start + 1:end]:
+        m = _FINDING_HEADING.match(line)
+        if m:
+            findings.append(Finding(m.group(1), None, [line]))
+            markers.append(None)
+        elif findings and _OBJECT_MARKER.match(line.strip()):
+            markers[-1] = _OBJECT_MARKER.match(line.strip()).group(1)
+        elif findings and not (line.startswith("### ") and line[4:].strip() in _SEVERITY_ORDER):
+            findings[-1].lines.append(line)
+    findings = [
+        f._replace(object=_normalize_object(marker or next(filter(None, map(finding_object, f.lines)), None), schema))
+        for f, marker in zip(findings, markers)
+    ]
+    return lines[: start + 1], findings, lines[end:]
+
+
+def _render_findings(findings: Iterable[Finding], schema: str) -> List[str]:
+    """
+    重要度順に並べ、重要度ごとに番号を振り直して "### {重要度}" 小見出しつきで出力する
+
+    各見出しの直後に対象オブジェクトを "<!-- object: ... -->" として書く。
+    """
+    by_severity: Dict[str, List[Finding]] = {s: [] for s in _SEVERITY_ORDER}
+    for f in findings:
+        by_severity[f.severity].append(f)
+    out: List[str] = [""]
+    for severity in _SEVERITY_ORDER:
+        if not by_severity[severity]:
+            continue
+        out.append(f"### {severity}")
+        for n, f in enumerate(by_severity[severity], 1):
+            m = _FINDING_HEADING.match(f.lines[0])
+            body = list(f.lines[1:])
+            while body and not body[-1].strip():
+                body.pop()
+            target = f"{schema}.{f.object}" if f.object else schema
+            out += [f"#### {severity}-{n}{m.group(3)}", f"<!-- object: {target} -->", *body, ""]
+    return out
+
+
+def _update_frontmatter(lines: List[str], fields: Dict[str, str]) -> List[str]:
+    """先頭の frontmatter（--- で囲まれた部分）の項目を上書き・追加する（frontmatter が無ければそのまま）"""
+    start = next((i for i, line in enumerate(lines) if line.strip()), None)
+    if start is None or lines[start].strip() != "---":
+        return lines
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].strip() == "---"), None)
+    if end is None:
+        return lines
+    body = [line for line in lines[start + 1:end] if line.split(":", 1)[0].strip() not in fields]
+    return ["---", *body, *(f"{k}: {v}" for k, v in fields.items()), *lines[end:]]
+
+
+def merge_reports(
+    schema: str,
+    previous: str,
+    updates: Dict[str, str],
+    removed: Iterable[str],
+    base_review: str,
+    review_date: str,
+) -> str:
+    """
+    前回のスキーマレビューに、オブジェクト単位の再レビュー結果を統合したレポートを作る
+
+    Args:
+        previous: 前回のスキーマレビュー（Markdown）
+        updates: 再レビューしたオブジェクト -> オブジェクト単位レビュー（Markdown。指摘はすべてそのオブジェクトのものとする）
+        removed: Vault から削除されたオブジェクト（指摘を取り除く）
+        base_review: 前回のレビューのファイル名（frontmatter に記録）
+    """
+    head, findings, tail = split_report(previous, schema)
+    # 前回が差分レビューなら、その記録は今回の記録に置き換える
+    if "## 差分レビュー" in tail:
+        cut = tail.index("## 差分レビュー")
+        rest = next((i for i in range(cut + 1, len(tail)) if tail[i].startswith("## ")), len(tail))
+        tail = tail[:cut] + tail[rest:]
+        while tail and not tail[-1].strip():
+            tail.pop()
+    replaced = {o.upper() for o in updates} | {o.upper() for o in removed}
+    kept = [f for f in findings if f.object.upper() not in replaced]
+    for obj, markdown in updates.items():
+        _, new_findings, _ = split_report(markdown, schema)
+        kept += [f._replace(object=obj) for f in new_findings]
+
+    if not findings:
+        # 前回のレポートに Findings 節が無ければ末尾に追加する
+        head, tail = head + ["", "## 2. Findings（重要度別）"], []
+    head = _update_frontmatter(
+        head,
+        {
+            "review_date": review_date,
+            "incremental": "true",
+            "base_review": base_review,
+            "reviewed_objects": "[" + ", ".join(sorted(updates)) + "]",
+        },
+    )
+    note = [
+        "",
+        "## 差分レビュー",
+        f"- 前回のレビュー: [[{base_review[:-3] if base_review.endswith('.md') else base_review}]]",
+        f"- 再レビューしたオブジェクト: {', '.join(f'{schema}.{o}' for o in sorted(updates)) or 'なし'}",
+        f"- Vault から削除されたオブジェクト: {', '.join(f'{schema}.{o}' for o in sorted(removed)) or 'なし'}",
+        "- それ以外のオブジェクトの指摘は前回のレビューから引き継いでいる",
+    ]
+    return "\n".join(head + _render_findings(kept, schema) + tail + note) + "\n"
@@ -0,0 +1,385 @@
+"""
+DB設計レビューの非同期ジョブ（プロセス内）
+
+スキーマ全体のレビューはAgent実行に数分〜15分かかり、HTTPリクエストのまま待つと
+クライアントのソケットタイムアウト（120秒）や Functions ホストの上限を超える。
+POST /review/schema はジョブを登録して job_id をすぐ返し、レビューは同じプロセスの
+イベントループ上のバックグラウンドタスクで実行する。進捗（受信イベント数・ツール呼び出し）と
+結果は GET /review/jobs/{id} / GET /review/jobs/{id}/result で取得する。
+
+同じ対象（スキーマ・オブジェクト・MAX_TABLES）のジョブが実行中（queued / running）なら
+新しいジョブは作らずにそのジョブを返す。
+複数の対象をまとめてレビューする場合（POST /review/batch）は ReviewBatch で
+バッチごとの同時実行数の上限をかけてジョブを登録し、完了した順に通知する。
+レビューの Agent 呼び出しは agent_slot() でプロセス全体の同時実行数の上限をかける
+（ジョブ・wait=true の同期実行・差分レビューのオブジェクト単位の呼び出しで共有し、ジョブの中で入れ子にしない）。
+ジョブは最初の実行枠を得るまで queued、得たら running になる。
+実行待ちを含む実行中のジョブ数には上限があり（全体・登録したユーザーごと）、超えた登録は
+AdmissionRejected で拒否する（呼び出し側で 503 / 429 + Retry-After に変換する）。
+ジョブはプロセス内にのみ保持するため、スケールアウト時は登録したインスタンスでしか参照できず、
+再起動で失われる。
+
+設定（環境変数）:
+    REVIEW_JOB_MAX_CONCURRENCY: レビューの Agent 同時実行数（既定: 6、全スキーマのバッチを並列に実行できる数）
+    REVIEW_JOB_MAX_ACTIVE: 実行待ち・実行中のジョブ数の上限（既定: 24、超えた登録は拒否）
+    REVIEW_JOB_MAX_ACTIVE_PER_USER: ユーザー（受付制御のキー）ごとの実行待ち・実行中のジョブ数の上限（既定: 6）
+    REVIEW_JOB_MAX_JOBS: 保持するジョブ数の上限（既定: 200、超えたら古い完了済みから削除）
+    REVIEW_JOB_TTL_SEC: 完了したジョブを保持する秒数（既定: 3600）
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from admission import AdmissionRejected
+from sse_parser import EVENT_TOOL_RESULT, TOOL_STEP_EVENTS, SSEEvent
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# 進捗として返すツール呼び出しの件数（古いものから捨てる）
+_MAX_TOOL_STEPS = 50
+# 登録を拒否したときの Retry-After 秒数
+REJECT_RETRY_AFTER_SEC = 30
+
+
+# 実行中のジョブ（ジョブのタスクと、そこから起動したタスクで参照する）
+_current_job: contextvars.ContextVar[Optional["ReviewJob"]] = contextvars.ContextVar("review_job", default=None)
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+
+class ReviewJob:
+    """
+    レビュー1件分のジョブ
+
+    Attributes:
+        status: queued / running / succeeded / failed
+        result: (HTTPステータス, レスポンスJSON) 完了時のみ
+    """
+
+    def __init__(self, key: Hashable, target: Dict[str, Any], owner: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.target = target
+        self.owner = owner
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events = 0
+        self.tool_calls = 0
+        self.tool_steps: Deque[Dict[str, Any]] = deque(maxlen=_MAX_TOOL_STEPS)
+        self.result: Optional[Tuple[int, Dict[str, Any]]] = None
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    async def wait(self) -> None:
+        """ジョブの完了を待つ（待つ側がキャンセルされてもジョブは止めない）"""
+        if self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    def on_event(self, ev: SSEEvent) -> None:
+        """Agentイベントを進捗として記録する"""
+        self.events += 1
+        if ev.event in TOOL_STEP_EVENTS or ev.event == EVENT_TOOL_RESULT:
+            obj = ev.data if isinstance(ev.data, dict) else {}
+            if ev.event == EVENT_TOOL_RESULT:
+                self.tool_calls += 1
+            self.tool_steps.append(
+                {
+                    "type": ev.event.split(".")[-1],
+                    "tool_name": obj.get("name") or obj.get("tool_name") or "unknown",
+                    "elapsed_sec": round(time.time() - (self.started_at or self.created_at), 1),
+                }
+            )
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "target": self.target,
+            "created_at": _iso(self.created_at),
+            "started_at": _iso(self.started_at),
+            "finished_at": _iso(self.finished_at),
+            "elapsed_sec": round(end - self.started_at, 1) if self.started_at else 0.0,
+            "progress": {
+                "events": self.events,
+                "tool_calls": self.tool_calls,
+                "tool_steps": list(self.tool_steps),
+            },
+            "error": self.error,
+        }
+
+
+class ReviewJobStore:
+    """
+    レビュージョブの登録・実行・参照（Agent 同時実行数・実行中ジョブ数の上限と同一対象の重複排除つき）
+
+    Args:
+        max_concurrency: レビューの Agent 同時実行数（agent_slot() の上限）
+        max_jobs: 保持するジョブ数の上限
+        ttl_sec: 完了したジョブを保持する秒数
+        max_active: 実行待ち・実行中のジョブ数の上限
+        max_active_per_owner: 登録したユーザーごとの実行待ち・実行中のジョブ数の上限
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 6,
+        max_jobs: int = 200,
+        ttl_sec: float = 3600,
+        max_active: int = 24,
+        max_active_per_owner: int = 6,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_active = max(1, max_active)
+        self.max_active_per_owner = max(1, max_active_per_owner)
+        self.max_jobs = max(1, max_jobs)
+        self.ttl_sec = ttl_sec
+        self._jobs: "OrderedDict[str, ReviewJob]" = OrderedDict()
+        self._active: Dict[Hashable, ReviewJob] = {}
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: set = set()
+
+    def submit(
+        self,
+        key: Hashable,
+        target: Dict[str, Any],
+        run: Callable[[ReviewJob], Awaitable[Tuple[int, Dict[str, Any]]]],
+        owner: Optional[str] = None,
+    ) -> Tuple[ReviewJob, bool]:
+        """
+        ジョブを登録してバックグラウンドで実行する（実行中のイベントループから呼ぶ）
+
+        Args:
+            key: 重複排除のキー（同じキーのジョブが実行中ならそれを返す）
+            target: ジョブの対象（参照用）
+            run: ジョブを受け取り (HTTPステータス, レスポンスJSON) を返すコルーチン関数
+            owner: 登録したユーザー（受付制御のキー。ユーザーごとの上限に使う）
+
+        Returns:
+            (ジョブ, 既存の実行中ジョブを返したか)
+
+        Raises:
+            AdmissionRejected: 実行待ち・実行中のジョブ数が上限（"overloaded"）、
+                またはそのユーザーの上限（"too_many_jobs"）に達している場合
+        """
+        with self._lock:
+            self._evict_locked(time.time())
+            existing = self._active.get(key)
+            if existing is not None:
+                return existing, True
+            self._check_capacity_locked(owner)
+            job = ReviewJob(key, target, owner)
+            self._jobs[job.id] = job
+            self._active[key] = job
+        task = job._task = asyncio.get_running_loop().create_task(self._run(job, run))
+        # 実行中のタスクが GC されないよう参照を保持する
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job, False
+
+    def check_capacity(self, owner: Optional[str] = None) -> None:
+        """ジョブを登録できるか確認する（できなければ submit と同じ AdmissionRejected）"""
+        with self._lock:
+            self._check_capacity_locked(owner)
+
+    def batch(
+        self,
+        items: List[Tuple[Hashable, Dict[str, Any]]],
+        run: Callable[[ReviewJob], Awaitable[Tuple[int, Dict[str, Any]]]],
+        max_parallel: int,
+        owner: Optional[str] = None,
+    ) -> "ReviewBatch":
+        """複数の (key, target) をまとめて実行する ReviewBatch を開始する（実行中のイベントループから呼ぶ）"""
+        return ReviewBatch(self, items, run, max_parallel, owner)
+
+    def get(self, job_id: str) -> Optional[ReviewJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def _check_capacity_locked(self, owner: Optional[str]) -> None:
+        if len(self._active) >= self.max_active:
+            raise AdmissionRejected("overloaded", REJECT_RETRY_AFTER_SEC)
+        if owner is not None:
+            owned = sum(1 for j in self._active.values() if j.owner == owner)
+            if owned >= self.max_active_per_owner:
+                raise AdmissionRejected("too_many_jobs", REJECT_RETRY_AFTER_SEC)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def agent_slot(self) -> AsyncIterator[None]:
+        """
+        レビューの Agent 呼び出し1件分の実行枠（プロセス全体で max_concurrency まで）
+
+        ジョブの中で取得した場合、最初の取得でジョブを running にする。
+        """
+        async with self._get_semaphore():
+            job = _current_job.get()
+            if job is not None and job.status == QUEUED:
+                job.status = RUNNING
+                job.started_at = time.time()
+                logging.info(f"Review job started: {job.id} {job.target}")
+            yield
+
+    async def _run(self, job: ReviewJob, run: Callable[[ReviewJob], Awaitable[Tuple[int, Dict[str, Any]]]]) -> None:
+        # タスクごとのコンテキストなので、他のジョブには影響しない
+        _current_job.set(job)
+        try:
+            job.result = await run(job)
+            job.status = SUCCEEDED if job.result[0] < 400 else FAILED
+            if job.status == FAILED:
+                job.error = str(job.result[1].get("message") or job.result[1].get("error") or "")
+        except Exception as e:
+            logging.exception(f"Review job failed: {job.id}")
+            job.status = FAILED
+            job.error = str(e)
+            job.result = (500, {"success": False, "error": str(e)})
+        finally:
+            job.finished_at = time.time()
+            # Agent を呼ばずに終わったジョブ（差分レビューで変更が無い等）
+            job.started_at = job.started_at or job.finished_at
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+            logging.info(f"Review job finished: {job.id} status={job.status} elapsed={job.finished_at - job.created_at:.1f}s")
+
+    def _evict_locked(self, now: float) -> None:
+        """TTL切れ、および上限超過分の完了済みジョブを古い順に削除する"""
+        for job_id in [j.id for j in self._jobs.values() if not j.active and now - j.finished_at > self.ttl_sec]:
+            del self._jobs[job_id]
+        if len(self._jobs) < self.max_jobs:
+            return
+        for job_id in [j.id for j in self._jobs.values() if not j.active]:
+            del self._jobs[job_id]
+            if len(self._jobs) < self.max_jobs:
+                return
+
+
+class ReviewBatch:
+    """
+    複数対象のレビュー（バッチ）
+
+    バッチ内で同時に登録するジョブを max_parallel 件までにし、1件終わるごとに次を登録する。
+    Agent の同時実行数・実行中ジョブ数は ReviewJobStore の上限に従う（バッチ同士・単発のレビューと共有）。
+    登録を拒否された対象は Retry-After の秒数だけ待って登録し直す。
+    登録・完了は next_event() で発生順に受け取る。
+
+    Args:
+        items: (重複排除のキー, 対象) のリスト
+        max_parallel: バッチ内で同時に実行するジョブ数
+        owner: 登録したユーザー（受付制御のキー）
+    """
+
+    SUBMITTED = "submitted"
+    COMPLETED = "completed"
+
+    def __init__(
+        self,
+        store: ReviewJobStore,
+        items: List[Tuple[Hashable, Dict[str, Any]]],
+        run: Callable[[ReviewJob], Awaitable[Tuple[int, Dict[str, Any]]]],
+        max_parallel: int,
+        owner: Optional[str] = None,
+    ):
+        self.size = len(items)
+        self.owner = owner
+        self.started_at = time.time()
+        self.jobs: List[Optional[ReviewJob]] = [None] * self.size
+        self._remaining = 2 * self.size
+        self._events: "asyncio.Queue[Tuple[str, int, ReviewJob, bool]]" = asyncio.Queue()
+        semaphore = asyncio.Semaphore(max(1, max_parallel))
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._one(store, semaphore, i, key, target, run)) for i, (key, target) in enumerate(items)
+        ]
+
+    @property
+    def finished(self) -> bool:
+        return self._remaining == 0
+
+    async def _one(self, store, semaphore, index, key, target, run) -> None:
+        async with semaphore:
+            while True:
+                try:
+                    job, deduplicated = store.submit(key, target, run, self.owner)
+                    break
+                except AdmissionRejected as e:
+                    await asyncio.sleep(e.retry_after)
+            self.jobs[index] = job
+            self._events.put_nowait((self.SUBMITTED, index, job, deduplicated))
+            await job.wait()
+        self._events.put_nowait((self.COMPLETED, index, job, deduplicated))
+
+    async def next_event(self, timeout: Optional[float] = None) -> Optional[Tuple[str, int, ReviewJob, bool]]:
+        """
+        次の登録・完了を待つ
+
+        Returns:
+            (SUBMITTED / COMPLETED, 対象の添字, ジョブ, 既存ジョブを返したか)。timeout 秒以内に無ければ None
+        """
+        if self.finished:
+            return None
+        try:
+            event = await asyncio.wait_for(self._events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._remaining -= 1
+        return event
+
+    def cancel(self) -> None:
+        """まだ登録していない対象を取りやめる（登録済みのジョブはそのまま実行する）"""
+        for task in self._tasks:
+            task.cancel()
+
+
+_store: Optional[ReviewJobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_review_job_store() -> ReviewJobStore:
+    """環境変数から生成したプロセス共有の ReviewJobStore を取得する"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReviewJobStore(
+                    max_concurrency=int(os.getenv("REVIEW_JOB_MAX_CONCURRENCY", "6")),
+                    max_jobs=int(os.getenv("REVIEW_JOB_MAX_JOBS", "200")),
+                    ttl_sec=float(os.getenv("REVIEW_JOB_TTL_SEC", "3600")),
+                    max_active=int(os.getenv("REVIEW_JOB_MAX_ACTIVE", "24")),
+                    max_active_per_owner=int(os.getenv("REVIEW_JOB_MAX_ACTIVE_PER_USER", "6")),
+                )
+    return _store
@@ -0,0 +1,311 @@
+"""
+DB設計レビュー結果のストア（Markdown + 追記専用インデックス）
+
+レビューのたびに {schema}_{object}_{ts}.md を新規作成すると、出力が同じでもファイルが増え、
+集計（tests/scripts/analyze_reviews.py）は毎回全ファイルを読み直して正規表現で数えることになる。
+ここでは保存時に内容のハッシュと優先度別の指摘数を求めて index.jsonl に1行追記し、
+同じ内容のレビューは Markdown を新たに書かず、既存ファイルを指すレコードだけを追記する。
+履歴・集計はインデックスだけを読めばよい。
+
+インデックスの1行（JSON）:
+    {"schema": "DB_DESIGN", "object": "DOCS_OBSIDIAN", "reviewed_at": "2026-01-04T02:58:15",
+     "content_hash": "sha256...", "path": "DB_DESIGN_DOCS_OBSIDIAN_20260104_025815.md",
+     "severity": {"critical": 0, "high": 2, "med": 3, "low": 1}, "size": 12345, "duplicate": false,
+     "vault_hashes": {"": "...", "DOCS_OBSIDIAN": "..."}}
+    vault_hashes はスキーマ単位レビュー時の Vault のオブジェクト別ハッシュ（review_incremental.py の差分判定に使う）
+
+設定（環境変数）:
+    REVIEW_STORE_DIR: 保存先ディレクトリ（既定: docs/snowflake/chatdemo/reviews/schemas）
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+INDEX_FILE = "index.jsonl"
+
+SEVERITIES = ("critical", "high", "med", "low")
+
+# 指摘見出し（例: "#### High-2: タイトル"）
+_FINDING = re.compile(r"^#### (Critical|High|Med|Low)-", re.M)
+# 既存ファイル名（例: DB_DESIGN_DOCS_OBSIDIAN_20260104_025815.md）
+_FILENAME = re.compile(r"^(?P<prefix>.+)_(?P<date>\d{8})_(?P<time>\d{6})\.md$")
+_FRONTMATTER_TARGET = re.compile(r"^target:\s*(.+?)\s*$", re.M)
+
+DEFAULT_DIR = Path(__file__).parent.parent.parent.parent / "docs" / "snowflake" / "chatdemo" / "reviews" / "schemas"
+
+
+class ReviewRecord(NamedTuple):
+    """インデックスの1レコード（レビュー1回分）"""
+    schema: str
+    object: Optional[str]
+    reviewed_at: str
+    content_hash: str
+    path: str
+    severity: Dict[str, int]
+    size: int
+    duplicate: bool = False
+    vault_hashes: Optional[Dict[str, str]] = None
+
+    @property
+    def total(self) -> int:
+        return sum(self.severity.values())
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict(), ensure_ascii=False, separators=(",", ":"))
+
+
+def content_hash(markdown: str) -> str:
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+
+def count_findings(markdown: str) -> Dict[str, int]:
+    """優先度別の指摘数（"#### Critical-" 等の見出しを1回の走査で数える）"""
+    counts = dict.fromkeys(SEVERITIES, 0)
+    for level in _FINDING.findall(markdown):
+        counts[level.lower()] += 1
+    return counts
+
+
+def _file_stem(schema: str, obj: Optional[str], ts: datetime) -> str:
+    schema_name = str(schema).replace("/", "_").replace(".", "_")
+    obj_part = "_" + str(obj).replace("/", "_").replace(".", "_") if obj else ""
+    return f"{schema_name}{obj_part}_{ts.strftime('%Y%m%d_%H%M%S')}"
+
+
+class ReviewStore:
+    """
+    レビュー結果の保存と履歴参照
+
+    Args:
+        root: Markdown と index.jsonl を置くディレクトリ
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index_path = self.root / INDEX_FILE
+        self._lock = threading.Lock()
+        self._records: List[ReviewRecord] = []
+        self._by_hash: Dict[str, ReviewRecord] = {}
+        self._loaded_sig: Optional[Tuple[int, int]] = None
+
+    def save(
+        self,
+        schema: str,
+        markdown: str,
+        obj: Optional[str] = None,
+        reviewed_at: Optional[datetime] = None,
+        vault_hashes: Optional[Dict[str, str]] = None,
+    ) -> ReviewRecord:
+        """
+        レビュー結果を保存してインデックスに追記する
+
+        同じ内容（ハッシュ一致）が保存済みなら Markdown は書かず、既存ファイルを指す
+        duplicate=True のレコードだけを追記する。
+        vault_hashes はレビュー時点の Vault のオブジェクト別ハッシュ（差分レビューの基準）。
+
+        Returns:
+            追記したレコード（path は root からの相対パス）
+        """
+        reviewed_at = reviewed_at or datetime.now()
+        digest = content_hash(markdown)
+        with self._lock:
+            self._load_locked()
+            existing = self._by_hash.get(digest)
+            if existing is not None:
+                record = existing._replace(
+                    schema=schema,
+                    object=obj,
+                    reviewed_at=reviewed_at.isoformat(timespec="seconds"),
+                    duplicate=True,
+                    vault_hashes=vault_hashes,
+                )
+            else:
+                self.root.mkdir(parents=True, exist_ok=True)
+                path = self._new_path(schema, obj, reviewed_at)
+                path.write_text(markdown, encoding="utf-8")
+                record = ReviewRecord(
+                    schema=schema,
+                    object=obj,
+                    reviewed_at=reviewed_at.isoformat(timespec="seconds"),
+                    content_hash=digest,
+                    path=path.name,
+                    severity=count_findings(markdown),
+                    size=len(markdown.encode("utf-8")),
+                    vault_hashes=vault_hashes,
+                )
+            self._append_locked([record])
+        if record.duplicate:
+            logging.info(f"Review unchanged, not rewritten: {record.path}")
+        return record
+
+    def records(self) -> List[ReviewRecord]:
+        """全レコード（追記順）。インデックスが変わっていなければ読み直さない"""
+        with self._lock:
+            self._load_locked()
+            return list(self._records)
+
+    def history(
+        self,
+        schema: Optional[str] = None,
+        obj: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[ReviewRecord]:
+        """
+        レビュー履歴（新しい順）
+
+        Args:
+            schema / obj: 絞り込み（大文字小文字は区別しない。obj="" ならスキーマ単位レビューのみ）
+        """
+        out = []
+        for r in reversed(self.records()):
+            if schema is not None and r.schema.upper() != schema.upper():
+                continue
+            if obj is not None and (r.object or "").upper() != obj.upper():
+                continue
+            out.append(r)
+            if limit is not None and len(out) >= limit:
+                break
+        return out
+
+    def latest(self, schema: str, obj: Optional[str] = None) -> Optional[ReviewRecord]:
+        found = self.history(schema, obj or "", limit=1)
+        return found[0] if found else None
+
+    def read(self, record: ReviewRecord) -> str:
+        return (self.root / record.path).read_text(encoding="utf-8")
+
+    def backfill(self) -> int:
+        """
+        インデックスに無い既存の Markdown をインデックスに追加する（読むのは未登録のファイルのみ）
+
+        スキーマ・オブジェクトは frontmatter の target とファイル名から、日時はファイル名から求める。
+
+        Returns:
+            追加したレコード数
+        """
+        with self._lock:
+            self._load_locked()
+            known = {r.path for r in self._records}
+            added: List[ReviewRecord] = []
+            for md_file in sorted(self.root.glob("*.md")):
+                if md_file.name in known:
+                    continue
+                record = self._record_from_file(md_file)
+                if record is None:
+                    logging.warning(f"Skipping {md_file.name} (invalid file name)")
+                    continue
+                if record.content_hash in self._by_hash:
+                    record = record._replace(duplicate=True)
+                self._by_hash.setdefault(record.content_hash, record)
+                added.append(record)
+            added.sort(key=lambda r: r.reviewed_at)
+            if added:
+                self._append_locked(added)
+        return len(added)
+
+    def _new_path(self, schema: str, obj: Optional[str], reviewed_at: datetime) -> Path:
+        """保存先のパス（同じ秒に同じ対象を保存した場合は、既存ファイルを上書きしないよう秒を進める）"""
+        ts = reviewed_at
+        path = self.root / f"{_file_stem(schema, obj, ts)}.md"
+        while path.exists():
+            ts += timedelta(seconds=1)
+            path = self.root / f"{_file_stem(schema, obj, ts)}.md"
+        return path
+
+    def _record_from_file(self, md_file: Path) -> Optional[ReviewRecord]:
+        m = _FILENAME.match(md_file.name)
+        if not m:
+            return None
+        markdown = md_file.read_text(encoding="utf-8")
+        reviewed_at = datetime.strptime(f"{m['date']}{m['time']}", "%Y%m%d%H%M%S")
+        schema, obj = self._target_of(m["prefix"], markdown)
+        return ReviewRecord(
+            schema=schema,
+            object=obj,
+            reviewed_at=reviewed_at.isoformat(timespec="seconds"),
+            content_hash=content_hash(markdown),
+            path=md_file.name,
+            severity=count_findings(markdown),
+            size=len(markdown.encode("utf-8")),
+        )
+
+    @staticmethod
+    def _target_of(prefix: str, markdown: str) -> Tuple[str, Optional[str]]:
+        """
+        ファイル名の接頭辞（{schema}_{object}）と frontmatter の target から対象を求める
+
+        target は Agent の出力のため SCHEMA / SCHEMA.OBJECT / OBJECT のいずれもあり得る。
+        接頭辞と矛盾しない解釈だけを採用し、決められなければ接頭辞全体をスキーマとする。
+        """
+        m = _FRONTMATTER_TARGET.search(markdown[:1000])
+        target = (m.group(1).strip("'\"") if m else "").upper()
+        upper = prefix.upper()
+        if "." in target:
+            schema, obj = target.split(".", 1)
+            if upper == f"{schema}_{obj}".replace(".", "_"):
+                return prefix[: len(schema)], prefix[len(schema) + 1:]
+        elif target:
+            if upper == target:
+                return prefix, None
+            if upper.startswith(target + "_"):
+                return prefix[: len(target)], prefix[len(target) + 1:]
+            if upper.endswith("_" + target):
+                return prefix[: -len(target) - 1], prefix[-len(target):]
+        return prefix, None
+
+    def _load_locked(self) -> None:
+        try:
+            st = self.index_path.stat()
+        except FileNotFoundError:
+            self._records, self._by_hash, self._loaded_sig = [], {}, None
+            return
+        sig = (st.st_mtime_ns, st.st_size)
+        if sig == self._loaded_sig:
+            return
+        records: List[ReviewRecord] = []
+        with self.index_path.open(encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(ReviewRecord(**json.loads(line)))
+                except (ValueError, TypeError) as e:
+                    logging.warning(f"Invalid review index line: {e}")
+        self._records = records
+        self._by_hash = {}
+        for r in records:
+            self._by_hash.setdefault(r.content_hash, r)
+        self._loaded_sig = sig
+
+    def _append_locked(self, records: Iterable[ReviewRecord]) -> None:
+        records = list(records)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # 1回の write で追記する（O_APPEND のため他プロセスの追記と行が混ざらない）
+        with self.index_path.open("a", encoding="utf-8") as f:
+            f.write("".join(r.to_json() + "\n" for r in records))
+        self._records.extend(records)
+        for r in records:
+            self._by_hash.setdefault(r.content_hash, r)
+        st = self.index_path.stat()
+        self._loaded_sig = (st.st_mtime_ns, st.st_size)
+
+
+_store: Optional[ReviewStore] = None
+_store_lock = threading.Lock()
+
+
+def get_review_store() -> ReviewStore:
+    """プロセス共有の ReviewStore を取得する（REVIEW_STORE_DIR、未設定なら docs/.../reviews/schemas）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReviewStore(Path(os.getenv("REVIEW_STORE_DIR") or DEFAULT_DIR))
+    return _store
@@ -1,11 +1,81 @@
 """
 S3ファイルアップロード用ユーティリティ
 AWS認証情報は環境変数またはlocal.settings.jsonから取得
+
+S3クライアントの生成は数十msかかりメモリも食うため、認証情報とリージョンの
+組ごとにプロセス内でキャッシュして使い回す（boto3 のクライアントはスレッドセーフ）。
+メモリ上のデータは upload_bytes / upload_stream で一時ファイルを介さずに送信する。
+アップロードの所要時間は metrics.py（chatdemo_s3_upload_duration_seconds）に記録する。
 """
+import io
 import os
+import threading
+import time
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import BotoCoreError, ClientError
-from typing import Optional
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from metrics import S3_UPLOAD_DURATION
+
+# これ以上のサイズはマルチパートアップロード（既定: 8MB）
+MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', str(8 * 1024 * 1024)))
+
+_clients: Dict[Tuple[Optional[str], ...], object] = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    現在の認証情報・リージョンに対応するS3クライアントを取得する（キャッシュ済みなら再利用）
+    """
+    cache_key = (
+        os.getenv('AWS_ACCESS_KEY_ID'),
+        os.getenv('AWS_SECRET_ACCESS_KEY'),
+        os.getenv('AWS_SESSION_TOKEN'),
+        os.getenv('AWS_REGION'),
+    )
+    client = _clients.get(cache_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(cache_key)
+            if client is None:
+                access_key, secret_key, session_token, region = cache_key
+                session = boto3.session.Session()
+                client = session.client(
+                    's3',
+                    aws_access_key_id=access_key,
+                    aws_secret_access_key=secret_key,
+                    aws_session_token=session_token,
+                    region_name=region
+                )
+                _clients[cache_key] = client
+    return client
+
+
+def clear_s3_client_cache() -> None:
+    """キャッシュしたS3クライアントを破棄する（認証情報のローテーション時など）"""
+    with _clients_lock:
+        _clients.clear()
+
+
+def _transfer_config() -> TransferConfig:
+    return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE)
+
+
+def _extra_args(content_type: Optional[str], content_encoding: Optional[str] = None) -> Dict[str, str]:
+    extra_args = {}
+    if content_type:
+        extra_args['ContentType'] = content_type
+    if content_encoding:
+        extra_args['ContentEncoding'] = content_encoding
+    return extra_args
+
+
+def _observe_upload(started: float, ok: bool) -> None:
+    S3_UPLOAD_DURATION.observe(time.perf_counter() - started, "success" if ok else "failure")
+
 
 def upload_file_to_s3(file_path: str, bucket: str, key: str, content_type: Optional[str] = None) -> bool:
     """
@@ -16,19 +86,82 @@ def upload_file_to_s3(file_path: str, bucket: str, key: str, content_type: Optio
     :param content_type: Content-Type（省略可）
     :return: 成功時True, 失敗時False
     """
-    session = boto3.session.Session()
-    s3 = session.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_REGION')
-    )
-    extra_args = {'ContentType': content_type} if content_type else {}
+    started = time.perf_counter()
+    try:
+        s3 = get_s3_client()
+        s3.upload_file(file_path, bucket, key, ExtraArgs=_extra_args(content_type), Config=_transfer_config())
+        print(f"✓ S3アップロード成功: s3://{bucket}/{key}")
+        _observe_upload(started, True)
+        return True
+    except (BotoCoreError, ClientError) as e:
+        print(f"S3アップロード失敗: {e}")
+        _observe_upload(started, False)
+        return False
+
+
+def upload_bytes(
+    data: bytes,
+    bucket: str,
+    key: str,
+    content_type: Optional[str] = None,
+    content_encoding: Optional[str] = None,
+) -> bool:
+    """
+    メモリ上のバイト列をS3にアップロードする
+    MULTIPART_THRESHOLD 未満は put_object 1回、それ以上はマルチパートで送信する
+    :param data: アップロードするデータ
+    :param bucket: S3バケット名
+    :param key: S3オブジェクトキー（パス含む）
+    :param content_type: Content-Type（省略可）
+    :param content_encoding: Content-Encoding（省略可）
+    :return: 成功時True, 失敗時False
+    """
+    if len(data) >= MULTIPART_THRESHOLD:
+        return upload_stream(io.BytesIO(data), bucket, key, content_type, content_encoding)
+    started = time.perf_counter()
+    try:
+        s3 = get_s3_client()
+        s3.put_object(Bucket=bucket, Key=key, Body=data, **_extra_args(content_type, content_encoding))
+        print(f"✓ S3アップロード成功: s3://{bucket}/{key}")
+        _observe_upload(started, True)
+        return True
+    except (BotoCoreError, ClientError) as e:
+        print(f"S3アップロード失敗: {e}")
+        _observe_upload(started, False)
+        return False
+
+
+def upload_stream(
+    fileobj: BinaryIO,
+    bucket: str,
+    key: str,
+    content_type: Optional[str] = None,
+    content_encoding: Optional[str] = None,
+) -> bool:
+    """
+    ファイルライクオブジェクト（BytesIO・ソケット等）の内容をS3にアップロードする
+    大きなデータは MULTIPART_CHUNKSIZE ごとのマルチパートで送信する
+    :param fileobj: read() 可能なバイナリストリーム
+    :param bucket: S3バケット名
+    :param key: S3オブジェクトキー（パス含む）
+    :param content_type: Content-Type（省略可）
+    :param content_encoding: Content-Encoding（省略可）
+    :return: 成功時True, 失敗時False
+    """
+    started = time.perf_counter()
     try:
-        s3.upload_file(file_path, bucket, key, ExtraArgs=extra_args)
+        s3 = get_s3_client()
+        s3.upload_fileobj(
+            fileobj,
+            bucket,
+            key,
+            ExtraArgs=_extra_args(content_type, content_encoding),
+            Config=_transfer_config(),
+        )
         print(f"✓ S3アップロード成功: s3://{bucket}/{key}")
+        _observe_upload(started, True)
         return True
     except (BotoCoreError, ClientError) as e:
         print(f"S3アップロード失敗: {e}")
+        _observe_upload(started, False)
         return False
@@ -0,0 +1,260 @@
+"""
+同一リクエストの Cortex Agent ストリーム共有（single-flight）
+
+ダッシュボード更新などで同じ質問が数秒内に集中すると、chat_stream がその数だけ
+Agent を実行してしまう。ここでは実行中の同一リクエスト（キーが一致するもの）を
+1本の上流SSEストリームにまとめ、受信したイベントを全ての待ち手に配る。
+途中から参加したリクエストには、それまでに受信したイベントを先頭から再生する。
+
+上流の受信はバックグラウンドタスクで行うため、最初のリクエスト（leader）が
+切断しても後続（follower）は最後まで受け取れる。購読者が全員切断したら上流の受信を止める
+（受付制御の実行枠は購読者側で解放済みのため、誰も読まない Agent 実行を続けない）。
+
+受信済みイベントは再生用に保持するが、CHAT_SINGLE_FLIGHT_MAX_REPLAY_EVENTS を超えたら
+新しい相乗りを止め、全購読者が受け取り済みのイベントから捨てる（保持するのは最も遅い購読者との差分のみ）。
+上流が正常に終わらなかった場合（例外・キャンセル）は、購読者に例外を送出する
+（途中までの回答を完了として扱わない）。
+
+設定（環境変数）:
+    CHAT_SINGLE_FLIGHT_ENABLED: 共有を有効にする（既定: false）
+    CHAT_SINGLE_FLIGHT_MAX_REPLAY_EVENTS: 途中参加の再生用に保持するイベント数の上限（既定: 2000）
+"""
+import asyncio
+import itertools
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sse_parser import SSEEvent
+
+
+class SingleFlightAborted(Exception):
+    """共有した上流ストリームが完了前に止まった（キャンセル等）"""
+
+
+class _Flight:
+    """
+    実行中の上流ストリーム1本分の状態（受信済みイベント・購読者・完了状態）
+
+    events[0] は上流から受信した offset 番目のイベント。positions は購読者ごとの次に読む位置。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_replay: int, detach: Callable[[], None]):
+        self.opened: asyncio.Future = loop.create_future()
+        self.cond = asyncio.Condition()
+        self.events: List[SSEEvent] = []
+        self.offset = 0
+        self.positions: Dict[int, int] = {}
+        self.max_replay = max_replay
+        self.detach = detach
+        self.events_seen = 0
+        self.finished = False
+        self.expired: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def received(self) -> int:
+        return self.offset + len(self.events)
+
+    def leave(self, subscriber: int) -> None:
+        """購読者を外す（最後の購読者なら上流の受信を止める）"""
+        if self.positions.pop(subscriber, None) is None:
+            return
+        if not self.positions and not self.finished:
+            logging.info("Single-flight: all subscribers left; cancelling upstream agent stream")
+            self.detach()
+            if self.task is not None:
+                self.task.cancel()
+        else:
+            self.trim()
+
+    def trim(self) -> None:
+        """再生用の上限を超えたら相乗りを止め、全購読者が受け取り済みのイベントを捨てる"""
+        if len(self.events) <= self.max_replay:
+            return
+        self.detach()
+        low = min(self.positions.values(), default=self.received)
+        if low > self.offset:
+            del self.events[: low - self.offset]
+            self.offset = low
+
+
+class CoalescedStream:
+    """
+    共有された上流ストリームの購読側（SSEEventStream と同じインターフェイス）
+
+    Attributes:
+        leader: この購読で上流を開いた場合 True
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, flight: _Flight, leader: bool):
+        self._flight = flight
+        self.leader = leader
+        self._id = next(self._ids)
+        flight.positions[self._id] = 0
+
+    @property
+    def events_seen(self) -> int:
+        """上流で受信した data 行の数（購読外イベントを含む）"""
+        return self._flight.events_seen
+
+    @property
+    def expired(self) -> Optional[str]:
+        """上流が期限切れで打ち切られた場合の種類（SSEEventStream.expired）"""
+        return self._flight.expired
+
+    @property
+    def truncated(self) -> bool:
+        return self._flight.expired is not None
+
+    def __aiter__(self) -> AsyncIterator[SSEEvent]:
+        return self._events()
+
+    async def _events(self) -> AsyncIterator[SSEEvent]:
+        flight = self._flight
+        i = flight.positions.get(self._id, flight.received)
+        try:
+            while True:
+                # 受信済み分を再生（途中参加でも先頭から）
+                while i < flight.received:
+                    yield flight.events[i - flight.offset]
+                    i += 1
+                    flight.positions[self._id] = i
+                flight.trim()
+                if flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: flight.received > i or flight.finished)
+        finally:
+            flight.leave(self._id)
+
+    async def aclose(self, drain: bool = False) -> None:
+        """購読をやめる（他の購読者がいれば上流は受信を続け、最後の購読者なら止める）"""
+        self._flight.leave(self._id)
+
+
+class StreamCoalescer:
+    """
+    キーごとに実行中の上流ストリームを1本にまとめる
+
+    使用例:
+        stream = await coalescer.open(key, lambda: client.open_sse(payload, subscribe=...))
+        try:
+            async for ev in stream:
+                ...
+        finally:
+            await stream.aclose()
+    """
+
+    def __init__(self, max_replay_events: int = 2000):
+        self.max_replay_events = max(1, max_replay_events)
+        self._flights: Dict[Tuple[int, Hashable], _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def open(
+        self,
+        key: Hashable,
+        opener: Callable[[], Awaitable[Any]],
+    ) -> CoalescedStream:
+        """
+        キーに対応する上流ストリームを購読する（無ければ opener で開く）
+
+        上流を開く際の例外（CortexAgentError 等）は、その時点で待っている
+        全ての呼び出し元に同じものを送出する。返した購読は aclose() で必ず閉じること。
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        flight = self._flights.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = _Flight(loop, self.max_replay_events, lambda: self._forget(flight_key, flight))
+            self._flights[flight_key] = flight
+            # タスクの参照を保持しておく（GCで回収されないように）
+            flight.task = loop.create_task(self._pump(flight, opener))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            logging.info(f"Single-flight: joined in-flight agent run (buffered_events={len(flight.events)})")
+        stream = CoalescedStream(flight, leader)
+        try:
+            await asyncio.shield(flight.opened)
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream
+
+    def _forget(self, flight_key: Tuple[int, Hashable], flight: _Flight) -> None:
+        """新しい相乗りを受け付けないようにする"""
+        if self._flights.get(flight_key) is flight:
+            del self._flights[flight_key]
+
+    async def _pump(self, flight: _Flight, opener: Callable[[], Awaitable[Any]]) -> None:
+        stream = None
+        completed = False
+        try:
+            try:
+                stream = await opener()
+            except Exception as e:
+                flight.error = e
+                flight.opened.set_exception(e)
+                return
+            flight.opened.set_result(None)
+
+            async for ev in stream:
+                flight.events.append(ev)
+                flight.events_seen = stream.events_seen
+                async with flight.cond:
+                    flight.cond.notify_all()
+            flight.events_seen = stream.events_seen
+            flight.expired = getattr(stream, "expired", None)
+            completed = True
+
+        except Exception as e:
+            logging.error(f"Single-flight upstream error: {e}")
+            flight.error = e
+
+        finally:
+            if not completed and flight.error is None:
+                # キャンセル等で途中で止まった（途中までの回答を完了として配らない）
+                flight.error = SingleFlightAborted("shared agent stream stopped before completion")
+            if not flight.opened.done():
+                flight.opened.cancel()
+            if stream is not None:
+                await stream.aclose()
+            flight.finished = True
+            flight.detach()
+            async with flight.cond:
+                flight.cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
+
+
+_coalescer: Optional[StreamCoalescer] = None
+
+
+def get_stream_coalescer() -> Optional[StreamCoalescer]:
+    """
+    プロセス共有の StreamCoalescer を取得する
+
+    Returns:
+        CHAT_SINGLE_FLIGHT_ENABLED が true でなければ None
+    """
+    global _coalescer
+    if os.getenv("CHAT_SINGLE_FLIGHT_ENABLED", "false").lower() != "true":
+        return None
+    if _coalescer is None:
+        _coalescer = StreamCoalescer(
+            max_replay_events=int(os.getenv("CHAT_SINGLE_FLIGHT_MAX_REPLAY_EVENTS", "2000")),
+        )
+    return _coalescer
@@ -5,12 +5,150 @@ Snowflake接続ユーティリティ - 秘密鍵認証対応
 """
 
 
+import hashlib
 import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from http_pool import get_session
+from resilience import call_with_retry_sync, get_circuit_breaker
+
+
+JWT_LIFETIME_SEC = 3600  # Snowflake のキーペア認証で許可される最大値（1時間）
+JWT_REFRESH_MARGIN_SEC = int(os.getenv("SNOWFLAKE_JWT_REFRESH_MARGIN_SEC", "300"))
+JWT_MIN_REMAINING_SEC = 30  # 残り有効期間がこれ未満のトークンは使わない
+
+
+class JWTMinter:
+    """
+    キーペア認証用JWTの発行とキャッシュ
+
+    秘密鍵の読み込み・パースと公開鍵フィンガープリントの計算は初回のみ行う。
+    署名済みトークンは exp の JWT_REFRESH_MARGIN_SEC 秒前まで使い回し、
+    それ以降は現在のトークンを返しつつバックグラウンドスレッドで再発行する。
+    残り JWT_MIN_REMAINING_SEC 秒を切った場合のみ呼び出し元で同期的に発行する。
+    """
+
+    def __init__(self, private_key_path: str, passphrase: Optional[str], account: str, user: str):
+        with open(private_key_path, "rb") as key_file:
+            private_key_data = key_file.read()
+
+        self._private_key = serialization.load_pem_private_key(
+            private_key_data,
+            password=passphrase.encode() if passphrase else None,
+            backend=default_backend()
+        )
+
+        # 公開鍵のフィンガープリントを取得
+        public_key_bytes = self._private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        public_key_fp = 'SHA256:' + hashlib.sha256(public_key_bytes).hexdigest()
+
+        account_identifier = f"{account}".upper()
+        self._qualified_username = f"{user}".upper()
+        self._issuer = f"{account_identifier}.{self._qualified_username}.{public_key_fp}"
+
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._refresh_at = 0.0
+        self._expires_at = 0.0
+        self._refreshing = False
+        self.mint_count = 0
+
+    def token(self) -> str:
+        """有効なJWTを返す（通常はキャッシュ参照のみ）"""
+        now = time.time()
+        if now < self._refresh_at:
+            return self._token
+        if now < self._expires_at - JWT_MIN_REMAINING_SEC:
+            self._refresh_in_background()
+            return self._token
+        with self._lock:
+            if time.time() >= self._expires_at - JWT_MIN_REMAINING_SEC:
+                self._mint()
+            return self._token
+
+    def _mint(self) -> None:
+        now = int(time.time())
+        payload = {
+            "iss": self._issuer,
+            "sub": self._qualified_username,
+            "iat": now,
+            "exp": now + JWT_LIFETIME_SEC
+        }
+        token = jwt.encode(payload, self._private_key, algorithm="RS256")
+        # トークン → 期限の順に更新（読み手はロックなしで参照するため）
+        self._token = token
+        self._expires_at = now + JWT_LIFETIME_SEC
+        self._refresh_at = now + JWT_LIFETIME_SEC - JWT_REFRESH_MARGIN_SEC
+        self.mint_count += 1
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                with self._lock:
+                    if time.time() >= self._refresh_at:
+                        self._mint()
+            except Exception as e:
+                print(f"JWT token refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=_run, name="snowflake-jwt-refresh", daemon=True).start()
+
+
+_jwt_minters: Dict[Tuple[str, Optional[str], str, str], JWTMinter] = {}
+_jwt_minters_lock = threading.Lock()
+
+
+def _get_jwt_minter(private_key_path: str, passphrase: Optional[str], account: str, user: str) -> Optional[JWTMinter]:
+    """
+    鍵・アカウント・ユーザーの組ごとに JWTMinter をプロセス内で共有する
+
+    Returns:
+        秘密鍵ファイルが存在しない場合は None
+    """
+    key = (private_key_path, passphrase, account, user)
+    minter = _jwt_minters.get(key)
+    if minter is None:
+        if not os.path.exists(private_key_path):
+            return None
+        with _jwt_minters_lock:
+            minter = _jwt_minters.get(key)
+            if minter is None:
+                minter = JWTMinter(private_key_path, passphrase, account, user)
+                _jwt_minters[key] = minter
+    return minter
+
 
 class SnowflakeAuthClient:
     def __init__(self):
-        self.account_url = os.getenv("SNOWFLAKE_ACCOUNT_URL")
+        self.account = os.getenv("SNOWFLAKE_ACCOUNT")
+        self.host = os.getenv("SNOWFLAKE_HOST")
+        self.user = os.getenv("SNOWFLAKE_USER")
+        self.account_url = os.getenv("SNOWFLAKE_ACCOUNT_URL", "").rstrip("/")
         self.bearer_token = os.getenv("SNOWFLAKE_BEARER_TOKEN")
+        self.auth_method = os.getenv("SNOWFLAKE_AUTH_METHOD", "bearer_token")
+        self.private_key_path = os.getenv("SNOWFLAKE_PRIVATE_KEY_PATH")
+        self.private_key_passphrase = os.getenv("SNOWFLAKE_PRIVATE_KEY_PASSPHRASE")
+        self.warehouse = os.getenv("SNOWFLAKE_WAREHOUSE")
+        self.database = os.getenv("SNOWFLAKE_DATABASE")
+        self.schema = os.getenv("SNOWFLAKE_SCHEMA")
+        self.role = os.getenv("SNOWFLAKE_ROLE")
+        self.session = get_session()
 
     def get_auth_headers(self):
         if self.bearer_token:
@@ -21,60 +159,24 @@ class SnowflakeAuthClient:
         if self.bearer_token:
             return self.bearer_token
         raise ValueError("SNOWFLAKE_BEARER_TOKEN is not set")
+
     def get_jwt_token(self) -> Optional[str]:
-        """秘密鍵からJWTトークンを生成"""
-        if not self.private_key_path or not os.path.exists(self.private_key_path):
+        """秘密鍵からJWTトークンを取得（署名済みトークンは有効期限の手前までキャッシュ）"""
+        if not self.private_key_path:
             return None
-        
+
         try:
-            # 秘密鍵を読み込み
-            with open(self.private_key_path, "rb") as key_file:
-                private_key_data = key_file.read()
-            
-            passphrase = self.private_key_passphrase.encode() if self.private_key_passphrase else None
-            
-            private_key = serialization.load_pem_private_key(
-                private_key_data,
-                password=passphrase,
-                backend=default_backend()
-            )
-            
-            # 公開鍵のフィンガープリントを取得
-            public_key_bytes = private_key.public_key().public_bytes(
-                encoding=serialization.Encoding.DER,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            minter = _get_jwt_minter(
+                self.private_key_path,
+                self.private_key_passphrase,
+                self.account,
+                self.user,
             )
-            
-            import hashlib
-            public_key_fp = 'SHA256:' + hashlib.sha256(public_key_bytes).hexdigest()
-            
-            # JWTペイロードを作成
-            account_identifier = f"{self.account}".upper()
-            qualified_username = f"{self.user}".upper()
-            
-            now = int(time.time())
-            lifetime = 3600  # 1時間
-            
-            payload = {
-                "iss": f"{account_identifier}.{qualified_username}.{public_key_fp}",
-                "sub": qualified_username,
-                "iat": now,
-                "exp": now + lifetime
-            }
-            
-            # JWTトークンを生成
-            token = jwt.encode(
-                payload,
-                private_key,
-                algorithm="RS256"
-            )
-            
-            return token
-            
+            return minter.token() if minter else None
         except Exception as e:
             print(f"JWT token generation failed: {e}")
             return None
-    
+
     def get_auth_header(self) -> Dict[str, str]:
         """認証ヘッダーを取得"""
         if self.auth_method == "private_key":
@@ -88,8 +190,14 @@ class SnowflakeAuthClient:
         
         raise ValueError("No authentication method available")
     
-    def execute_query(self, sql: str) -> Optional[Dict[str, Any]]:
-        """SQLクエリを実行"""
+    def execute_query(self, sql: str, bindings: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """
+        SQLクエリを実行
+
+        Args:
+            sql: SQL文（バインド変数は ? で指定）
+            bindings: {"1": {"type": "TEXT", "value": "..."}, ...}
+        """
         url = f"{self.account_url}/api/v2/statements"
         
         headers = {
@@ -106,11 +214,19 @@ class SnowflakeAuthClient:
             "warehouse": self.warehouse,
             "role": self.role
         }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload)
+        if bindings:
+            payload["bindings"] = bindings
+        # 再試行時は同じ requestId に retry=true を付けて送る（二重実行にならない）
+        params = {"requestId": str(uuid.uuid4())}
+
+        def _post() -> Dict[str, Any]:
+            response = self.session.post(url, headers=headers, params=dict(params), json=payload)
+            params["retry"] = "true"
             response.raise_for_status()
             return response.json()
+
+        try:
+            return call_with_retry_sync(_post, breaker=get_circuit_breaker(f"sql:{self.account_url}"))
         except Exception as e:
             print(f"Query execution failed: {e}")
             if hasattr(e, 'response') and e.response:
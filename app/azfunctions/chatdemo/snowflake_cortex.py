@@ -1,7 +1,10 @@
 import os
-import requests
 import json
-from typing import Dict, Any, Optional
+import requests
+from typing import Dict, Any, Optional, Tuple
+from chat_message_writer import get_chat_message_writer
+from http_pool import get_session
+from resilience import RETRYABLE_STATUS, call_with_retry_sync, get_circuit_breaker
 from snowflake_auth import SnowflakeAuthClient
 
 class SnowflakeCortexClient:
@@ -14,58 +17,46 @@ class SnowflakeCortexClient:
         self.account = self.auth_client.account
         self.host = self.auth_client.host
         self.user = self.auth_client.user
-        import os
-        import requests
+        self.base_url = self.auth_client.account_url
+        self.database = self.auth_client.database
+        self.schema = self.auth_client.schema
+        self.agent_name = os.getenv('SNOWFLAKE_AGENT_NAME', 'SNOWFLAKE_DEMO_AGENT')
+        # function_app.py の各エンドポイントと同じ接続プールを共有
+        self.session = get_session()
 
-        class SnowflakeCortexClient:
-            """
-            Snowflake Cortex Agent REST APIクライアント
-            """
-            def __init__(self):
-                self.base_url = os.getenv('SNOWFLAKE_ACCOUNT_URL', '').rstrip('/')
-                self.database = os.getenv('SNOWFLAKE_DATABASE', '')
-                self.schema = os.getenv('SNOWFLAKE_SCHEMA', '')
-                self.agent_name = os.getenv('SNOWFLAKE_AGENT_NAME', 'SNOWFLAKE_DEMO_AGENT')
-                self.session = requests.Session()
+    def execute_query(self, sql: str, bindings: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """SQL API経由でクエリを実行（SnowflakeAuthClientに委譲）"""
+        return self.auth_client.execute_query(sql, bindings)
 
-            def call_cortex_agent(self, message: str) -> dict:
-                """
-                Snowflake Cortex AgentをREST API経由で呼び出す
-                """
-                agent_schema, agent_object = self._parse_agent_name(self.agent_name)
-                url = f"{self.base_url}/databases/{self.database}/schemas/{agent_schema}/agents/{agent_object}:run"
-                token = os.getenv("SNOWFLAKE_BEARER_TOKEN", "")
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                }
-                payload = {
-                    "messages": [{"role": "user", "content": [{"type": "text", "text": message}]}],
-                    "tool_choice": {"type": "auto"},
-                }
-                response = self.session.post(
-                    url,
-                    headers=headers,
-                    json=payload,
-                    timeout=120
-                )
-                if response.status_code >= 400:
-                    error_msg = f"Snowflake Agent Error: {response.status_code} - {response.text}"
-                    return {"error": "snowflake_error", "message": error_msg}
-                return response.json()
+    def _parse_agent_name(self, agent_name: str) -> Tuple[str, str]:
+        if "." in agent_name:
+            agent_schema, agent_object = agent_name.split(".", 1)
+            return agent_schema, agent_object
+        return self.schema, agent_name
 
-            def _parse_agent_name(self, agent_name: str):
-                if "." in agent_name:
-                    return agent_name.split(".", 1)
-                return self.schema, agent_name
+    def call_cortex_agent(self, message: str, agent_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Snowflake Cortex AgentをREST API経由で呼び出す（SSEを収集して返す）
+        """
+        agent_schema, agent_object = self._parse_agent_name(agent_name or self.agent_name)
+        url = f"{self.base_url}/api/v2/databases/{self.database}/schemas/{agent_schema}/agents/{agent_object}:run"
+        headers = {
+            **self.auth_client.get_auth_header(),
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        }
+        full_prompt = message
+        payload = {
+            "messages": [
+                {
+                    "role": "user",
                     "content": [{"type": "text", "text": full_prompt}]
                 }
             ],
             "tool_choice": {"type": "auto"}
         }
         
-        try:
+        def _post() -> requests.Response:
             response = self.session.post(
                 url,
                 headers=headers,
@@ -73,6 +64,17 @@ class SnowflakeCortexClient:
                 stream=True,
                 timeout=900
             )
+            if response.status_code in RETRYABLE_STATUS:
+                # 本文を読み切ってから送出（再試行し尽くした場合は下のエラー応答に使う）
+                response.content
+                raise requests.HTTPError(f"Snowflake Agent Error: {response.status_code}", response=response)
+            return response
+
+        try:
+            try:
+                response = call_with_retry_sync(_post, breaker=get_circuit_breaker(f"agent:{self.base_url}"))
+            except requests.HTTPError as e:
+                response = e.response
             
             print(f"Agent API status code: {response.status_code}")
             
@@ -135,29 +137,12 @@ class SnowflakeCortexClient:
     def save_message(self, user_id: str, message: str, ai_response: Optional[str] = None) -> bool:
         """
         チャットメッセージをSnowflakeに保存
+
+        書き込みキューに積んで即座に戻る。実際の INSERT は ChatMessageWriter が
+        複数メッセージをまとめて（バインド変数で）実行する。
         """
-        # テーブルが存在しない場合は作成
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS CHAT_MESSAGES (
-            ID NUMBER AUTOINCREMENT,
-            USER_ID VARCHAR(255),
-            MESSAGE TEXT,
-            AI_RESPONSE TEXT,
-            TIMESTAMP TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
-            PRIMARY KEY (ID)
-        )
-        """
-        
-        self.execute_query(create_table_query)
-        
-        # メッセージを挿入
-        insert_query = f"""
-        INSERT INTO CHAT_MESSAGES (USER_ID, MESSAGE, AI_RESPONSE)
-        VALUES ('{user_id}', '{message}', '{ai_response if ai_response else 'NULL'}')
-        """
-        
-        result = self.execute_query(insert_query)
-        return result is not None
+        get_chat_message_writer(self.execute_query).save(user_id, message, ai_response)
+        return True
     
     def get_messages(self, limit: int = 50) -> Optional[list]:
         """
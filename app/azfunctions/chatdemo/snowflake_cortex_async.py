@@ -0,0 +1,407 @@
+"""
+Snowflake Cortex Agent 非同期クライアント（asyncio / aiohttp）
+
+Agent実行（最大900秒）の間ワーカースレッドを占有しないよう、
+function_app.py の async エンドポイントから await で呼び出す。
+接続は http_pool.get_async_session() の共有プールを使う。
+ストリームを受け取る前の一時的な失敗（429 / 5xx・接続失敗）は resilience.py で再試行する。
+
+open_sse の timeout は接続・ソケット受信の上限でしかなく、少しずつバイトが届く
+ストリームは止められない。StreamDeadlines で「最初のイベントまで」「イベント間隔」
+「全体」の期限を指定すると、超えた時点で受信を打ち切って正常終了し
+（SSEEventStream.truncated / expired）、それまでに受け取ったイベントで応答を組み立てられる。
+
+Agent実行の所要時間・SSEイベント種類別の件数・ツール呼び出しは metrics.py に記録する
+（イベント件数はストリーム終了時にまとめて加算）。
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+
+from http_pool import get_async_session
+from metrics import ACTIVE_STREAMS, AGENT_RUN_DURATION, AGENT_SSE_EVENTS, observe_tool_call
+from resilience import CircuitOpenError, call_with_retry, get_circuit_breaker, parse_retry_after
+from sse_parser import EVENT_TOOL_CALL, EVENT_TOOL_END, EVENT_TOOL_RESULT, EVENT_TOOL_START, SSEEvent, SSEParser
+
+# [DONE] 後に残りを読み切る上限秒数（期限指定時は受信間隔のタイムアウトが無いため。超えたら接続を切る）
+DRAIN_TIMEOUT_SEC = 2.0
+
+
+class StreamDeadlines(NamedTuple):
+    """
+    Agentストリームの期限（秒。None なら制限しない）
+
+    Attributes:
+        first_event: リクエスト開始から最初のイベント（data 行）まで
+        idle: イベントの最大間隔（購読外のイベントも受信とみなす）
+        total: リクエスト開始からストリーム終了まで
+    """
+    first_event: Optional[float] = None
+    idle: Optional[float] = None
+    total: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, prefix: str, first_event: float, idle: float, total: float) -> "StreamDeadlines":
+        """
+        {prefix}_FIRST_EVENT_SEC / {prefix}_IDLE_SEC / {prefix}_TOTAL_SEC から生成する（0 で制限しない）
+        """
+        def _read(name: str, default: float) -> Optional[float]:
+            value = float(os.getenv(f"{prefix}_{name}_SEC", str(default)))
+            return value if value > 0 else None
+
+        return cls(_read("FIRST_EVENT", first_event), _read("IDLE", idle), _read("TOTAL", total))
+
+
+class CortexAgentError(Exception):
+    """Cortex Agent REST API がエラーステータスを返した"""
+
+    def __init__(self, status: int, body: str, retry_after: Optional[float] = None):
+        super().__init__(f"Cortex Agent API error: {status}")
+        self.status = status
+        self.body = body
+        # 応答の Retry-After（サーキットが開いている場合は再開までの秒数）
+        self.retry_after = retry_after
+
+
+class AsyncCortexAgentClient:
+    """
+    Cortex Agent REST API（POST .../agents/{agent}:run）の非同期クライアント
+    """
+
+    def __init__(self, base_url: str, token: str, database: str, schema: str, agent: str):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.database = database
+        self.schema = schema
+        self.agent = agent
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/api/v2/databases/{self.database}/schemas/{self.schema}/agents/{self.agent}:run"
+
+    def _headers(self, accept: str) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json",
+            "Accept": accept,
+        }
+
+    @staticmethod
+    def _timeout(timeout: float, read: bool = True) -> aiohttp.ClientTimeout:
+        # requests の timeout と同じく「接続」と「受信間隔」の上限として扱う
+        # （read=False なら受信間隔は呼び出し側の期限に任せる）
+        return aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout if read else None)
+
+    async def _with_retry(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """一時的な失敗を再試行する（サーキットが開いていれば 503 の CortexAgentError）"""
+        try:
+            return await call_with_retry(fn, breaker=get_circuit_breaker(f"agent:{self.base_url}"))
+        except CircuitOpenError as e:
+            raise CortexAgentError(503, str(e), retry_after=e.retry_after) from e
+
+    async def run_agent(self, payload: Dict[str, Any], timeout: float = 60) -> Dict[str, Any]:
+        """
+        Agentを実行し、JSON応答（非ストリーミング）を返す
+
+        Raises:
+            CortexAgentError: HTTPステータスが400以上の場合（429 / 5xx は再試行後）
+        """
+        started_at = time.monotonic()
+        outcome = "error"
+        try:
+            data = await self._with_retry(lambda: self._run_agent_once(payload, timeout))
+            outcome = "completed"
+            return data
+        finally:
+            AGENT_RUN_DURATION.observe(time.monotonic() - started_at, "run", outcome)
+
+    async def _run_agent_once(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        session = get_async_session()
+        async with session.post(
+            self.url,
+            headers=self._headers("application/json"),
+            json=payload,
+            timeout=self._timeout(timeout),
+        ) as resp:
+            if resp.status >= 400:
+                raise _agent_error(resp, await resp.text())
+            return await resp.json(content_type=None)
+
+    async def open_sse(
+        self,
+        payload: Dict[str, Any],
+        subscribe: Optional[Iterable[str]] = None,
+        timeout: float = 900,
+        deadlines: Optional[StreamDeadlines] = None,
+    ) -> "SSEEventStream":
+        """
+        Agentをストリーミング実行し、SSEイベントの非同期イテレータを返す
+
+        HTTPエラーはイテレータを返す前に例外として送出するため、
+        呼び出し側は受信ループの外でエラー応答を組み立てられる。
+
+        Args:
+            payload: :run のリクエストボディ
+            subscribe: JSON デコードして返すイベント名（None なら全イベント）
+            timeout: 接続・受信間隔のタイムアウト秒（deadlines に期限がある場合は接続のみ）
+            deadlines: 最初のイベント・イベント間隔・全体の期限（超えたら受信を打ち切る）
+
+        Raises:
+            CortexAgentError: HTTPステータスが400以上の場合（429 / 5xx は再試行後）
+        """
+        started_at = time.monotonic()
+        try:
+            return await self._with_retry(
+                lambda: self._open_sse_once(payload, subscribe, timeout, deadlines, started_at)
+            )
+        except BaseException:
+            AGENT_RUN_DURATION.observe(time.monotonic() - started_at, "stream", "error")
+            raise
+
+    async def _open_sse_once(
+        self,
+        payload: Dict[str, Any],
+        subscribe: Optional[Iterable[str]],
+        timeout: float,
+        deadlines: Optional[StreamDeadlines],
+        started_at: float,
+    ) -> "SSEEventStream":
+        session = get_async_session()
+        # 期限がある場合、受信間隔の上限（sock_read）が先に切れると ServerTimeoutError になり
+        # truncated / expired で終えられないため、受信は期限だけで打ち切る
+        resp = await session.post(
+            self.url,
+            headers=self._headers("text/event-stream"),
+            json=payload,
+            timeout=self._timeout(timeout, read=deadlines is None or not any(deadlines)),
+        )
+        if resp.status >= 400:
+            try:
+                body = await resp.text()
+            finally:
+                resp.release()
+            raise _agent_error(resp, body)
+        return SSEEventStream(resp, SSEParser(subscribe), deadlines, started_at)
+
+    async def run_many(
+        self,
+        payloads: Iterable[Dict[str, Any]],
+        max_concurrency: int = 4,
+        timeout: float = 900,
+    ) -> List[Any]:
+        """
+        複数のAgent実行を同時実行数を制限して並行実行する（バッチ用）
+
+        Returns:
+            payloads と同じ順序の結果リスト（失敗した要素は例外オブジェクト）
+        """
+        return await gather_bounded(
+            [lambda p=p: self.run_agent(p, timeout=timeout) for p in payloads],
+            max_concurrency,
+        )
+
+
+def _agent_error(resp: aiohttp.ClientResponse, body: str) -> CortexAgentError:
+    return CortexAgentError(resp.status, body, retry_after=parse_retry_after(resp.headers.get("Retry-After")))
+
+
+class SSEEventStream:
+    """
+    SSEレスポンスを SSEParser でパースし、購読イベントを受信順に返す非同期イテレータ
+
+    data: [DONE] を受け取ったら残りを読み捨てて接続を解放する
+    （読み切った接続だけが keep-alive プールに戻るため）。
+    deadlines の期限を超えた場合は接続を切って反復を終える（例外にはしない）。
+
+    Attributes:
+        expired: 期限切れで打ち切った場合の種類（"first_event" / "idle" / "total"）
+    """
+
+    _TOOL_EVENTS = frozenset({EVENT_TOOL_CALL, EVENT_TOOL_START, EVENT_TOOL_END, EVENT_TOOL_RESULT})
+
+    def __init__(
+        self,
+        resp: aiohttp.ClientResponse,
+        parser: SSEParser,
+        deadlines: Optional[StreamDeadlines] = None,
+        started_at: Optional[float] = None,
+    ):
+        self._resp = resp
+        self.parser = parser
+        self.deadlines = deadlines
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.expired: Optional[str] = None
+        self._tool_started: Dict[str, float] = {}
+        self._tool_durations: Dict[str, float] = {}
+        self._finished = False
+        ACTIVE_STREAMS.inc("agent")
+
+    @property
+    def events_seen(self) -> int:
+        """受信した data 行の数（購読外イベントを含む）"""
+        return self.parser.events_seen
+
+    @property
+    def truncated(self) -> bool:
+        """期限切れで途中までしか受信していない"""
+        return self.expired is not None
+
+    def __aiter__(self) -> AsyncIterator[SSEEvent]:
+        return self._events()
+
+    async def _events(self) -> AsyncIterator[SSEEvent]:
+        parser = self.parser
+        try:
+            async for chunk in self._chunks():
+                events = parser.feed(chunk)
+                if parser.done:
+                    await self.aclose(drain=True)
+                for ev in events:
+                    if ev.event in self._TOOL_EVENTS:
+                        self._observe_tool(ev)
+                    yield ev
+                if parser.done:
+                    return
+            if self.expired:
+                return
+            for ev in parser.close():
+                if ev.event in self._TOOL_EVENTS:
+                    self._observe_tool(ev)
+                yield ev
+        finally:
+            await self.aclose()
+
+    def _observe_tool(self, ev: SSEEvent) -> None:
+        """ツール呼び出しの件数・所要時間を記録する（開始イベントが無ければ tool_result の elapsed_ms を使う）"""
+        obj = ev.data if isinstance(ev.data, dict) else {}
+        tool_name = str(obj.get("name") or obj.get("tool_name") or "unknown")
+        if ev.event in (EVENT_TOOL_CALL, EVENT_TOOL_START):
+            self._tool_started.setdefault(tool_name, time.monotonic())
+            return
+        started = self._tool_started.pop(tool_name, None)
+        if started is not None:
+            self._tool_durations[tool_name] = time.monotonic() - started
+        if ev.event == EVENT_TOOL_END:
+            # 件数・状態は続く tool_result で記録する
+            return
+        duration = self._tool_durations.pop(tool_name, None)
+        if duration is None:
+            elapsed = obj.get("elapsed_ms") or obj.get("elapsedMs")
+            duration = elapsed / 1000 if isinstance(elapsed, (int, float)) else None
+        observe_tool_call(tool_name, obj.get("status"), duration)
+
+    def _finish(self) -> None:
+        """ストリーム終了時にメトリクスをまとめて記録する（1回のみ）"""
+        if self._finished:
+            return
+        self._finished = True
+        ACTIVE_STREAMS.dec("agent")
+        for name, n in self.parser.event_names().items():
+            AGENT_SSE_EVENTS.inc(name, amount=n)
+        if self.parser.done:
+            outcome = "completed"
+        elif self.expired:
+            outcome = "truncated"
+        else:
+            outcome = "aborted"
+        AGENT_RUN_DURATION.observe(time.monotonic() - self.started_at, "stream", outcome)
+
+    async def _chunks(self) -> AsyncIterator[bytes]:
+        content = self._resp.content
+        if self.deadlines is None:
+            async for chunk in content.iter_any():
+                yield chunk
+            return
+
+        last_event: Optional[float] = None
+        seen = self.parser.events_seen
+        while True:
+            timeout, kind = self._remaining(time.monotonic(), last_event)
+            try:
+                chunk = await asyncio.wait_for(content.readany(), timeout)
+            except asyncio.TimeoutError as e:
+                if isinstance(e, aiohttp.ServerTimeoutError):
+                    # 期限が無い（sock_read が有効な）場合の受信タイムアウト
+                    raise
+                self.expired = kind
+                logging.warning(
+                    f"Agent stream deadline exceeded ({kind}): "
+                    f"elapsed={time.monotonic() - self.started_at:.1f}s events={self.parser.events_seen}"
+                )
+                return
+            if not chunk:
+                return
+            yield chunk
+            if self.parser.events_seen != seen:
+                seen = self.parser.events_seen
+                last_event = time.monotonic()
+
+    def _remaining(self, now: float, last_event: Optional[float]) -> Tuple[Optional[float], Optional[str]]:
+        """最も近い期限までの秒数とその種類（期限が無ければ (None, None)）"""
+        d = self.deadlines
+        candidates = []
+        if d.total is not None:
+            candidates.append((self.started_at + d.total, "total"))
+        if last_event is None:
+            if d.first_event is not None:
+                candidates.append((self.started_at + d.first_event, "first_event"))
+        elif d.idle is not None:
+            candidates.append((last_event + d.idle, "idle"))
+        if not candidates:
+            return None, None
+        deadline, kind = min(candidates)
+        return max(0.0, deadline - now), kind
+
+    async def aclose(self, drain: bool = False) -> None:
+        """レスポンスを解放する（drain=True なら残りを読み切ってから。期限切れなら接続を切る）"""
+        self._finish()
+        if self._resp.closed:
+            return
+        if self.expired:
+            self._resp.close()
+            return
+        if drain:
+            try:
+                await asyncio.wait_for(self._drain(), DRAIN_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                # 読み切れない接続はプールに戻さない
+                self._resp.close()
+                return
+            except Exception:
+                pass
+        self._resp.release()
+
+    async def _drain(self) -> None:
+        async for _ in self._resp.content.iter_any():
+            pass
+
+
+async def gather_bounded(
+    factories: Iterable[Callable[[], Awaitable[Any]]],
+    max_concurrency: int,
+) -> List[Any]:
+    """
+    コルーチン生成関数を同時実行数 max_concurrency 以内で実行する
+
+    Args:
+        factories: 引数なしでコルーチンを返す関数のリスト
+        max_concurrency: 同時実行の上限（1以上）
+
+    Returns:
+        入力と同じ順序の結果リスト（失敗した要素は例外オブジェクト）
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(factory: Callable[[], Awaitable[Any]]) -> Any:
+        async with semaphore:
+            return await factory()
+
+    results = await asyncio.gather(*[_run(f) for f in factories], return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            logging.warning(f"Bounded task failed: {r}")
+    return results
@@ -0,0 +1,319 @@
+"""
+Snowflake SQL API 非同期エグゼキュータ（asyncio / aiohttp）
+
+SnowflakeAuthClient.execute_query は同期POSTで完了を待ち、先頭パーティションしか
+返さない。ここでは文を async=true で投入してステートメントハンドルをポーリングし、
+結果パーティションを先読み（同時取得数を制限）しながら行を順に返す。
+PROFILE_RESULTS や DOCS_OBSIDIAN の大きな結果でも、メモリに載るのは
+先読み中のパーティション分だけになる。
+429 / 5xx・接続失敗は resilience.py で再試行する（文の投入は同じ requestId で retry=true を付けて再送）。
+
+使用例:
+    client = AsyncSnowflakeSQLClient.from_env()
+    async for row in client.iter_rows("SELECT * FROM DB_DESIGN.PROFILE_RESULTS"):
+        ...
+
+    # 複数の文をまとめて投入してから結果を順に読む（パイプライン）
+    results = await client.query_many([sql1, sql2, sql3])
+"""
+import asyncio
+import logging
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence
+
+import aiohttp
+
+from http_pool import get_async_session
+from resilience import RETRYABLE_STATUS, CircuitOpenError, call_with_retry, get_circuit_breaker, parse_retry_after
+
+
+class SnowflakeSQLError(Exception):
+    """SQL API がエラーを返した（HTTPエラーまたは文の実行失敗）"""
+
+    def __init__(
+        self,
+        status: int,
+        body: str,
+        code: Optional[str] = None,
+        handle: Optional[str] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(f"Snowflake SQL API error: {status}" + (f" ({code})" if code else ""))
+        self.status = status
+        self.body = body
+        self.code = code
+        self.handle = handle
+        self.retry_after = retry_after
+
+
+class StatementResult:
+    """
+    完了した文の結果（行はパーティション単位で遅延取得）
+
+    Attributes:
+        handle: ステートメントハンドル
+        columns: 列名のリスト
+        num_rows: 全行数
+        partition_count: 結果パーティション数
+    """
+
+    def __init__(self, client: "AsyncSnowflakeSQLClient", first_page: Dict[str, Any]):
+        self._client = client
+        self._first_data: Optional[List[List[Any]]] = first_page.get("data") or []
+        meta = first_page.get("resultSetMetaData") or {}
+        self.handle: str = first_page.get("statementHandle", "")
+        self.metadata = meta
+        self.columns: List[str] = [c.get("name") for c in meta.get("rowType", [])]
+        self.num_rows: int = meta.get("numRows", len(self._first_data))
+        self.partition_count: int = max(1, len(meta.get("partitionInfo") or [None]))
+
+    async def rows(self, prefetch: Optional[int] = None) -> AsyncIterator[List[Any]]:
+        """
+        行を先頭から順に返す
+
+        2番目以降のパーティションは最大 prefetch 個を並行取得し、
+        読み終えたパーティションから破棄する。
+        """
+        prefetch = max(1, prefetch or self._client.partition_concurrency)
+        first, self._first_data = self._first_data, None
+        if first is None:
+            raise RuntimeError("StatementResult.rows() can only be iterated once")
+
+        pending: Deque[asyncio.Task] = deque()
+        next_partition = 1
+
+        def schedule() -> None:
+            nonlocal next_partition
+            while len(pending) < prefetch and next_partition < self.partition_count:
+                pending.append(asyncio.ensure_future(self._client.fetch_partition(self.handle, next_partition)))
+                next_partition += 1
+
+        try:
+            schedule()
+            for row in first:
+                yield row
+            del first
+            while pending:
+                data = await pending.popleft()
+                schedule()
+                for row in data:
+                    yield row
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class AsyncSnowflakeSQLClient:
+    """
+    Snowflake SQL API（/api/v2/statements）の非同期クライアント
+
+    Args:
+        base_url: アカウントURL（https://<account>.snowflakecomputing.com）
+        auth_header: 認証ヘッダを返す関数（SnowflakeAuthClient.get_auth_header 等）
+        warehouse / database / schema / role: 文の実行コンテキスト
+        partition_concurrency: 結果パーティションの同時取得数
+        poll_interval / max_poll_interval: ハンドルのポーリング間隔（指数的に延長）
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        auth_header: Callable[[], Dict[str, str]],
+        warehouse: Optional[str] = None,
+        database: Optional[str] = None,
+        schema: Optional[str] = None,
+        role: Optional[str] = None,
+        partition_concurrency: int = 4,
+        poll_interval: float = 0.2,
+        max_poll_interval: float = 5.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.auth_header = auth_header
+        self.warehouse = warehouse
+        self.database = database
+        self.schema = schema
+        self.role = role
+        self.partition_concurrency = max(1, partition_concurrency)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> "AsyncSnowflakeSQLClient":
+        """SnowflakeAuthClient と同じ環境変数から生成する"""
+        from snowflake_auth import SnowflakeAuthClient
+
+        auth = SnowflakeAuthClient()
+        return cls(
+            auth.account_url,
+            auth.get_auth_header,
+            warehouse=auth.warehouse,
+            database=auth.database,
+            schema=auth.schema,
+            role=auth.role,
+            **kwargs,
+        )
+
+    @property
+    def statements_url(self) -> str:
+        return f"{self.base_url}/api/v2/statements"
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            **self.auth_header(),
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> aiohttp.ClientResponse:
+        """
+        SQL API にリクエストする（429 / 5xx・接続失敗は再試行）
+
+        再試行しても 429 / 5xx の場合は SnowflakeSQLError、サーキットが開いていれば 503 の SnowflakeSQLError。
+        """
+        session = get_async_session()
+        params = kwargs.pop("params", None)
+        attempts = 0
+
+        async def once() -> aiohttp.ClientResponse:
+            nonlocal attempts
+            attempts += 1
+            query = params
+            if attempts > 1 and params and "requestId" in params:
+                # 同じ requestId の再送であることを示す（二重実行にならない）
+                query = {**params, "retry": "true"}
+            resp = await session.request(method, url, headers=self._headers(), params=query, **kwargs)
+            if resp.status in RETRYABLE_STATUS:
+                try:
+                    body = await resp.text()
+                finally:
+                    resp.release()
+                raise SnowflakeSQLError(
+                    resp.status, body, retry_after=parse_retry_after(resp.headers.get("Retry-After"))
+                )
+            return resp
+
+        try:
+            return await call_with_retry(once, breaker=get_circuit_breaker(f"sql:{self.base_url}"))
+        except CircuitOpenError as e:
+            raise SnowflakeSQLError(503, str(e), retry_after=e.retry_after) from e
+
+    async def submit(
+        self,
+        sql: str,
+        bindings: Optional[Dict[str, Dict[str, Any]]] = None,
+        timeout: int = 60,
+    ) -> str:
+        """
+        文を非同期実行で投入し、ステートメントハンドルを返す
+
+        Args:
+            sql: SQL文（バインド変数は ? で指定）
+            bindings: {"1": {"type": "TEXT", "value": "..."}, ...}
+            timeout: 文の実行タイムアウト秒（Snowflake側）
+
+        Raises:
+            SnowflakeSQLError: 投入に失敗した場合
+        """
+        payload: Dict[str, Any] = {
+            "statement": sql,
+            "timeout": timeout,
+            "database": self.database,
+            "schema": self.schema,
+            "warehouse": self.warehouse,
+            "role": self.role,
+        }
+        if bindings:
+            payload["bindings"] = bindings
+        # requestId を付けておくと、同じIDでの再送が二重実行にならない
+        params = {"async": "true", "requestId": str(uuid.uuid4())}
+        async with await self._request("POST", self.statements_url, params=params, json=payload) as resp:
+            body = await resp.text()
+            if resp.status not in (200, 202):
+                raise SnowflakeSQLError(resp.status, body)
+            data = await resp.json(content_type=None)
+        handle = data.get("statementHandle")
+        if not handle:
+            raise SnowflakeSQLError(resp.status, body, code=data.get("code"))
+        return handle
+
+    async def wait(self, handle: str) -> StatementResult:
+        """
+        文の完了をポーリングで待ち、結果（先頭パーティション込み）を返す
+
+        Raises:
+            SnowflakeSQLError: 文が失敗した場合
+        """
+        url = f"{self.statements_url}/{handle}"
+        interval = self.poll_interval
+        while True:
+            async with await self._request("GET", url) as resp:
+                if resp.status == 200:
+                    return StatementResult(self, await resp.json(content_type=None))
+                body = await resp.text()
+                if resp.status != 202:
+                    code = None
+                    try:
+                        code = (await resp.json(content_type=None)).get("code")
+                    except Exception:
+                        pass
+                    raise SnowflakeSQLError(resp.status, body, code=code, handle=handle)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def fetch_partition(self, handle: str, partition: int) -> List[List[Any]]:
+        """結果パーティション1つ分の行を取得する"""
+        url = f"{self.statements_url}/{handle}"
+        async with await self._request("GET", url, params={"partition": str(partition)}) as resp:
+            if resp.status != 200:
+                raise SnowflakeSQLError(resp.status, await resp.text(), handle=handle)
+            data = await resp.json(content_type=None)
+        return data.get("data") or []
+
+    async def query(
+        self,
+        sql: str,
+        bindings: Optional[Dict[str, Dict[str, Any]]] = None,
+        timeout: int = 60,
+    ) -> StatementResult:
+        """文を投入して完了を待つ"""
+        return await self.wait(await self.submit(sql, bindings, timeout))
+
+    async def iter_rows(
+        self,
+        sql: str,
+        bindings: Optional[Dict[str, Dict[str, Any]]] = None,
+        timeout: int = 60,
+    ) -> AsyncIterator[List[Any]]:
+        """文を実行し、結果の行を順に返す（全件をメモリに載せない）"""
+        result = await self.query(sql, bindings, timeout)
+        async for row in result.rows():
+            yield row
+
+    async def query_many(
+        self,
+        statements: Sequence[str],
+        timeout: int = 60,
+    ) -> List[Any]:
+        """
+        複数の文を先にすべて投入し、その後まとめて完了を待つ
+
+        Returns:
+            statements と同じ順序の StatementResult（失敗した要素は例外オブジェクト）
+        """
+        handles = await asyncio.gather(
+            *[self.submit(sql, timeout=timeout) for sql in statements],
+            return_exceptions=True,
+        )
+        results = await asyncio.gather(
+            *[self.wait(h) if isinstance(h, str) else _raise(h) for h in handles],
+            return_exceptions=True,
+        )
+        for r in results:
+            if isinstance(r, Exception):
+                logging.warning(f"Statement failed: {r}")
+        return results
+
+
+async def _raise(e: BaseException) -> Any:
+    raise e
@@ -0,0 +1,133 @@
+"""
+Cortex Agent SSE（text/event-stream）のインクリメンタルパーサ
+
+受信したバイト列のまま行分割し、行をstrへデコードせずに
+event: / data: を判定する。購読していないイベントは UTF-8 デコードも
+JSON デコードも行わずに読み飛ばす（thinking.delta 等の大量イベント対策）。
+チャンク境界をまたぐ行は次の feed() まで保持する。
+
+使用例:
+    parser = SSEParser(subscribe={"response.text.delta", "response.text"})
+    for chunk in chunks:
+        for ev in parser.feed(chunk):
+            print(ev.event, ev.data)
+        if parser.done:
+            break
+"""
+import json
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+DONE_MARKER = b"[DONE]"
+
+EVENT_THINKING_DELTA = "response.thinking.delta"
+EVENT_THINKING = "response.thinking"
+EVENT_TEXT_DELTA = "response.text.delta"
+EVENT_TEXT = "response.text"
+EVENT_TOOL_RESULT = "response.tool_result"
+EVENT_TOOL_CALL = "response.tool.call"
+EVENT_TOOL_START = "response.tool.start"
+EVENT_TOOL_END = "response.tool.end"
+
+TOOL_STEP_EVENTS = frozenset({EVENT_TOOL_CALL, EVENT_TOOL_START, EVENT_TOOL_END})
+
+
+class SSEEvent(NamedTuple):
+    """パース済みのSSEイベント（data は JSON デコード済み）"""
+    event: Optional[str]
+    data: Any
+    raw: bytes
+
+    @property
+    def text(self) -> Optional[str]:
+        """data["text"]（文字列かつ空でない場合のみ）"""
+        t = self.data.get("text") if isinstance(self.data, dict) else None
+        return t if isinstance(t, str) and t else None
+
+
+class SSEParser:
+    """
+    バイト列を受け取り、購読対象の SSEEvent を返すインクリメンタルパーサ
+
+    Args:
+        subscribe: JSON デコードして返すイベント名の集合（None なら全イベント）
+
+    Attributes:
+        done: data: [DONE] を受信したか
+        events_seen: 受信した data 行の数（購読外・JSON不正を含み、[DONE] を除く）
+        event_counts: events_seen のイベント名（bytes、event: 行が無ければ None）別の内訳
+    """
+
+    def __init__(self, subscribe: Optional[Iterable[str]] = None):
+        self._subscribe = (
+            None if subscribe is None else frozenset(s.encode("ascii") for s in subscribe)
+        )
+        self._names: Dict[bytes, str] = {}
+        self._buf = b""
+        self._event: Optional[bytes] = None
+        self.done = False
+        self.events_seen = 0
+        self.event_counts: Dict[Optional[bytes], int] = {}
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """チャンクを追加し、完結した行から得られたイベントを返す"""
+        if self.done or not chunk:
+            return []
+        lines = (self._buf + chunk if self._buf else chunk).split(b"\n")
+        self._buf = lines.pop()
+        out: List[SSEEvent] = []
+        subscribe = self._subscribe
+        counts = self.event_counts
+        event = self._event
+        for line in lines:
+            if not line or line == b"\r":
+                event = None
+                continue
+            head = line[0]
+            if head == 0x64 and line.startswith(b"data:"):  # "d"
+                if subscribe is not None and event not in subscribe:
+                    # 購読外はデコードしない（[DONE] 判定のみ）
+                    if len(line) <= 16 and line[5:].strip() == DONE_MARKER:
+                        self._finish()
+                        return out
+                    self.events_seen += 1
+                    counts[event] = counts.get(event, 0) + 1
+                    continue
+                payload = line[5:].strip()
+                if payload == DONE_MARKER:
+                    self._finish()
+                    return out
+                self.events_seen += 1
+                counts[event] = counts.get(event, 0) + 1
+                try:
+                    obj = json.loads(payload.decode("utf-8", errors="replace"))
+                except ValueError:
+                    continue
+                out.append(SSEEvent(self._name(event), obj, payload))
+            elif head == 0x65 and line.startswith(b"event:"):  # "e"
+                event = line[6:].strip()
+        self._event = event
+        return out
+
+    def close(self) -> List[SSEEvent]:
+        """ストリーム終端で未改行の最終行を処理する"""
+        if self._buf and not self.done:
+            return self.feed(b"\n")
+        return []
+
+    def _finish(self) -> None:
+        self.done = True
+        self._buf = b""
+        self._event = None
+
+    def event_names(self) -> Dict[str, int]:
+        """event_counts をイベント名（str、event: 行が無ければ "message"）で返す"""
+        return {self._name(k) if k is not None else "message": v for k, v in self.event_counts.items()}
+
+    def _name(self, event: Optional[bytes]) -> Optional[str]:
+        if event is None:
+            return None
+        name = self._names.get(event)
+        if name is None:
+            name = event.decode("utf-8", errors="replace")
+            self._names[event] = name
+        return name
@@ -0,0 +1,144 @@
+"""
+Agentストリームのトレースログ（off / sampled / full）
+
+スキーマ全体レビュー（MAX_TABLES=2000）では1回のAgent実行で数万イベントが届き、
+全イベント・全 delta を logging.info すると1回で数万レコード・数MBのログになる。
+ここでは出力量をモードで切り替え、ログの文字列化（デコード・JSON化・切り詰め）は
+実際に出力されるときだけ行う（% 形式の遅延フォーマット）。
+
+モード:
+    off: イベント単位のログは出さず、終了時の集計1行のみ
+    sampled: ツール呼び出し・最終テキスト等の少量イベントは毎回、
+             delta 等の大量イベントは種類ごとに N 件に1件だけ出す（+ 集計1行）
+    full: 全イベントの生データと内容を出す（従来どおり）
+
+設定（環境変数）:
+    REVIEW_STREAM_TRACE: トレースモード（既定: sampled）
+    REVIEW_STREAM_TRACE_SAMPLE_EVERY: sampled で大量イベントを出す間隔（既定: 100）
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Optional, Set
+
+from sse_parser import (
+    EVENT_TEXT,
+    EVENT_TEXT_DELTA,
+    EVENT_THINKING,
+    EVENT_THINKING_DELTA,
+    EVENT_TOOL_RESULT,
+    TOOL_STEP_EVENTS,
+    SSEEvent,
+)
+
+TRACE_OFF = "off"
+TRACE_SAMPLED = "sampled"
+TRACE_FULL = "full"
+
+# sampled でも毎回出す（1回の実行で数件〜数十件の）イベント
+_LOW_VOLUME_EVENTS = frozenset({EVENT_TEXT, EVENT_THINKING, EVENT_TOOL_RESULT, *TOOL_STEP_EVENTS})
+
+
+class _Lazy:
+    """ログ出力時にだけ評価される引数（logging の % フォーマット用）"""
+
+    __slots__ = ("_fn",)
+
+    def __init__(self, fn: Callable[[], str]):
+        self._fn = fn
+
+    def __str__(self) -> str:
+        return self._fn()
+
+
+def _raw(ev: SSEEvent, limit: int) -> _Lazy:
+    return _Lazy(lambda: ev.raw[: limit * 4].decode("utf-8", errors="replace")[:limit])
+
+
+def _dumps(obj: Any, limit: int) -> _Lazy:
+    return _Lazy(lambda: json.dumps(obj, ensure_ascii=False)[:limit])
+
+
+def _text(ev: SSEEvent, limit: int) -> _Lazy:
+    return _Lazy(lambda: (ev.text or "")[:limit])
+
+
+class StreamTrace:
+    """
+    1ストリーム分のトレースログ
+
+    Args:
+        name: ログの接頭辞（例: "review_schema_endpoint"）
+        mode: off / sampled / full（None なら REVIEW_STREAM_TRACE）
+        sample_every: sampled で大量イベントを出す間隔（None なら REVIEW_STREAM_TRACE_SAMPLE_EVERY）
+    """
+
+    def __init__(self, name: str, mode: Optional[str] = None, sample_every: Optional[int] = None):
+        self.name = name
+        mode = (mode or os.getenv("REVIEW_STREAM_TRACE", TRACE_SAMPLED)).lower()
+        if mode not in (TRACE_OFF, TRACE_SAMPLED, TRACE_FULL):
+            logging.warning(f"Invalid REVIEW_STREAM_TRACE={mode}, fallback to {TRACE_SAMPLED}")
+            mode = TRACE_SAMPLED
+        self.mode = mode
+        if sample_every is None:
+            sample_every = int(os.getenv("REVIEW_STREAM_TRACE_SAMPLE_EVERY", "100"))
+        self.sample_every = max(1, sample_every)
+        self._seen: Dict[Optional[str], int] = {}
+        self._logger = logging.getLogger()
+
+    def subscribe(self, events: Set[str]) -> Optional[Set[str]]:
+        """
+        open_sse に渡す購読イベント
+
+        full では全イベント（None）。それ以外は処理に必要な events とログに出す少量イベントのみにし、
+        thinking.delta 等はパーサでデコードせずに読み飛ばす。
+        """
+        if self.mode == TRACE_FULL:
+            return None
+        if self.mode == TRACE_SAMPLED:
+            return set(events) | _LOW_VOLUME_EVENTS
+        return set(events)
+
+    def event(self, ev: SSEEvent) -> None:
+        """受信したイベントをモードに応じてログに出す"""
+        if self.mode == TRACE_OFF or not self._logger.isEnabledFor(logging.INFO):
+            return
+        n = self._seen.get(ev.event, 0) + 1
+        self._seen[ev.event] = n
+        if self.mode == TRACE_FULL:
+            logging.info("[%s][stream] event=%s %s", self.name, ev.event, _raw(ev, 500))
+        elif ev.event not in _LOW_VOLUME_EVENTS and (n - 1) % self.sample_every:
+            return
+
+        kind = ev.event
+        if kind == EVENT_THINKING_DELTA:
+            logging.info("[%s][thinking.delta] #%d %s", self.name, n, _text(ev, 500))
+        elif kind == EVENT_THINKING:
+            logging.info("[%s][thinking] %s", self.name, _text(ev, 2000))
+        elif kind == EVENT_TEXT_DELTA:
+            logging.info("[%s][text.delta] #%d %s", self.name, n, _text(ev, 500))
+        elif kind == EVENT_TEXT:
+            logging.info("[%s][text] %s", self.name, _text(ev, 500))
+        elif kind in TOOL_STEP_EVENTS:
+            obj = ev.data if isinstance(ev.data, dict) else {}
+            logging.info("[%s][tool_step] %s tool=%s", self.name, kind, obj.get("name") or obj.get("tool_name") or "unknown")
+        elif kind == EVENT_TOOL_RESULT:
+            logging.info("[%s][tool_result] %s", self.name, _dumps(ev.data, 500))
+        else:
+            logging.info("[%s][event_data] event=%s #%d data=%s", self.name, kind, n, _dumps(ev.data, 300))
+
+    def close(self, event_counts: Dict[str, int], **fields: Any) -> None:
+        """
+        終了時の集計を1行で出す（モードによらず出力）
+
+        Args:
+            event_counts: 受信したイベント種類ごとの件数（SSEParser.event_names()、購読外を含む）
+            fields: 追加で出す項目（done / truncated 等）
+        """
+        logging.info(
+            "[%s][summary] mode=%s events=%s %s",
+            self.name,
+            self.mode,
+            _dumps(event_counts, 2000),
+            _Lazy(lambda: " ".join(f"{k}={v}" for k, v in fields.items())),
+        )
@@ -1,7 +1,7 @@
 """
 S3アップロード関数の動作テスト
 """
-from s3_upload import upload_file_to_s3
+from s3_upload import upload_bytes, upload_file_to_s3
 import os
 
 def main():
@@ -18,6 +18,10 @@ def main():
     result = upload_file_to_s3(test_file, bucket, key, content_type="text/plain")
     print("アップロード結果:", result)
 
+    # メモリ上のデータを直接アップロード（一時ファイル不要）
+    result = upload_bytes("S3 upload test (bytes)\n".encode("utf-8"), bucket, "test/test_upload_bytes.txt", content_type="text/plain")
+    print("アップロード結果（bytes）:", result)
+
     # 後始末
     os.remove(test_file)
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+認証ヘッダ生成 マイクロベンチマーク（キーペア認証）
+
+SnowflakeAuthClient.get_auth_header() の headers/sec を、
+従来の実装（呼び出しごとに PEM 読み込み・鍵パース・フィンガープリント計算・RS256署名）と
+JWTMinter によるキャッシュ版で比較する。一時ディレクトリに生成したRSA鍵を使う。
+
+使用方法:
+    python tests/azfunctions/chatdemo/bench_jwt_auth.py
+    python tests/azfunctions/chatdemo/bench_jwt_auth.py --seconds 3 --passphrase secret
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+# プロジェクトルートをパスに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+azfunc_path = os.path.join(project_root, 'app/azfunctions/chatdemo')
+sys.path.insert(0, azfunc_path)
+
+import jwt  # noqa: E402
+from cryptography.hazmat.backends import default_backend  # noqa: E402
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+from snowflake_auth import SnowflakeAuthClient  # noqa: E402
+
+
+def write_private_key(path: str, passphrase: str = "") -> None:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    encryption = (
+        serialization.BestAvailableEncryption(passphrase.encode())
+        if passphrase else serialization.NoEncryption()
+    )
+    with open(path, "wb") as f:
+        f.write(key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=encryption,
+        ))
+
+
+def legacy_auth_header(client: SnowflakeAuthClient) -> Dict[str, str]:
+    """変更前の get_jwt_token() と同じ処理（毎回 PEM 読み込み〜署名）"""
+    with open(client.private_key_path, "rb") as key_file:
+        private_key_data = key_file.read()
+    passphrase = client.private_key_passphrase.encode() if client.private_key_passphrase else None
+    private_key = serialization.load_pem_private_key(
+        private_key_data,
+        password=passphrase,
+        backend=default_backend()
+    )
+    public_key_bytes = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    public_key_fp = 'SHA256:' + hashlib.sha256(public_key_bytes).hexdigest()
+    now = int(time.time())
+    payload = {
+        "iss": f"{client.account.upper()}.{client.user.upper()}.{public_key_fp}",
+        "sub": client.user.upper(),
+        "iat": now,
+        "exp": now + 3600
+    }
+    return {"Authorization": f"Bearer {jwt.encode(payload, private_key, algorithm='RS256')}"}
+
+
+def bench(name: str, fn: Callable[[], Dict[str, str]], seconds: float) -> float:
+    fn()  # ウォームアップ（初回の鍵読み込みを除外）
+    count = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    while time.perf_counter() < deadline:
+        fn()
+        count += 1
+    elapsed = time.perf_counter() - t0
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"{name:28} calls={count:9d}  {rate:14,.0f} headers/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="認証ヘッダ生成 マイクロベンチマーク")
+    parser.add_argument("--seconds", type=float, default=2.0, help="各計測の実行秒数")
+    parser.add_argument("--passphrase", default="", help="秘密鍵のパスフレーズ")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        key_path = os.path.join(tmpdir, "rsa_key.p8")
+        write_private_key(key_path, args.passphrase)
+
+        os.environ.update({
+            "SNOWFLAKE_ACCOUNT": "BENCH_ACCOUNT",
+            "SNOWFLAKE_USER": "BENCH_USER",
+            "SNOWFLAKE_AUTH_METHOD": "private_key",
+            "SNOWFLAKE_PRIVATE_KEY_PATH": key_path,
+            "SNOWFLAKE_PRIVATE_KEY_PASSPHRASE": args.passphrase,
+        })
+        client = SnowflakeAuthClient()
+
+        print("=== get_auth_header benchmark (RS256, 2048bit) ===")
+        base = bench("legacy (mint every call)", lambda: legacy_auth_header(client), args.seconds)
+        fast = bench("JWTMinter (cached)", client.get_auth_header, args.seconds)
+        if base > 0:
+            print(f"\nspeedup: {fast / base:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
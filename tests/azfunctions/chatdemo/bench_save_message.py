@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+save_message スループット ベンチマーク
+
+sql_api_standin.py（ローカル代替サーバ）に対して、
+従来の save_message（毎回 CREATE TABLE IF NOT EXISTS + 文字列連結の1行 INSERT）と
+ChatMessageWriter（DDL 1回 + 複数行バインド INSERT）の messages/sec を比較する。
+
+使用方法:
+    python tests/azfunctions/chatdemo/bench_save_message.py
+    python tests/azfunctions/chatdemo/bench_save_message.py --messages 1000 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+# プロジェクトルートをパスに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+azfunc_path = os.path.join(project_root, 'app/azfunctions/chatdemo')
+sys.path.insert(0, azfunc_path)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sql_api_standin import SQLAPIStandin  # noqa: E402
+
+
+def start_standin(latency: float) -> SQLAPIStandin:
+    """代替サーバを別スレッドのイベントループで起動する"""
+    server = SQLAPIStandin(latency=latency)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def _run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=_run, daemon=True).start()
+    started.wait()
+    return server
+
+
+def legacy_save_message(client, user_id: str, message: str, ai_response: str) -> bool:
+    """変更前の SnowflakeCortexClient.save_message と同じ処理"""
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS CHAT_MESSAGES (
+        ID NUMBER AUTOINCREMENT,
+        USER_ID VARCHAR(255),
+        MESSAGE TEXT,
+        AI_RESPONSE TEXT,
+        TIMESTAMP TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+        PRIMARY KEY (ID)
+    )
+    """
+    client.execute_query(create_table_query)
+    insert_query = f"""
+    INSERT INTO CHAT_MESSAGES (USER_ID, MESSAGE, AI_RESPONSE)
+    VALUES ('{user_id}', '{message}', '{ai_response if ai_response else 'NULL'}')
+    """
+    return client.execute_query(insert_query) is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="save_message スループット ベンチマーク")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.01, help="代替サーバのリクエスト遅延秒")
+    args = parser.parse_args()
+
+    server = start_standin(args.latency)
+    os.environ.update({
+        "SNOWFLAKE_ACCOUNT_URL": server.base_url,
+        "SNOWFLAKE_BEARER_TOKEN": "bench",
+        "SNOWFLAKE_AUTH_METHOD": "bearer_token",
+    })
+    from chat_message_writer import ChatMessageWriter
+    from snowflake_auth import SnowflakeAuthClient
+
+    client = SnowflakeAuthClient()
+    messages = [(f"user{i % 10}", f"今月の売上は? #{i}", f"{i}円です") for i in range(args.messages)]
+
+    print(f"=== save_message benchmark ({args.messages} messages, latency {args.latency * 1000:.0f} ms) ===")
+
+    before = server.requests
+    t0 = time.perf_counter()
+    for m in messages:
+        legacy_save_message(client, *m)
+    legacy_sec = time.perf_counter() - t0
+    print(f"{'legacy (DDL + 1-row INSERT)':30} {legacy_sec * 1000:9.1f} ms  "
+          f"{args.messages / legacy_sec:10,.0f} messages/sec  requests={server.requests - before}")
+
+    before = server.requests
+    inserted_before = len(server.inserted["CHAT_MESSAGES"])
+    writer = ChatMessageWriter(client.execute_query, flush_interval_sec=0.05)
+    t0 = time.perf_counter()
+    for m in messages:
+        writer.save(*m)
+    enqueue_sec = time.perf_counter() - t0
+    writer.close()
+    batched_sec = time.perf_counter() - t0
+    print(f"{'ChatMessageWriter (batched)':30} {batched_sec * 1000:9.1f} ms  "
+          f"{args.messages / batched_sec:10,.0f} messages/sec  requests={server.requests - before}  "
+          f"(enqueue {enqueue_sec * 1e6 / args.messages:.1f} us/message)")
+
+    written = len(server.inserted["CHAT_MESSAGES"]) - inserted_before
+    assert written == args.messages, f"inserted {written} != {args.messages}"
+    print(f"\nspeedup: {legacy_sec / batched_sec:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
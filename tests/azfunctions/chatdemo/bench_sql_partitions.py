@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+SQL API 結果パーティション取得 ベンチマーク
+
+sql_api_standin.py（ローカル代替サーバ）に対して、AsyncSnowflakeSQLClient の
+パーティション先読み数ごとの rows/sec と、全パーティションを一括取得して
+リストに載せる方式とのピークメモリ（tracemalloc）を比較する。
+
+使用方法:
+    python tests/azfunctions/chatdemo/bench_sql_partitions.py
+    python tests/azfunctions/chatdemo/bench_sql_partitions.py --rows 200000 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+# プロジェクトルートをパスに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+azfunc_path = os.path.join(project_root, 'app/azfunctions/chatdemo')
+sys.path.insert(0, azfunc_path)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from http_pool import get_async_session  # noqa: E402
+from snowflake_sql_async import AsyncSnowflakeSQLClient  # noqa: E402
+from sql_api_standin import SQLAPIStandin  # noqa: E402
+
+
+async def stream_rows(client: AsyncSnowflakeSQLClient, sql: str, prefetch: int) -> int:
+    result = await client.query(sql)
+    count = 0
+    async for _ in result.rows(prefetch=prefetch):
+        count += 1
+    return count
+
+
+async def collect_all(client: AsyncSnowflakeSQLClient, sql: str) -> int:
+    """全パーティションを同時取得して1つのリストにまとめる（比較用）"""
+    result = await client.query(sql)
+    parts = await asyncio.gather(
+        *[client.fetch_partition(result.handle, i) for i in range(1, result.partition_count)]
+    )
+    rows = list(result._first_data or [])
+    for p in parts:
+        rows.extend(p)
+    return len(rows)
+
+
+async def bench(name: str, coro_fn) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    rows = await coro_fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:26} rows={rows:8d}  {elapsed * 1000:9.1f} ms  {rows / elapsed:12,.0f} rows/sec  peak={peak / 1024 / 1024:7.1f} MiB")
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    server = SQLAPIStandin(latency=args.latency, rows_per_partition=args.rows_per_partition)
+    base_url = await server.start()
+    try:
+        client = AsyncSnowflakeSQLClient(base_url, lambda: {"Authorization": "Bearer bench"}, poll_interval=0.01)
+        sql = f"SELECT SEQ4() AS ID FROM TABLE(GENERATOR(ROWCOUNT => {args.rows}))"
+        print(f"=== SQL API partitions benchmark ({args.rows:,} rows, "
+              f"{args.rows_per_partition} rows/partition, latency {args.latency * 1000:.0f} ms) ===")
+        for prefetch in (1, 4, 8):
+            await bench(f"rows() prefetch={prefetch}", lambda p=prefetch: stream_rows(client, sql, p))
+        await bench("collect all partitions", lambda: collect_all(client, sql))
+    finally:
+        await get_async_session().close()
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQL API 結果パーティション取得ベンチマーク")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--rows-per-partition", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02, help="代替サーバのリクエスト遅延秒")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
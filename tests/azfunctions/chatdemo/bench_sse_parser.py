@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+SSEパーサ マイクロベンチマーク
+
+Cortex Agent の応答を模した 10,000 イベントのSSEストリームに対して、
+従来の行ループ（str デコード + startswith + 全 data 行 json.loads）と
+sse_parser.SSEParser（バイト列走査 + 購読イベントのみデコード）の
+events/sec を比較する。
+
+使用方法:
+    python tests/azfunctions/chatdemo/bench_sse_parser.py
+    python tests/azfunctions/chatdemo/bench_sse_parser.py --events 50000 --chunk-size 4096
+    python tests/azfunctions/chatdemo/bench_sse_parser.py --record tests/output/agent_stream.sse
+    python tests/azfunctions/chatdemo/bench_sse_parser.py --input tests/output/agent_stream.sse
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+# プロジェクトルートをパスに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+azfunc_path = os.path.join(project_root, 'app/azfunctions/chatdemo')
+sys.path.insert(0, azfunc_path)
+
+from sse_parser import (  # noqa: E402
+    EVENT_TEXT,
+    EVENT_TEXT_DELTA,
+    EVENT_THINKING,
+    EVENT_TOOL_RESULT,
+    TOOL_STEP_EVENTS,
+    SSEParser,
+)
+
+# chat_stream と同じ購読イベント
+SUBSCRIBE = {EVENT_THINKING, EVENT_TEXT_DELTA, EVENT_TEXT, EVENT_TOOL_RESULT, *TOOL_STEP_EVENTS}
+
+
+def record_stream(n_events: int, seed: int = 42) -> bytes:
+    """
+    Agent応答に近い比率のSSEストリームを生成する
+    （thinking.delta 約6割、text.delta 約3割、残りはツール関連）
+    """
+    rng = random.Random(seed)
+    parts: List[str] = []
+    for i in range(n_events - 2):
+        r = rng.random()
+        if r < 0.6:
+            ev, data = "response.thinking.delta", {"content_index": 0, "text": "考え中" * rng.randint(1, 8)}
+        elif r < 0.9:
+            ev, data = "response.text.delta", {"content_index": 1, "text": f"売上は{i}円です。" * rng.randint(1, 3)}
+        elif r < 0.95:
+            ev, data = "response.tool.start", {"name": "sales_sql", "tool_use_id": f"t{i}"}
+        else:
+            ev, data = "response.tool_result", {
+                "name": "sales_sql",
+                "status": "success",
+                "content": [{"json": {"sql": "SELECT 1", "result_set": {"data": [[i, "x" * 40]] * 5}}}],
+            }
+        parts.append(f"event: {ev}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n")
+    parts.append(f"event: response.text\ndata: {json.dumps({'text': '最終回答'}, ensure_ascii=False)}\n\n")
+    parts.append("event: done\ndata: [DONE]\n\n")
+    return "".join(parts).encode("utf-8")
+
+
+def chunked(stream: bytes, size: int) -> List[bytes]:
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def legacy_loop(chunks: List[bytes]) -> int:
+    """変更前の function_app.py と同じ行ループ（requests.iter_lines 相当の行分割込み）"""
+    events = 0
+    current_event = None
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        pending = lines.pop() if lines and lines[-1] and chunk[-1:] != b"\n" else None
+        for raw in lines:
+            try:
+                line = raw.decode("utf-8")
+            except Exception:
+                line = raw.decode("utf-8", errors="replace")
+            line = line.rstrip("\r")
+            if line == "":
+                current_event = None
+                continue
+            if line.startswith("event:"):
+                current_event = line[len("event:"):].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            data_str = line[len("data:"):].strip()
+            if data_str == "[DONE]":
+                return events
+            try:
+                obj = json.loads(data_str)
+            except Exception:
+                continue
+            events += 1
+            if current_event == "response.thinking.delta":
+                t = obj.get("text") if isinstance(obj, dict) else None
+                if isinstance(t, str) and t:
+                    pass
+    return events
+
+
+def parser_loop(chunks: List[bytes]) -> int:
+    """SSEParser（購読イベントのみデコード）"""
+    parser = SSEParser(subscribe=SUBSCRIBE)
+    for chunk in chunks:
+        for ev in parser.feed(chunk):
+            ev.text
+        if parser.done:
+            break
+    return parser.events_seen
+
+
+def parser_all_loop(chunks: List[bytes]) -> int:
+    """SSEParser（全イベントをデコード。review_schema_endpoint 相当）"""
+    parser = SSEParser(subscribe=None)
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.done:
+            break
+    return parser.events_seen
+
+
+def bench(name: str, fn: Callable[[List[bytes]], int], chunks: List[bytes], repeat: int) -> float:
+    best = float("inf")
+    events = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        events = fn(chunks)
+        best = min(best, time.perf_counter() - t0)
+    rate = events / best if best > 0 else 0.0
+    print(f"{name:28} events={events:7d}  best={best * 1000:8.2f} ms  {rate:12,.0f} events/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSEパーサ マイクロベンチマーク")
+    parser.add_argument("--events", type=int, default=10000, help="生成するイベント数")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="受信チャンクサイズ（バイト）")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（最良値を採用）")
+    parser.add_argument("--input", help="記録済みSSEファイルを使用する")
+    parser.add_argument("--record", help="生成したストリームをファイルに保存する")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            stream = f.read()
+    else:
+        stream = record_stream(args.events)
+    if args.record:
+        os.makedirs(os.path.dirname(args.record) or ".", exist_ok=True)
+        with open(args.record, "wb") as f:
+            f.write(stream)
+        print(f"✓ ストリームを保存: {args.record}")
+
+    chunks = chunked(stream, args.chunk_size)
+    print(f"=== SSE parser benchmark ({len(stream):,} bytes, {len(chunks)} chunks) ===")
+    base = bench("legacy line loop", legacy_loop, chunks, args.repeat)
+    fast = bench("SSEParser (subscribed)", parser_loop, chunks, args.repeat)
+    bench("SSEParser (all events)", parser_all_loop, chunks, args.repeat)
+    if base > 0:
+        print(f"\nspeedup (subscribed vs legacy): {fast / base:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Snowflake SQL API（/api/v2/statements）のローカル代替サーバ
+
+ベンチマーク・動作確認用。実際のSQLは実行せず、次の文だけを模擬する。
+    SELECT ... GENERATOR(ROWCOUNT => N) ...   : N行（列 ID, NAME）を返す
+    INSERT INTO <table> ...                   : bindings の行数を <table> に記録する
+    その他（CREATE TABLE 等）                  : 0行で成功
+
+async=true で投入された文は exec_polls 回のポーリングまで 202 を返し、その後 200 と
+先頭パーティション・partitionInfo を返す。?partition=N で各パーティションを返す。
+各リクエストに latency 秒の遅延を入れてネットワーク往復を模擬する。
+
+使用方法:
+    python tests/azfunctions/chatdemo/sql_api_standin.py --port 8765 --latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import re
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+_GENERATOR = re.compile(r"GENERATOR\s*\(\s*ROWCOUNT\s*=>\s*(\d+)\s*\)", re.IGNORECASE)
+_INSERT = re.compile(r"^\s*INSERT\s+INTO\s+([\w.]+)", re.IGNORECASE)
+
+
+class SQLAPIStandin:
+    """
+    SQL API の代替サーバ
+
+    Attributes:
+        inserted: テーブル名ごとの挿入行（bindings の値のリスト）
+        requests: 受け付けたHTTPリクエスト数
+        statements: 投入された文の数
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        exec_polls: int = 1,
+        rows_per_partition: int = 1000,
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.exec_polls = exec_polls
+        self.rows_per_partition = rows_per_partition
+        self.port = port
+        self.inserted: Dict[str, List[List[Any]]] = defaultdict(list)
+        self.requests = 0
+        self.statements = 0
+        self._handles: Dict[str, Dict[str, Any]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/api/v2/statements", self._submit)
+        app.router.add_get("/api/v2/statements/{handle}", self._status)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _delay(self) -> None:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _execute(self, body: Dict[str, Any]) -> List[List[Any]]:
+        sql = body.get("statement", "")
+        m = _GENERATOR.search(sql)
+        if m:
+            return [[str(i), f"name_{i}"] for i in range(int(m.group(1)))]
+        m = _INSERT.match(sql)
+        if m:
+            bindings = body.get("bindings") or {}
+            values = [bindings[k]["value"] for k in sorted(bindings, key=int)]
+            ncols = max(1, sql.split("VALUES", 1)[-1].split(")", 1)[0].count("?"))
+            rows = [values[i:i + ncols] for i in range(0, len(values), ncols)] if values else [[]]
+            self.inserted[m.group(1).upper()].extend(rows)
+            return [[str(len(rows))]]
+        return []
+
+    def _page(self, handle: str, partition: int) -> Dict[str, Any]:
+        rows = self._handles[handle]["rows"]
+        size = self.rows_per_partition
+        return {"data": rows[partition * size:(partition + 1) * size]}
+
+    async def _submit(self, request: web.Request) -> web.Response:
+        await self._delay()
+        body = await request.json()
+        self.statements += 1
+        handle = str(uuid.uuid4())
+        self._handles[handle] = {"rows": self._execute(body), "polls": 0}
+        if request.query.get("async") == "true":
+            return web.json_response({"statementHandle": handle, "message": "Asynchronous execution in progress."}, status=202)
+        return web.json_response(self._result(handle))
+
+    def _result(self, handle: str) -> Dict[str, Any]:
+        rows = self._handles[handle]["rows"]
+        size = self.rows_per_partition
+        n_parts = max(1, (len(rows) + size - 1) // size)
+        return {
+            "statementHandle": handle,
+            "code": "090001",
+            "message": "Statement executed successfully.",
+            "resultSetMetaData": {
+                "numRows": len(rows),
+                "rowType": [{"name": "ID", "type": "fixed"}, {"name": "NAME", "type": "text"}],
+                "partitionInfo": [
+                    {"rowCount": len(rows[i * size:(i + 1) * size])} for i in range(n_parts)
+                ],
+            },
+            **self._page(handle, 0),
+        }
+
+    async def _status(self, request: web.Request) -> web.Response:
+        await self._delay()
+        handle = request.match_info["handle"]
+        state = self._handles.get(handle)
+        if state is None:
+            return web.json_response({"code": "000709", "message": "Statement not found"}, status=404)
+        if "partition" in request.query:
+            return web.json_response(self._page(handle, int(request.query["partition"])))
+        if state["polls"] < self.exec_polls:
+            state["polls"] += 1
+            return web.json_response({"statementHandle": handle, "code": "333334"}, status=202)
+        return web.Response(
+            text=json.dumps(self._result(handle), ensure_ascii=False),
+            content_type="application/json",
+        )
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    server = SQLAPIStandin(
+        latency=args.latency,
+        exec_polls=args.exec_polls,
+        rows_per_partition=args.rows_per_partition,
+        port=args.port,
+    )
+    print(f"SQL API stand-in: {await server.start()}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snowflake SQL API ローカル代替サーバ")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.02, help="リクエストごとの遅延秒")
+    parser.add_argument("--exec-polls", type=int, default=1, help="完了までに 202 を返す回数")
+    parser.add_argument("--rows-per-partition", type=int, default=1000)
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
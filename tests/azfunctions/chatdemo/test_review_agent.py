@@ -6,10 +6,15 @@ DB設計レビューエージェント テストスクリプト
     python test_review_agent.py
     python test_review_agent.py --schema APP_PRODUCTION
     python test_review_agent.py --local
+    python test_review_agent.py --local --wait   # ジョブにせず完了まで待つ（wait=true）
+    python test_review_agent.py --local --incremental   # 前回から Vault が変わったオブジェクトだけをレビュー
+    python test_review_agent.py --local --batch DB_DESIGN LOG DB_DESIGN.DOCS_OBSIDIAN
+    python test_review_agent.py --local --estate --max-parallel 6   # 全スキーマを並列にレビュー
 """
 import sys
 import os
 import json
+import time
 import argparse
 import requests
 from datetime import datetime
@@ -25,6 +30,9 @@ except ModuleNotFoundError:
     # ローカル環境ではHTTPエンドポイントのみ使用可能
     DBReviewAgent = None
 
+# コマンドラインから実行するスクリプト（test_* は引数を取るため pytest では収集しない）
+__test__ = False
+
 
 def test_direct_call(target_schema: str, max_tables: int = None):
     """
@@ -74,9 +82,99 @@ def test_direct_call(target_schema: str, max_tables: int = None):
     return success
 
 
-def test_http_endpoint(target_schema: str, max_tables: int = None, base_url: str = None):
+def wait_review_job(base_url: str, submitted: dict, poll_sec: float = 5.0, timeout_sec: float = 1800):
+    """
+    レビュージョブの完了を待って結果を返す（進捗を表示）
+    """
+    status_url = f"{base_url}{submitted['status_url']}"
+    result_url = f"{base_url}{submitted['result_url']}"
+    print(f"ジョブ: {submitted['job_id']}（重複: {submitted.get('deduplicated')}）")
+
+    deadline = time.time() + timeout_sec
+    while time.time() < deadline:
+        job = requests.get(status_url, timeout=30).json()
+        progress = job.get("progress", {})
+        steps = progress.get("tool_steps") or []
+        last = f" 直近: {steps[-1]['type']} {steps[-1]['tool_name']}" if steps else ""
+        print(f"  [{job.get('elapsed_sec', 0):>6.1f}s] {job.get('status')} イベント={progress.get('events', 0)} "
+              f"ツール={progress.get('tool_calls', 0)}{last}")
+        if job.get("status") not in ("queued", "running"):
+            break
+        time.sleep(poll_sec)
+
+    return requests.get(result_url, timeout=30)
+
+
+# --estate でレビューするスキーマ
+ESTATE_SCHEMAS = ["APP_PRODUCTION", "DB_DESIGN", "LOG", "NAME_RESOLUTION", "IMPORT", "APP_DEVELOPMENT"]
+
+
+def test_batch_endpoint(targets: list, max_tables: int = None, base_url: str = None, max_parallel: int = None,
+                        incremental: bool = False):
+    """
+    バッチレビュー（POST /api/review/batch）の SSE を受信し、対象ごとの完了を表示する
+    """
+    print(f"=== DB設計レビュー バッチ ===")
+    base_url = base_url or "http://localhost:7071"
+    payload = {"targets": targets}
+    if max_tables:
+        payload["max_tables"] = max_tables
+    if max_parallel:
+        payload["max_parallel"] = max_parallel
+    if incremental:
+        payload["incremental"] = True
+    print(f"リクエスト: {json.dumps(payload, ensure_ascii=False)}")
+    print()
+    
+    started = time.time()
+    done = None
+    try:
+        with requests.post(f"{base_url}/api/review/batch", json=payload, stream=True, timeout=(10, 900)) as response:
+            if response.status_code != 200:
+                print(f"エラー: {response.status_code} {response.text}")
+                return False
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                    continue
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[len("data: "):])
+                elapsed = time.time() - started
+                if event == "target_start":
+                    t = data["target"]
+                    name = f"{t['target_schema']}.{t['target_object']}" if t.get("target_object") else t["target_schema"]
+                    print(f"  [{elapsed:>6.1f}s] 開始 {name}（ジョブ: {data['job_id']}）")
+                elif event == "target_done":
+                    t = data["target"]
+                    name = f"{t['target_schema']}.{t['target_object']}" if t.get("target_object") else t["target_schema"]
+                    sev = data.get("severity") or {}
+                    counts = " ".join(f"{k[0].upper()}:{v}" for k, v in sev.items())
+                    mark = "✓" if data["success"] else "✗"
+                    print(f"  [{elapsed:>6.1f}s] {mark} {name} {data['elapsed_sec']}s {counts} {data.get('review_file') or data.get('message')}")
+                elif event == "done":
+                    done = data
+                elif event == "error":
+                    print(f"エラー: {data}")
+    except requests.exceptions.RequestException as e:
+        print(f"リクエストエラー: {str(e)}")
+        return False
+    
+    if not done:
+        return False
+    print()
+    print(f"成功 {done['succeeded']} / {done['targets']} 件、経過 {done['elapsed_sec']} 秒")
+    print(f"サマリ: docs/snowflake/chatdemo/reviews/batches/{done['summary_file']}")
+    return done["failed"] == 0
+
+
+def test_http_endpoint(target_schema: str, max_tables: int = None, base_url: str = None, wait: bool = False,
+                       incremental: bool = False):
     """
     HTTPエンドポイント経由でテスト
+
+    既定はジョブ登録（202）→ 進捗をポーリング → 結果取得。wait=True なら完了まで1リクエストで待つ。
     """
     print(f"=== DB設計レビュー HTTPエンドポイントテスト ===")
     
@@ -90,6 +188,10 @@ def test_http_endpoint(target_schema: str, max_tables: int = None, base_url: str
     }
     if max_tables:
         payload["max_tables"] = max_tables
+    if wait:
+        payload["wait"] = True
+    if incremental:
+        payload["incremental"] = True
     
     print(f"エンドポイント: {endpoint}")
     print(f"リクエスト: {json.dumps(payload, ensure_ascii=False)}")
@@ -100,9 +202,12 @@ def test_http_endpoint(target_schema: str, max_tables: int = None, base_url: str
             endpoint,
             json=payload,
             headers={"Content-Type": "application/json"},
-            timeout=300  # 5分タイムアウト
+            timeout=900 if wait else 30
         )
         
+        if response.status_code == 202:
+            response = wait_review_job(base_url, response.json())
+        
         print(f"ステータスコード: {response.status_code}")
         
         if response.status_code == 200:
@@ -111,7 +216,7 @@ def test_http_endpoint(target_schema: str, max_tables: int = None, base_url: str
             print(f"メッセージ: {data.get('message')}")
             print()
             
-            markdown = data.get('markdown', '')
+            markdown = data.get('final_text', '')
             if markdown:
                 print("=== レビュー結果（Markdown） ===")
                 print(markdown[:500])
@@ -161,16 +266,52 @@ def main():
         '--url',
         help='Azure FunctionsのベースURL（カスタム）'
     )
+    parser.add_argument(
+        '--wait',
+        action='store_true',
+        help='ジョブにせず完了まで待つ（HTTPエンドポイント経由のみ）'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='前回のレビューから Vault が変わったオブジェクトだけをレビュー（HTTPエンドポイント経由のみ）'
+    )
+    parser.add_argument(
+        '--batch',
+        nargs='+',
+        metavar='TARGET',
+        help='複数の対象（SCHEMA または SCHEMA.OBJECT）をまとめてレビュー（HTTPエンドポイント経由のみ）'
+    )
+    parser.add_argument(
+        '--estate',
+        action='store_true',
+        help=f'全スキーマ（{", ".join(ESTATE_SCHEMAS)}）をまとめてレビュー'
+    )
+    parser.add_argument(
+        '--max-parallel',
+        type=int,
+        help='バッチ内で同時に実行する数（省略時はサーバの REVIEW_JOB_MAX_CONCURRENCY）'
+    )
     
     args = parser.parse_args()
     
-    if args.local or args.url:
+    if args.batch or args.estate:
+        success = test_batch_endpoint(
+            targets=(args.batch or []) + (ESTATE_SCHEMAS if args.estate else []),
+            max_tables=args.max_tables,
+            base_url=args.url or "http://localhost:7071",
+            max_parallel=args.max_parallel,
+            incremental=args.incremental
+        )
+    elif args.local or args.url:
         # HTTPエンドポイント経由
         base_url = args.url or "http://localhost:7071"
         success = test_http_endpoint(
             target_schema=args.schema,
             max_tables=args.max_tables,
-            base_url=base_url
+            base_url=base_url,
+            wait=args.wait,
+            incremental=args.incremental
         )
     else:
         # 直接呼び出し
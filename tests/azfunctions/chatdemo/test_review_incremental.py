@@ -0,0 +1,122 @@
+"""
+差分レビューのレポート統合（review_incremental.merge_reports / split_report）テスト
+
+統合したレポートを次回の統合の前回レポートとして使っても、指摘が正しいオブジェクトに
+割り当てられ（master/ のパスが無い指摘を含む）、再レビューで重複せずに入れ替わることを確認する。
+
+使用方法:
+    pytest tests/azfunctions/chatdemo/test_review_incremental.py -v
+"""
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+azfunc_path = os.path.join(project_root, 'app/azfunctions/chatdemo')
+sys.path.insert(0, azfunc_path)
+
+from review_incremental import SCHEMA_KEY, merge_reports, split_report  # noqa: E402
+
+SCHEMA = "DB_DESIGN"
+
+PREVIOUS = """---
+type: agent_review
+review_date: 2026-01-01
+---
+
+# DB設計レビュー DB_DESIGN
+
+## 1. サマリ
+- 指摘 3 件
+
+## 2. Findings（重要度別）
+
+### High
+#### High-1: PROFILE_RUNS の主キーが未定義
+- Evidence: master/tables/DB_DESIGN.PROFILE_RUNS.md
+
+### Med
+#### Med-1: RUN_ID の型が不統一
+- Evidence: master/columns/DB_DESIGN.PROFILE_RESULTS.RUN_ID.md
+#### Med-2: スキーマのコメントが空
+- スキーマ定義にコメントが無い
+
+## 3. 次のアクション
+- 主キーを追加する
+"""
+
+
+def _object_review(title: str, severity: str = "Low") -> str:
+    """オブジェクト単位レビュー（master/ のパスを含まない指摘1件）"""
+    return f"""# DB設計レビュー
+
+## 2. Findings
+
+### {severity}
+#### {severity}-1: {title}
+- 根拠は Vault の定義
+"""
+
+
+def _objects(markdown: str) -> dict:
+    _, findings, _ = split_report(markdown, SCHEMA)
+    return {f.lines[0].split(": ", 1)[1]: f.object for f in findings}
+
+
+def test_split_uses_master_path():
+    assert _objects(PREVIOUS) == {
+        "PROFILE_RUNS の主キーが未定義": "PROFILE_RUNS",
+        "RUN_ID の型が不統一": "PROFILE_RESULTS",
+        "スキーマのコメントが空": SCHEMA_KEY,
+    }
+
+
+def test_update_without_path_is_attributed_to_reviewed_object():
+    merged = merge_reports(
+        SCHEMA, PREVIOUS, {"PROFILE_RUNS": _object_review("RUN_ID に NOT NULL が無い")}, [],
+        "DB_DESIGN_20260101_000000.md", "2026-01-02",
+    )
+    assert _objects(merged) == {
+        "RUN_ID の型が不統一": "PROFILE_RESULTS",
+        "スキーマのコメントが空": SCHEMA_KEY,
+        "RUN_ID に NOT NULL が無い": "PROFILE_RUNS",
+    }
+    assert "<!-- object: DB_DESIGN.PROFILE_RUNS -->" in merged
+    assert "<!-- object: DB_DESIGN -->" in merged
+
+
+def test_merge_round_trip_replaces_instead_of_duplicating():
+    first = merge_reports(
+        SCHEMA, PREVIOUS, {"PROFILE_RUNS": _object_review("RUN_ID に NOT NULL が無い")}, [],
+        "DB_DESIGN_20260101_000000.md", "2026-01-02",
+    )
+    second = merge_reports(
+        SCHEMA, first, {"PROFILE_RUNS": _object_review("STARTED_AT の型が文字列", "Med")}, [],
+        "DB_DESIGN_20260102_000000.md", "2026-01-03",
+    )
+    assert _objects(second) == {
+        "RUN_ID の型が不統一": "PROFILE_RESULTS",
+        "STARTED_AT の型が文字列": "PROFILE_RUNS",
+        "スキーマのコメントが空": SCHEMA_KEY,
+    }
+    # 統合を繰り返しても対象の行・差分レビューの記録は1つずつ
+    assert second.count("<!-- object: DB_DESIGN.PROFILE_RUNS -->") == 1
+    assert second.count("## 差分レビュー") == 1
+    assert "## 3. 次のアクション" in second
+
+
+def test_merge_is_stable_without_updates():
+    merged = merge_reports(SCHEMA, PREVIOUS, {}, [], "DB_DESIGN_20260101_000000.md", "2026-01-02")
+    again = merge_reports(SCHEMA, merged, {}, [], "DB_DESIGN_20260102_000000.md", "2026-01-02")
+    assert _objects(again) == _objects(PREVIOUS)
+    _, findings, _ = split_report(merged, SCHEMA)
+    _, findings_again, _ = split_report(again, SCHEMA)
+    assert findings == findings_again
+
+
+def test_removed_object_drops_findings():
+    merged = merge_reports(
+        SCHEMA, PREVIOUS, {}, ["PROFILE_RESULTS"], "DB_DESIGN_20260101_000000.md", "2026-01-02"
+    )
+    assert "RUN_ID の型が不統一" not in _objects(merged)
+    assert "#### Med-1: スキーマのコメントが空" in merged
@@ -0,0 +1,109 @@
+"""
+SSEEventStream の期限（StreamDeadlines）テスト
+
+途中で止まる Agent の代わりに aiohttp のローカルサーバを立て、
+open_sse の timeout（接続・受信間隔）と期限が同じ値でも
+ServerTimeoutError ではなく truncated / expired で終わることを確認する。
+[DONE] の後に接続が閉じられなくても、残りの読み切りで止まらないことも確認する。
+
+使用方法:
+    pytest tests/azfunctions/chatdemo/test_sse_deadlines.py -v
+"""
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+# プロジェクトルートをパスに追加
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+azfunc_path = os.path.join(project_root, 'app/azfunctions/chatdemo')
+sys.path.insert(0, azfunc_path)
+
+from http_pool import get_async_session  # noqa: E402
+import snowflake_cortex_async  # noqa: E402
+from snowflake_cortex_async import AsyncCortexAgentClient, StreamDeadlines  # noqa: E402
+
+AGENT_ROUTE = "/api/v2/databases/D/schemas/S/agents/A:run"
+DELTA = b'event: response.text.delta\ndata: {"text": "partial"}\n\n'
+STALL_SEC = 2.0
+LIMIT_SEC = 0.5
+EVENTS = web.AppKey("events", int)
+
+
+async def _stalled_agent(request: web.Request) -> web.StreamResponse:
+    """events 件のイベントを送った後、応答を返さずに止まる"""
+    resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await resp.prepare(request)
+    for _ in range(request.app[EVENTS]):
+        await resp.write(DELTA)
+    await asyncio.sleep(STALL_SEC)
+    await resp.write(b"data: [DONE]\n\n")
+    return resp
+
+
+async def _done_then_stalled_agent(request: web.Request) -> web.StreamResponse:
+    """[DONE] を送った後、接続を閉じずに止まる"""
+    resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await resp.prepare(request)
+    await resp.write(DELTA + b"data: [DONE]\n\n")
+    await asyncio.sleep(STALL_SEC)
+    return resp
+
+
+async def _collect(events: int, deadlines, handler=_stalled_agent):
+    app = web.Application()
+    app[EVENTS] = events
+    app.router.add_post(AGENT_ROUTE, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        client = AsyncCortexAgentClient(f"http://127.0.0.1:{port}", "token", "D", "S", "A")
+        started = time.monotonic()
+        stream = await client.open_sse({"messages": []}, timeout=LIMIT_SEC, deadlines=deadlines)
+        try:
+            received = [ev async for ev in stream]
+        finally:
+            await stream.aclose()
+        return stream, received, time.monotonic() - started
+    finally:
+        await get_async_session().close()
+        await runner.cleanup()
+
+
+def test_idle_deadline_equal_to_timeout():
+    """受信間隔の期限と timeout が同じでも expired="idle" で打ち切る"""
+    stream, received, _ = asyncio.run(_collect(1, StreamDeadlines(idle=LIMIT_SEC)))
+    assert stream.truncated
+    assert stream.expired == "idle"
+    assert len(received) == 1
+
+
+def test_first_event_deadline_equal_to_timeout():
+    """最初のイベントまでの期限と timeout が同じでも expired="first_event" で打ち切る"""
+    stream, received, _ = asyncio.run(_collect(0, StreamDeadlines(first_event=LIMIT_SEC, idle=LIMIT_SEC)))
+    assert stream.expired == "first_event"
+    assert received == []
+
+
+def test_timeout_without_deadlines():
+    """期限が無ければ従来どおり受信間隔のタイムアウトで例外になる"""
+    with pytest.raises(aiohttp.ServerTimeoutError):
+        asyncio.run(_collect(1, None))
+
+
+def test_drain_after_done_is_bounded(monkeypatch):
+    """[DONE] 後に接続が閉じられなくても、読み切りは DRAIN_TIMEOUT_SEC で打ち切る"""
+    monkeypatch.setattr(snowflake_cortex_async, "DRAIN_TIMEOUT_SEC", 0.2)
+    stream, received, elapsed = asyncio.run(
+        _collect(0, StreamDeadlines(idle=LIMIT_SEC * 10), handler=_done_then_stalled_agent)
+    )
+    assert elapsed < STALL_SEC
+    assert not stream.truncated
+    assert len(received) == 1
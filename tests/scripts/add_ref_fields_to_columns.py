@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
-"""全カラム定義ファイルに ref_table_id, ref_column, ref_cardinality フィールドを追加"""
-from pathlib import Path
+"""全カラム定義ファイルに ref_table_id, ref_column, ref_cardinality フィールドを追加
+
+追加済みかどうかは vault_index.py のインデックス（スナップショット）で判定し、未追加のファイルだけを読む。
+"""
 import re
 
+from vault_index import VaultIndex
+
 def process_file(content: str) -> tuple[str, bool]:
     """YAMLフロントマターに ref_* フィールドを追加"""
     
@@ -41,11 +45,15 @@ def process_file(content: str) -> tuple[str, bool]:
     return new_content, True
 
 def main():
-    columns_dir = Path("docs/snowflake/chatdemo/master/columns")
+    index = VaultIndex.load()
     total_changes = 0
     files_changed = 0
     
-    for md_file in sorted(columns_dir.glob("*.md")):
+    for column in index.of_kind("columns"):
+        # 既に ref_table_id がある場合は読まずにスキップ
+        if "ref_table_id" in column.frontmatter:
+            continue
+        md_file = index.master_dir / column.path
         content = md_file.read_text(encoding="utf-8")
         new_content, changed = process_file(content)
         
@@ -3,67 +3,76 @@
 
 使用方法:
     python tests/scripts/analyze_reviews.py
+    python tests/scripts/analyze_reviews.py --group-by object
+    python tests/scripts/analyze_reviews.py --trend --by schema --format csv --output trend.csv
 
 出力:
     レビュー総数、優先度別指摘数、平均指摘数等の統計情報
+    --group-by: schema / object / week ごとの優先度別指摘数
+    --trend: 週ごとの指摘数の推移（--by で schema / object 単位にも分ける）
+
+集計は reviews/schemas/index.jsonl（review_store.py が保存時に追記する指摘数）から行う。
+インデックスに無い Markdown は初回実行時に1回だけ読んでインデックスに追加する。
+--group-by / --trend は review_analytics.py で指摘（優先度・タイトル・対象オブジェクト）を集計する
+（解析結果は reviews/schemas/.review_analytics_cache.json にキャッシュし、変更されたファイルだけ解析し直す）。
 """
+import argparse
 from pathlib import Path
-import re
+import sys
 from datetime import datetime
 
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "app/azfunctions/chatdemo"))
+
+from review_analytics import GROUP_BY, ReviewAnalytics, to_csv, to_json
+from review_store import SEVERITIES, ReviewStore
+
 
 def analyze_reviews(review_dir: Path):
-    """レビュー結果を集計して統計情報を出力"""
+    """レビュー結果を集計して統計情報を出力（index.jsonl の件数を使い、Markdown は読まない）"""
+    store = ReviewStore(review_dir)
+    # インデックス未登録のファイル（インデックス導入前のレビュー等）だけを読んで追加
+    added = store.backfill()
+    if added:
+        print(f"Indexed {added} review file(s) into {store.index_path.name}")
+    
     metrics = {
         'total_reviews': 0,
         'critical_count': 0,
         'high_count': 0,
         'med_count': 0,
         'low_count': 0,
+        'unique_contents': set(),
         'reviews': []
     }
     
-    for md_file in sorted(review_dir.glob("*.md")):
-        content = md_file.read_text(encoding="utf-8")
-        
-        # ファイル名から日時を抽出
-        # 例: DB_DESIGN_20260102_092948.md
-        match = re.search(r'(\w+)_(\d{8})_(\d{6})\.md', md_file.name)
-        if not match:
-            print(f"Warning: Skipping {md_file.name} (invalid format)")
-            continue
-        
-        schema, date_str, time_str = match.groups()
-        review_date = datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H%M%S")
-        
-        # 優先度別カウント
-        # 例: #### Critical-1: タイトル
-        critical = len(re.findall(r'^#### Critical-', content, re.M))
-        high = len(re.findall(r'^#### High-', content, re.M))
-        med = len(re.findall(r'^#### Med-', content, re.M))
-        low = len(re.findall(r'^#### Low-', content, re.M))
-        
+    for record in store.records():
+        severity = record.severity
         metrics['total_reviews'] += 1
-        metrics['critical_count'] += critical
-        metrics['high_count'] += high
-        metrics['med_count'] += med
-        metrics['low_count'] += low
+        metrics['critical_count'] += severity['critical']
+        metrics['high_count'] += severity['high']
+        metrics['med_count'] += severity['med']
+        metrics['low_count'] += severity['low']
+        metrics['unique_contents'].add(record.content_hash)
         
+        target = f"{record.schema}.{record.object}" if record.object else record.schema
         metrics['reviews'].append({
-            'schema': schema,
-            'date': review_date,
-            'critical': critical,
-            'high': high,
-            'med': med,
-            'low': low,
-            'total': critical + high + med + low
+            'schema': target,
+            'date': datetime.fromisoformat(record.reviewed_at),
+            'critical': severity['critical'],
+            'high': severity['high'],
+            'med': severity['med'],
+            'low': severity['low'],
+            'total': record.total,
+            'duplicate': record.duplicate
         })
+    metrics['reviews'].sort(key=lambda r: r['date'])
     
     # サマリ出力
     print("=" * 60)
     print("DB Design Review Metrics")
     print("=" * 60)
     print(f"Total Reviews: {metrics['total_reviews']}")
+    print(f"Unique Contents: {len(metrics['unique_contents'])}")
     print(f"\nIssues by Priority:")
     print(f"  Critical: {metrics['critical_count']}")
     print(f"  High:     {metrics['high_count']}")
@@ -85,11 +94,48 @@ def analyze_reviews(review_dir: Path):
             date_str = review['date'].strftime('%Y-%m-%d %H:%M')
             print(f"{date_str} | {review['schema']:15} | "
                   f"C:{review['critical']} H:{review['high']} M:{review['med']} L:{review['low']} | "
-                  f"Total: {review['total']}")
+                  f"Total: {review['total']}"
+                  f"{' (unchanged)' if review['duplicate'] else ''}")
+
+
+def report_findings(review_dir: Path, group_by: str = None, trend: bool = False, by: str = None,
+                    fmt: str = "table", output: str = None):
+    """指摘の集計（--group-by / --trend）を表・CSV・JSONで出力"""
+    analytics = ReviewAnalytics(review_dir)
+    parsed, reused = analytics.refresh()
+    print(f"Parsed {parsed} file(s), {reused} from cache", file=sys.stderr)
+    
+    rows = analytics.trend(by) if trend else analytics.group(group_by)
+    if fmt == "csv":
+        text = to_csv(rows)
+    elif fmt == "json":
+        text = to_json(rows) + "\n"
+    else:
+        key_cols = ["week"] + ([by] if by else []) if trend else ["key"]
+        lines = []
+        for row in rows:
+            key = " | ".join(f"{row[c]:15}" for c in key_cols)
+            counts = " ".join(f"{s[0].upper()}:{row[s]}" for s in SEVERITIES)
+            lines.append(f"{key} | reviews:{row['reviews']:3} | {counts} | Total: {row['total']}")
+        text = "\n".join(lines) + "\n"
+    
+    if output:
+        Path(output).write_text(text, encoding="utf-8")
+        print(f"Wrote {len(rows)} row(s) to {output}", file=sys.stderr)
+    else:
+        print(text, end="")
 
 
 def main():
     """メインエントリポイント"""
+    parser = argparse.ArgumentParser(description="DB設計レビュー結果の集計")
+    parser.add_argument("--group-by", choices=GROUP_BY, help="指摘数を schema / object / week ごとに集計")
+    parser.add_argument("--trend", action="store_true", help="週ごとの指摘数の推移")
+    parser.add_argument("--by", choices=("schema", "object"), help="--trend を schema / object 単位にも分ける")
+    parser.add_argument("--format", choices=("table", "csv", "json"), default="table", help="出力形式（既定: table）")
+    parser.add_argument("--output", help="出力先ファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    
     review_dir = Path("docs/snowflake/chatdemo/reviews/schemas")
     
     if not review_dir.exists():
@@ -100,12 +146,14 @@ def main():
         print("  python tests/scripts/analyze_reviews.py")
         return 1
     
-    md_files = list(review_dir.glob("*.md"))
-    if not md_files:
+    if not any(review_dir.glob("*.md")):
         print(f"No review files found in {review_dir}")
         return 0
     
-    analyze_reviews(review_dir)
+    if args.group_by or args.trend:
+        report_findings(review_dir, args.group_by, args.trend, args.by, args.format, args.output)
+    else:
+        analyze_reviews(review_dir)
     return 0
 
 
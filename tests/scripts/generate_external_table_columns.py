@@ -1,26 +1,26 @@
 #!/usr/bin/env python3
-"""外部テーブル用のカラム定義を内部テーブルから生成"""
-from pathlib import Path
+"""外部テーブル用のカラム定義を内部テーブルから生成
+
+カラム定義の frontmatter は vault_index.py のインデックス（スナップショット）から取得する。
+"""
+from typing import Optional
+
 import yaml
 
-def generate_columns_for_external_table(internal_table_id: str, external_table_id: str, prefix: str):
+from vault_index import VaultIndex
+
+def generate_columns_for_external_table(internal_table_id: str, external_table_id: str, prefix: str,
+                                        index: Optional[VaultIndex] = None):
     """内部テーブルのカラム定義から外部テーブル用のカラム定義を生成"""
-    master_columns = Path("docs/snowflake/chatdemo/master/columns")
+    index = index or VaultIndex.load()
+    master_columns = index.master_dir / "columns"
     
-    # 内部テーブルのカラム定義を取得
-    internal_columns = []
-    for md_file in master_columns.glob(f"{prefix}.*.md"):
-        content = md_file.read_text(encoding="utf-8")
-        if content.startswith("---"):
-            parts = content.split("---", 2)
-            if len(parts) >= 3:
-                fm = yaml.safe_load(parts[1])
-                if fm.get("type") == "column" and fm.get("table_id") == internal_table_id:
-                    internal_columns.append({
-                        "file": md_file,
-                        "frontmatter": fm,
-                        "body": parts[2] if len(parts) > 2 else ""
-                    })
+    # 内部テーブルのカラム定義を取得（frontmatter はインデックスから。ファイルは読み直さない）
+    internal_columns = [
+        {"file": master_columns / f"{col.name}.md", "frontmatter": col.frontmatter}
+        for col in index.columns_of(internal_table_id)
+        if col.name.startswith(f"{prefix}.") and col.frontmatter.get("type") == "column"
+    ]
     
     # 外部テーブル用のカラム定義を生成
     created_files = []
@@ -61,13 +61,15 @@ def generate_columns_for_external_table(internal_table_id: str, external_table_i
 
 def main():
     print("=== 外部テーブルカラム定義生成 ===\n")
+    index = VaultIndex.load()
     
     # PROFILE_RUNS_EXTERNAL
     print("1. PROFILE_RUNS_EXTERNAL のカラム定義生成:")
     files1 = generate_columns_for_external_table(
         internal_table_id="TBL_20251226180943",
         external_table_id="TBL_20260102230002",
-        prefix="DB_DESIGN.PROFILE_RUNS"
+        prefix="DB_DESIGN.PROFILE_RUNS",
+        index=index
     )
     for f in files1:
         print(f"  ✓ {f}")
@@ -79,7 +81,8 @@ def main():
     files2 = generate_columns_for_external_table(
         internal_table_id="TBL_20251226182257",
         external_table_id="TBL_20260102230001",
-        prefix="DB_DESIGN.PROFILE_RESULTS"
+        prefix="DB_DESIGN.PROFILE_RESULTS",
+        index=index
     )
     for f in files2:
         print(f"  ✓ {f}")
@@ -9,7 +9,7 @@ from pathlib import Path
 import os
 import sys
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "app/azfunctions/chatdemo"))
-from s3_upload import upload_file_to_s3
+from s3_upload import upload_bytes
 
 # --- 設定 ---
 BUCKET = "135365622922-snowflake-chatdemo-vault-prod"
@@ -39,7 +39,7 @@ year = timestamp.year
 month = timestamp.month
 day = timestamp.day
 hour = timestamp.hour
-# --- JSON Linesファイル生成 ---
+# --- JSON Lines生成 ---
 log_obj = {
     "conversation_id": conversation_id,
     "session_id": session_id,
@@ -55,18 +55,14 @@ log_obj = {
     "hour": hour
 }
 
-log_dir = Path("tmp/cortex_conversations")
-log_dir.mkdir(parents=True, exist_ok=True)
 file_name = f"{conversation_id}_{timestamp.strftime('%Y%m%dT%H%M%S')}.jsonl"
-file_path = log_dir / file_name
-with open(file_path, "w", encoding="utf-8") as f:
-    f.write(json.dumps(log_obj, ensure_ascii=False) + "\n")
+body = (json.dumps(log_obj, ensure_ascii=False) + "\n").encode("utf-8")
 
 # --- S3パス構築 ---
 s3_key = f"{S3_BASE}/year={year}/month={month:02d}/day={day:02d}/hour={hour:02d}/{file_name}"
 
 # --- S3アップロード ---
-if upload_file_to_s3(str(file_path), BUCKET, s3_key, content_type="application/json"):
+if upload_bytes(body, BUCKET, s3_key, content_type="application/json"):
     print(f"アップロード完了: s3://{BUCKET}/{s3_key}")
 else:
     print("アップロード失敗")
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Vault（docs/snowflake/chatdemo/master）の frontmatter インデックス
+
+使用方法:
+    python3 tests/scripts/vault_index.py            # 種類別の件数と読み込み時間を表示
+    python3 tests/scripts/vault_index.py --rebuild  # スナップショットを使わずに作り直す
+
+スクリプトからの利用:
+    from vault_index import VaultIndex
+
+    index = VaultIndex.load()
+    table = index.get("TBL_20251226180943")          # table_id / column_id / schema_id 等で引く
+    columns = index.columns_of(table.id)             # テーブルのカラム（ファイル名順）
+    entry = index.by_name("DB_DESIGN.PROFILE_RUNS")  # ファイル名（SCHEMA.OBJECT[.COLUMN]）で引く
+    entries = index.find("RUN_ID", kind="columns")   # physical で引く（スキーマをまたいで複数あり得る）
+
+処理内容:
+    - master/{schemas,tables,columns,views,externaltables,semanticviews,other} の frontmatter を読み、
+      ID（schema_id / table_id / column_id / view_id / externaltable_id / semantic_view_id）・ファイル名・physical で引けるようにする
+    - 解析結果はスナップショット（docs/snowflake/chatdemo/.vault_index.pickle、git 管理外）に保存し、
+      次回からは mtime・サイズが変わったファイルだけを解析し直す
+"""
+import argparse
+import logging
+import os
+import pickle
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+VAULT_DIR = Path(__file__).resolve().parent.parent.parent / "docs" / "snowflake" / "chatdemo"
+SNAPSHOT_FILE = ".vault_index.pickle"
+SNAPSHOT_VERSION = 1
+
+MASTER_DIRS = ("schemas", "tables", "columns", "views", "externaltables", "semanticviews", "other")
+
+# 種類（master/ のディレクトリ）ごとの ID 項目（外部テーブルは externaltable_id のファイルもある）
+ID_FIELDS = {
+    "schemas": ("schema_id",),
+    "tables": ("table_id",),
+    "columns": ("column_id",),
+    "views": ("view_id",),
+    "externaltables": ("table_id", "externaltable_id"),
+    "semanticviews": ("semantic_view_id",),
+}
+
+# C 実装があれば使う（PyYAML の純 Python 版より数倍速い）
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_KEY_LINE = re.compile(r"^([A-Za-z_][\w-]*):(?:\s+(.*))?$")
+_LIST_ITEM = re.compile(r"^\s+-\s+(.*)$")
+
+
+def _scalar(value: str) -> Any:
+    """true / 数値等は YAML と同じ型にし、それ以外（": " を含む文字列等）はそのままの文字列とする"""
+    try:
+        parsed = yaml.load(value, Loader=_Loader)
+    except yaml.YAMLError:
+        return value
+    return value if isinstance(parsed, (dict, list)) else parsed
+
+
+def _parse_flat(text: str) -> Dict[str, Any]:
+    """
+    YAML として読めない frontmatter を1行1項目（key: value と "  - item" のリスト）として読む
+
+    comment に ": " を含む等、Obsidian では表示できても YAML としては不正なファイルがあるため。
+    """
+    fm: Dict[str, Any] = {}
+    key = None
+    for line in text.splitlines():
+        m = _KEY_LINE.match(line)
+        if m:
+            key = m.group(1)
+            fm[key] = _scalar(m.group(2)) if m.group(2) else None
+            continue
+        m = _LIST_ITEM.match(line)
+        if m and key:
+            if not isinstance(fm[key], list):
+                fm[key] = []
+            fm[key].append(_scalar(m.group(1)))
+    return fm
+
+
+def parse_frontmatter(content: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    先頭の frontmatter を辞書にする（YAML として不正なら1行1項目として読む）
+
+    Returns:
+        (frontmatter, 本文)。frontmatter が無ければ (None, 全文)
+    """
+    if not content.startswith("---"):
+        return None, content
+    parts = content.split("---", 2)
+    if len(parts) < 3:
+        return None, content
+    try:
+        fm = yaml.load(parts[1], Loader=_Loader)
+    except yaml.YAMLError:
+        fm = _parse_flat(parts[1])
+    return (fm if isinstance(fm, dict) else {}), parts[2]
+
+
+class VaultEntry(NamedTuple):
+    """master/ のファイル1つ分"""
+    kind: str
+    name: str
+    frontmatter: Dict[str, Any]
+    mtime_ns: int
+    size: int
+
+    @property
+    def id(self) -> Optional[str]:
+        return next((self.frontmatter[f] for f in ID_FIELDS.get(self.kind, ()) if self.frontmatter.get(f)), None)
+
+    @property
+    def physical(self) -> Optional[str]:
+        return self.frontmatter.get("physical")
+
+    @property
+    def schema(self) -> str:
+        """ファイル名のスキーマ部分"""
+        return self.name.split(".", 1)[0]
+
+    @property
+    def path(self) -> Path:
+        """master/ からの相対パス"""
+        return Path(self.kind) / f"{self.name}.md"
+
+
+class VaultIndex:
+    """
+    master/ の frontmatter インデックス
+
+    Args:
+        vault_dir: Vault のディレクトリ（master/ の親）
+        snapshot_path: スナップショット（既定: vault_dir/.vault_index.pickle）
+    """
+
+    def __init__(self, vault_dir: Path = VAULT_DIR, snapshot_path: Optional[Path] = None):
+        self.vault_dir = Path(vault_dir)
+        self.master_dir = self.vault_dir / "master"
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else self.vault_dir / SNAPSHOT_FILE
+        self.entries: List[VaultEntry] = []
+        self._by_id: Dict[str, VaultEntry] = {}
+        self._by_name: Dict[str, VaultEntry] = {}
+        self._by_physical: Dict[str, List[VaultEntry]] = {}
+        self._columns: Dict[str, List[VaultEntry]] = {}
+
+    @classmethod
+    def load(cls, vault_dir: Path = VAULT_DIR, snapshot_path: Optional[Path] = None) -> "VaultIndex":
+        index = cls(vault_dir, snapshot_path)
+        index.refresh()
+        return index
+
+    def refresh(self, rebuild: bool = False) -> Tuple[int, int]:
+        """
+        スナップショットを読み、追加・変更されたファイルだけを解析し直す（変化があればスナップショットを書き戻す）
+
+        Args:
+            rebuild: スナップショットを使わずに全ファイルを解析する
+
+        Returns:
+            (解析したファイル数, スナップショットを使ったファイル数)
+        """
+        cached = {} if rebuild else self._load_snapshot()
+        entries: List[VaultEntry] = []
+        parsed = reused = 0
+        for kind in MASTER_DIRS:
+            try:
+                files = sorted(
+                    (e for e in os.scandir(self.master_dir / kind) if e.name.endswith(".md") and e.is_file()),
+                    key=lambda e: e.name,
+                )
+            except FileNotFoundError:
+                continue
+            for f in files:
+                st = f.stat()
+                entry = cached.get(f"{kind}/{f.name}")
+                if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                    reused += 1
+                else:
+                    entry = self._parse(kind, Path(f.path), st)
+                    parsed += 1
+                entries.append(entry)
+
+        self._build(entries)
+        if parsed or len(cached) != len(entries):
+            self._save_snapshot()
+        return parsed, reused
+
+    def get(self, object_id: str) -> Optional[VaultEntry]:
+        """schema_id / table_id / column_id / view_id / externaltable_id / semantic_view_id で引く"""
+        return self._by_id.get(object_id)
+
+    def by_name(self, name: str) -> Optional[VaultEntry]:
+        """ファイル名（拡張子なし。例: DB_DESIGN.PROFILE_RUNS.RUN_ID）で引く"""
+        return self._by_name.get(name.upper())
+
+    def find(self, physical: str, kind: Optional[str] = None) -> List[VaultEntry]:
+        """physical で引く（大文字小文字は区別しない）"""
+        found = self._by_physical.get(physical.upper(), [])
+        return [e for e in found if e.kind == kind] if kind else list(found)
+
+    def of_kind(self, kind: str) -> List[VaultEntry]:
+        return [e for e in self.entries if e.kind == kind]
+
+    def columns_of(self, table_id: str) -> List[VaultEntry]:
+        """テーブル・外部テーブルのカラム（frontmatter の table_id が一致するもの、ファイル名順）"""
+        return list(self._columns.get(table_id, []))
+
+    def schema_of(self, entry: VaultEntry) -> Optional[VaultEntry]:
+        """オブジェクトのスキーマ（カラムはテーブル経由で求める）"""
+        if entry.kind == "columns":
+            table = self.get(entry.frontmatter.get("table_id"))
+            return self.schema_of(table) if table else None
+        return self.get(entry.frontmatter.get("schema_id"))
+
+    def _parse(self, kind: str, path: Path, st: os.stat_result) -> VaultEntry:
+        fm, _ = parse_frontmatter(path.read_text(encoding="utf-8"))
+        if fm is None:
+            logging.warning(f"No frontmatter: {kind}/{path.name}")
+        return VaultEntry(kind, path.name[:-3], fm or {}, st.st_mtime_ns, st.st_size)
+
+    def _build(self, entries: List[VaultEntry]) -> None:
+        self.entries = entries
+        self._by_id, self._by_name, self._by_physical, self._columns = {}, {}, {}, {}
+        for e in entries:
+            if e.id:
+                self._by_id.setdefault(e.id, e)
+            self._by_name[e.name.upper()] = e
+            if e.physical:
+                self._by_physical.setdefault(str(e.physical).upper(), []).append(e)
+            if e.kind == "columns" and e.frontmatter.get("table_id"):
+                self._columns.setdefault(e.frontmatter["table_id"], []).append(e)
+
+    def _load_snapshot(self) -> Dict[str, VaultEntry]:
+        # スナップショットはこのスクリプトが書いたローカルファイルのみを想定（pickle のため外部から受け取らないこと）
+        try:
+            with self.snapshot_path.open("rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Ignoring invalid vault snapshot {self.snapshot_path}: {e}")
+            return {}
+        if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+            return {}
+        return {f"{kind}/{name}.md": VaultEntry(kind, name, *rest) for kind, name, *rest in data["entries"]}
+
+    def _save_snapshot(self) -> None:
+        # 途中で中断しても壊れたスナップショットが残らないよう一時ファイルから置き換える
+        tmp = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(
+                {"version": SNAPSHOT_VERSION, "entries": [tuple(e) for e in self.entries]},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, self.snapshot_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vault（master/）の frontmatter インデックス")
+    parser.add_argument("--vault", type=Path, default=VAULT_DIR, help="Vault のディレクトリ")
+    parser.add_argument("--rebuild", action="store_true", help="スナップショットを使わずに作り直す")
+    args = parser.parse_args()
+
+    index = VaultIndex(args.vault)
+    started = time.perf_counter()
+    parsed, reused = index.refresh(rebuild=args.rebuild)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    for kind in MASTER_DIRS:
+        print(f"{kind:15s} {len(index.of_kind(kind)):4d}")
+    print(f"\n合計: {len(index.entries)} ファイル（解析 {parsed} / スナップショット {reused}）{elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()